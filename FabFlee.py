@@ -20,9 +20,14 @@ except ImportError:
 import glob
 import csv
 import os
-import numpy as np
-import pandas as pd
 from shutil import copyfile, rmtree, move
+
+from .scripts.lazy_import import lazy_import
+
+# numpy and pandas are only imported by the tasks that use them.
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
 # Add local script, blackbox and template path.
 add_local_paths("FabFlee")
 
@@ -98,10 +103,17 @@ def flees(config, simulation_period, **args):
 
 @task
 @load_plugin_env_vars("FabFlee")
-def flee_ensemble(config, simulation_period, script='flee', label="", **args):
+def flee_ensemble(config, simulation_period, script='flee', label="",
+                  batched="False", **args):
     """
     Submits an ensemble of dummy jobs.
     One job is run for each file in <config_file_directory>/flee_test/SWEEP.
+    Keyword arguments:
+            batched : if True, run all SWEEP members on localhost in a
+                      persistent pool of worker processes, instead of
+                      launching one job per member.
+            batch_workers : number of worker processes in batched mode,
+                            defaults to the number of local CPUs.
     """
     update_environment(args)
     with_config(config)
@@ -120,9 +132,70 @@ def flee_ensemble(config, simulation_period, script='flee', label="", **args):
         print("adding label: ", label)
         env.job_name_template += "_{}".format(label)
 
+    if str(batched).lower() == "true":
+        run_ensemble_batched(config, sweep_dir, **args)
+        return
+
     run_ensemble(config, sweep_dir, **args)
 
 
+def run_ensemble_batched(config, sweep_dir, **args):
+    """
+    Run all SWEEP members of an ensemble on localhost in a persistent pool of
+    worker processes. flee is imported, and the shared input_csv and
+    source_data files are parsed, once per worker rather than once per member.
+    The results are stored in the same RUNS layout as run_ensemble produces.
+    """
+    update_environment(args)
+    if env.host != "localhost":
+        raise RuntimeError(
+            "batched ensembles can only be executed on localhost, "
+            "not on {}".format(env.host)
+        )
+
+    env.job_name = template(env.job_name_template)
+    runs_dir = os.path.join(env.local_results, env.job_name, "RUNS")
+    if os.path.exists(runs_dir):
+        if getattr(env, "prevent_results_overwrite", "") != "delete":
+            raise RuntimeError(
+                "results directory {} already exists".format(runs_dir)
+            )
+        rmtree(runs_dir)
+
+    workers = int(getattr(env, "batch_workers", 0))
+    if workers < 1:
+        workers = os.cpu_count()
+
+    # each member runs in a single worker process, i.e. on one MPI rank
+    if env.script == "pflee":
+        if int(getattr(env, "cores", 1)) > 1:
+            raise RuntimeError(
+                "batched ensembles run each pflee member on a single rank, "
+                "use cores=1 or batched=False to run them on {} cores".format(
+                    env.cores)
+            )
+        run_script = "{}/runscripts/run_par.py".format(env.flee_location)
+    else:
+        run_script = "{}/runscripts/run.py".format(env.flee_location)
+
+    from .scripts.run_flee_batch import prepare_run_dirs, run_flee_batch
+
+    run_dirs = prepare_run_dirs(
+        config_dir=env.job_config_path_local,
+        sweep_dir=sweep_dir,
+        runs_dir=runs_dir
+    )
+    run_flee_batch(
+        flee_location=env.flee_location,
+        run_script=run_script,
+        run_dirs=run_dirs,
+        simulation_period=env.simulation_period,
+        workers=workers,
+        uncertainty=str(
+            getattr(env, "UNHCR_uncertainty", False)).lower() == "true"
+    )
+
+
 def load_module_from_path(moduleName, PATH_to_module):
     import importlib
 
@@ -192,18 +265,63 @@ def flare_local(config, simulation_period, out_dir="", file_suffix=""):
 
 @task
 @load_plugin_env_vars("FabFlee")
-def flare_ensemble(config, simulation_period, N, out_dir, file_suffix=""):
+def flare_ensemble(config, simulation_period, N, out_dir, file_suffix="",
+                   workers=None, seed=None, out_format="csv"):
     """
     Run an ensemble of flare instances locally.
     config: configuration directory.
     simulation_period: simulation period in days.
     N: number of instances in ensemble.
     out_dir: base output subdirectory in flare-results.
+    workers: number of worker processes, defaults to env.flare_workers or,
+             if that is not set, to the number of local CPUs.
+    seed: base seed of the ensemble, from which each instance gets its
+          own seed.
+    out_format: csv, or npz / intervals for the compact conflict
+                progression formats of scripts/conflict_format.py, which
+                couple_flare_to_flee converts back to csv.
+
+    The geography is read once per worker, and instance i is written to
+    results-flare/<out_dir>/<i>/input_csv, i.e. the SWEEP layout used by
+    couple_flare_to_flee.
     """
-    for i in range(0, int(N)):
-        instance_out_dir = "%s/%s" % (out_dir, i)
-        flare_local(config, simulation_period,
-                    instance_out_dir, file_suffix=file_suffix)
+    load_module_from_path(
+        moduleName="flare", PATH_to_module=env.flare_location
+    )
+    load_module_from_path(
+        moduleName="flee", PATH_to_module=env.flee_location
+    )
+
+    if workers is None:
+        workers = getattr(env, "flare_workers", 0)
+    workers = int(workers)
+    if workers < 1:
+        workers = os.cpu_count()
+    workers = min(workers, int(N))
+
+    if seed is not None:
+        seed = int(seed)
+
+    flare_out_dir = "{}/results-flare/{}".format(
+        get_plugin_path("FabFlee"), out_dir
+    )
+    config_dir = "{}/config_files/{}".format(
+        get_plugin_path("FabFlee"), config
+    )
+
+    from .scripts.run_flare import run_flare_ensemble
+
+    run_flare_ensemble(
+        config_dir="{}/input_csv".format(config_dir),
+        out_dir=flare_out_dir,
+        N=int(N),
+        simulation_period=int(simulation_period),
+        file_suffix=file_suffix,
+        workers=workers,
+        seed=seed,
+        module_paths=[env.flare_location, env.flee_location],
+        out_format=out_format
+    )
 
 
 @task
@@ -220,6 +338,9 @@ def couple_flare_to_flee(config, flare_out="flare-out-scratch"):
     local("cp -r %s/results-flare/%s/* %s/SWEEP/"
           % (get_plugin_path("FabFlee"), flare_out, config_dir))
 
+    from .scripts.conflict_format import expand_conflicts
+    expand_conflicts("%s/SWEEP" % (config_dir))
+
 
 @task
 @load_plugin_env_vars("FabFlee")
@@ -435,11 +556,45 @@ def plot_forecast(output_dir="", region_names=""):
     )
 
 
+def cflee_cores(config, instance_cores, macro_cores="", micro_cores="",
+                balance_from=""):
+    """
+    Return the number of cores of each macro and of each micro instance of a
+    cflee job: macro_cores and micro_cores, or instance_cores if they are not
+    set. With balance_from, the results directory of a previous run of the
+    config, their sum is split again over the two submodels, such that their
+    step times in that run would have been balanced.
+    """
+    macro_cores = int(macro_cores) if macro_cores else int(instance_cores)
+    micro_cores = int(micro_cores) if micro_cores else int(instance_cores)
+    if len(balance_from) == 0:
+        return macro_cores, micro_cores
+
+    # the planner is shipped with the multiscale configs, as PJ.py uses it
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "resource_planner",
+        os.path.join(find_config_file_path(config), "resource_planner.py")
+    )
+    resource_planner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(resource_planner)
+
+    plan = resource_planner.plan_cores(
+        resource_planner.load_step_times(
+            os.path.join(env.local_results, balance_from)),
+        macro_cores + micro_cores
+    )
+    print("resource plan from {}: {}".format(balance_from, plan))
+    return plan["macro_cores"], plan["micro_cores"]
+
+
 @task
 @load_plugin_env_vars("FabFlee")
 def cflee(config, coupling_type="file", weather_coupling="False",
           num_instances="1", instance_cores="1",
-          job_wall_time="00:12:00", ** args):
+          job_wall_time="00:12:00", output_flush_interval="100",
+          pipelined_coupling="False", macro_cores="", micro_cores="",
+          balance_from="", calibration_days="0", ** args):
     """ Submit a cflee (coupling flee) job to the remote queue.
     The job results will be stored with a name pattern as defined
     Required Keyword arguments:
@@ -447,9 +602,27 @@ def cflee(config, coupling_type="file", weather_coupling="False",
             config directory to use for the simulation script,
             e.g. config=mscalecity
         coupling_type :
-            the coupling model, currently two models are implemented :
-            (1) file couping, and (2) muscle3
-            acceptable input set : file / muscle3
+            the coupling model, currently three models are implemented :
+            (1) file couping, (2) muscle3, and (3) shm, i.e. shared memory
+            coupling of macro and micro instances on the same node
+            acceptable input set : file / muscle3 / shm
+        output_flush_interval :
+            number of simulated days between two writes of the out.csv file
+            of each macro/micro instance, which is only written by rank 0
+        pipelined_coupling :
+            for the file and shm coupling, apply the data of the other
+            submodel with a lag of one day, so that the macro and micro
+            steps overlap instead of waiting for each other
+        macro_cores, micro_cores :
+            cores of each macro and micro instance, instance_cores by default
+        balance_from :
+            results directory of a previous run of the config, whose step
+            times are used to split macro_cores + micro_cores over the two
+            submodels, such that they do not wait for each other
+        calibration_days :
+            for the file and shm coupling, number of simulated days of a
+            calibration run of all instances, after which PJ.py splits the
+            cores in the same way. The job keeps the same number of cores.
     Example:
         fabsim eagle_hidalgo cflee:ssudan-mscale-test,coupling_type=file,
         weather_coupling=False,num_instances=2,instance_cores=2,TestOnly=True
@@ -460,18 +633,36 @@ def cflee(config, coupling_type="file", weather_coupling="False",
         fabsim eagle_hidalgo cflee:ssudan-mscale-test,coupling_type=file,
         weather_coupling=True,num_instances=10,instance_cores=4
 
+        fabsim localhost cflee:ssudan-mscale-test,coupling_type=shm,
+        weather_coupling=False,num_instances=2,instance_cores=1
+
+        fabsim eagle_hidalgo cflee:ssudan-mscale-test,coupling_type=file,
+        weather_coupling=True,num_instances=10,instance_cores=4,
+        balance_from=ssudan-mscale-test_eagle_hidalgo_80
+
     """
+    macro_cores, micro_cores = cflee_cores(
+        config, instance_cores, macro_cores, micro_cores, balance_from)
     update_environment(args, {"coupling_type": coupling_type.lower(),
                               "weather_coupling": weather_coupling.lower(),
                               "num_instances": num_instances,
                               "instance_cores": instance_cores,
-                              "job_wall_time": job_wall_time
+                              "macro_cores": macro_cores,
+                              "micro_cores": micro_cores,
+                              "calibration_days": calibration_days,
+                              "job_wall_time": job_wall_time,
+                              "output_flush_interval": output_flush_interval,
+                              "pipelined_coupling": pipelined_coupling.lower()
                               }
                        )
 
-    env.cores = int(num_instances) * int(instance_cores) * 2
+    # the calibration of PJ.py only moves cores between the macro and micro
+    # instances of a pair
+    env.cores = int(num_instances) * (macro_cores + micro_cores)
     env.py_pkg = ["qcg-pilotjob", "pandas", "seaborn", "matplotlib", "jinja2"]
-    if coupling_type == "file":
+    if coupling_type in ["file", "shm"]:
+        # the shm coupling is also launched by PJ.py, and needs all macro
+        # and micro instances to run on a single node
         script = "flee_file_coupling"
     elif coupling_type == "muscle3":
         env.cores += 2
@@ -492,7 +683,9 @@ def cflee(config, coupling_type="file", weather_coupling="False",
 def cflee_ensemble(config, coupling_type="file", weather_coupling="False",
                    num_workers="1", worker_cores="1",
                    N="1", simulation_period="425",
-                   job_wall_time="00:12:00", ** args):
+                   job_wall_time="00:12:00", output_flush_interval="100",
+                   pipelined_coupling="False", macro_cores="", micro_cores="",
+                   balance_from="", calibration_days="0", ** args):
     """
     Example:
         fab eagle_vecma cflee_ensemble:mscalecity,coupling_type=file,
@@ -501,19 +694,29 @@ def cflee_ensemble(config, coupling_type="file", weather_coupling="False",
         fab eagle_vecma cflee_ensemble:mscalecity,coupling_type=file,
         weather_coupling=True,num_workers=10,worker_cores=4,N=3
     """
+    macro_cores, micro_cores = cflee_cores(
+        config, worker_cores, macro_cores, micro_cores, balance_from)
     update_environment(args, {"coupling_type": coupling_type,
                               "weather_coupling": weather_coupling.lower(),
                               "num_workers": num_workers,
                               "worker_cores": worker_cores,
+                              "macro_cores": macro_cores,
+                              "micro_cores": micro_cores,
+                              "calibration_days": calibration_days,
                               "job_wall_time": job_wall_time,
-                              "simulation_period": simulation_period
+                              "simulation_period": simulation_period,
+                              "output_flush_interval": output_flush_interval,
+                              "pipelined_coupling": pipelined_coupling.lower()
                               }
                        )
-    env.cores = int(num_workers) * int(worker_cores) * 2
+    env.cores = int(num_workers) * (macro_cores + micro_cores)
 
     if coupling_type == 'file':
         script = 'flee_file_coupling'
         label = 'file_coupling'
+    elif coupling_type == 'shm':
+        script = 'flee_file_coupling'
+        label = 'shm_coupling'
     elif coupling_type == 'muscle3':
         script = 'flee_muscle3_coupling'
         label = 'muscle3_coupling'
@@ -590,26 +793,18 @@ def plot_uq_output(output_dir="", graphs_dir=""):
 
 def vvp_validate_results(output_dir="", **kwargs):
     """ Extract validation results (no dependencies on FabSim env). """
+    from .scripts.flee_validation import score_run
 
-    flee_location_local = user_config["localhost"].get(
-        "flee_location", user_config["default"].get("flee_location"))
-
-    local("export PYTHONPATH=%s:${PYTHONPATH}; export FLEE_TYPE_CHECK=False; python3 %s/flee/postprocessing/extract-validation-results.py %s "
-          "> %s/validation_results.yml"
-          % (flee_location_local, flee_location_local, output_dir, output_dir))
-
-    with open("{}/validation_results.yml".format(output_dir), 'r') as val_yaml:
-        validation_results = yaml.load(val_yaml, Loader=yaml.SafeLoader)
-
-        # TODO: make a proper validation metric using a validation schema.
-        # print(validation_results["totals"]["Error (rescaled)"])
-        print("Validation {}: {}".format(output_dir.split("/")[-1],
-                                         validation_results["totals"][
-                                         "Error (rescaled)"]))
-        return validation_results["totals"]["Error (rescaled)"]
+    try:
+        _, error_rescaled = score_run(output_dir)
+    except Exception as exception:
+        print("error: vvp_validate_results failed on {}: {}".format(
+            output_dir, exception))
+        return -1.0
 
-    print("error: vvp_validate_results failed on {}".format(output_dir))
-    return -1.0
+    print("Validation {}: {}".format(output_dir.split("/")[-1],
+                                     error_rescaled))
+    return error_rescaled
 
 
 @task
@@ -746,14 +941,36 @@ def make_vvp_mean(np_array, **kwargs):
 
 @task
 @load_plugin_env_vars("FabFlee")
-def validate_flee_output(results_dir):
+def validate_flee_output(results_dir, workers=0):
     """
     Goes through all the output directories and calculates the validation
-    scores.
+    scores. The runs are scored in a pool of worker processes (by default one
+    per local CPU), and the scores of all runs are stored in
+    <results_dir>/validation_results.csv.
     """
-    vvp.ensemble_vvp("{}/{}/RUNS".format(env.local_results, results_dir),
-                     vvp_validate_results,
-                     make_vvp_mean)
+    from .scripts.flee_validation import score_ensemble
+
+    workers = int(workers)
+    if workers < 1:
+        workers = os.cpu_count()
+
+    results = score_ensemble(
+        runs_dir="{}/{}/RUNS".format(env.local_results, results_dir),
+        workers=workers,
+        out_file="{}/{}/validation_results.csv".format(
+            env.local_results, results_dir)
+    )
+
+    scores = []
+    for run_name, score in results.items():
+        if score is None:
+            print("error: vvp_validate_results failed on {}".format(run_name))
+            scores.append(-1.0)
+            continue
+        print("Validation {}: {}".format(run_name, score[1]))
+        scores.append(score[1])
+
+    return make_vvp_mean(np.array(scores))
 
 
 @task
@@ -836,7 +1053,8 @@ def new_conflict(config, **args):
 # Syntax: fabsim localhost
 # process_acled:country,start_date=dd-mm-yyyy,filter=[earliest,fatalities]
 @task
-def process_acled(country, start_date, filter_opt, admin_level):
+def process_acled(country, start_date, filter_opt, admin_level,
+                  cache="False"):
     """
     Process .csv files sourced from acleddata.com to a <locations.csv> format
     Syntax:
@@ -848,6 +1066,8 @@ def process_acled(country, start_date, filter_opt, admin_level):
         fatalities keeps admin2 with the highest fatalities.
         admin_level: is how high the admin level you want to apply the
         filter_opt to i.e location, admin2, admin1
+        cache: if True, keep the parsed events in acled.parquet, which
+        is read instead of acled.csv on repeat runs (requires pyarrow).
     """
     from .scripts.acled2locations import acled2locations
 
@@ -855,8 +1075,9 @@ def process_acled(country, start_date, filter_opt, admin_level):
         fab_flee_loc=get_plugin_path("FabFlee"),
         country=country,
         start_date=start_date,
-        filter=filter_opt,
-        admin_level=admin_level
+        filter_opt=filter_opt,
+        admin_level=admin_level,
+        cache=str(cache).lower() == "true"
     )
 
     # local("python3 %s/scripts/acled2locations.py %s %s %s %s %s"
@@ -871,10 +1092,17 @@ def process_acled(country, start_date, filter_opt, admin_level):
 @task
 # Syntax: fabsim localhost
 # extract_conflict_file:<country_name>,simulation_period=<number>
-def extract_conflict_file(config, simulation_period, **args):
+def extract_conflict_file(config, simulation_period="", sweep="False",
+                          **args):
     """
     Travels to the input_csv directory of a specific config and extracts
     a conflict progression CSV file from locations.csv.
+    config: a config, or several configs separated by ';'.
+    simulation_period: a period, or several periods separated by ';', in
+                       which case conflicts_<period>.csv is written for each
+                       period. Defaults to the Length in conflict_period.csv.
+    sweep: if True, the conflicts files of all SWEEP members of the configs
+           are extracted instead, e.g. for the validation config.
     """
     # config_dir = "%s/config_files/%s" % (get_plugin_path("FabFlee"), config)
     # local("python3 %s/scripts/location2conflict.py %s \
@@ -884,14 +1112,63 @@ def extract_conflict_file(config, simulation_period, **args):
     #          config_dir,
     #          config_dir))
 
+    from .scripts.location2conflict import (
+        location2conflict_batch, read_conflict_period
+    )
+
+    input_dirs = []
+    for config_name in config.split(";"):
+        config_dir = os.path.join(
+            get_plugin_path("FabFlee"), "config_files", config_name
+        )
+        if str(sweep).lower() == "true":
+            sweep_dir = os.path.join(config_dir, "SWEEP")
+            input_dirs += [
+                os.path.join(sweep_dir, member, "input_csv")
+                for member in sorted(os.listdir(sweep_dir))
+                if os.path.isdir(os.path.join(sweep_dir, member, "input_csv"))
+            ]
+        else:
+            input_dirs.append(os.path.join(config_dir, "input_csv"))
+
+    periods = [p for p in str(simulation_period).split(";") if len(p) > 0]
+
+    jobs = []
+    for input_dir in input_dirs:
+        input_file = os.path.join(input_dir, "locations.csv")
+        if len(periods) == 0:
+            jobs.append((read_conflict_period(input_dir), input_file,
+                         os.path.join(input_dir, "conflicts.csv")))
+        elif len(periods) == 1:
+            jobs.append((periods[0], input_file,
+                         os.path.join(input_dir, "conflicts.csv")))
+        else:
+            jobs += [
+                (period, input_file,
+                 os.path.join(input_dir, "conflicts_%s.csv" % (period)))
+                for period in periods
+            ]
+
+    location2conflict_batch(jobs)
+
+
+@task
+# Syntax: fabsim localhost
+# convert_conflict_file:<config_name>,input_file=<name>,output_file=<name>
+def convert_conflict_file(config, input_file="conflicts.csv",
+                          output_file="conflicts.npz"):
+    """
+    Converts a conflict progression file in the input_csv directory of a
+    config between the csv read by Flee and the compact formats, i.e. a
+    bit-packed .npz file or a <name>_intervals.csv run-length encoding.
+    """
     config_dir = os.path.join(
-        get_plugin_path("FabFlee"), "config_files", config
+        get_plugin_path("FabFlee"), "config_files", config, "input_csv"
     )
-    from .scripts.location2conflict import location2conflict
-    location2conflict(
-        simulation_period=int(simulation_period),
-        input_file=os.path.join(config_dir, "input_csv", "locations.csv"),
-        output_file=os.path.join(config_dir, "input_csv", "conflicts.csv"),
+    from .scripts.conflict_format import convert_conflicts
+    convert_conflicts(
+        os.path.join(config_dir, input_file),
+        os.path.join(config_dir, output_file)
     )
 
 
@@ -963,6 +1240,10 @@ def load_conflict(conflict_name):
         %s/conflict_data/active_conflict")
           % (get_plugin_path("FabFlee"), get_plugin_path("FabFlee")))
 
+    local(template("cp %s/config_files/run_utils.py \
+        %s/conflict_data/active_conflict")
+          % (get_plugin_path("FabFlee"), get_plugin_path("FabFlee")))
+
     with open("%s/conflict_data/active_conflict/commands.log.txt"
               % (get_plugin_path("FabFlee")), "a") as myfile:
         myfile.write("fab localhost load_conflict:%s\n" % conflict_name)
@@ -1011,6 +1292,11 @@ def instantiate(conflict_name):
         %s/config_files/%s/run_food.py")
           % (get_plugin_path("FabFlee"), get_plugin_path("FabFlee"),
              conflict_name))
+
+    local(template("cp %s/config_files/run_utils.py \
+        %s/config_files/%s/run_utils.py")
+          % (get_plugin_path("FabFlee"), get_plugin_path("FabFlee"),
+             conflict_name))
     # line added to copy run_food.py as well (otherwise executing
     # food_flee doesn't work...)
 
@@ -1022,6 +1308,22 @@ def instantiate(conflict_name):
              conflict_name))
 
 
+@task
+def sync_run_utils():     # Syntax: fab localhost sync_run_utils
+    """
+    Copy config_files/run_utils.py, the only source of the helpers of the
+    run scripts, over its copies in the config directories, which are
+    needed to run a config directly with python run.py.
+    """
+    master = os.path.join(get_plugin_path("FabFlee"), "config_files",
+                          "run_utils.py")
+    for path in glob.glob(os.path.join(get_plugin_path("FabFlee"),
+                                       "config_files", "**", "run_utils.py"),
+                          recursive=True):
+        if os.path.abspath(path) != os.path.abspath(master):
+            copyfile(master, path)
+
+
 @task
 def clear_active_conflict():     # Syntax: fab localhost clear_active_conflict
     """ Delete all content in the active conflict directory. """
@@ -1031,6 +1333,23 @@ def clear_active_conflict():     # Syntax: fab localhost clear_active_conflict
 
 
 # FabFlee refinement tasks
+def active_conflict_editor():
+    """
+    Load the csv files of the active conflict directory into a
+    ScenarioEditor.
+    """
+    from .scripts.scenario_editor import ScenarioEditor
+
+    return ScenarioEditor("%s/conflict_data/active_conflict"
+                          % (get_plugin_path("FabFlee")))
+
+
+def log_command(command):
+    with open("%s/conflict_data/active_conflict/commands.log.txt"
+              % (get_plugin_path("FabFlee")), "a") as myfile:
+        myfile.write("fab localhost %s\n" % command)
+
+
 @task
 # Syntax: fab localhost
 # change_capacities:camp_name=capacity(,camp_name2=capacity2)
@@ -1040,37 +1359,14 @@ def change_capacities(**capacities):
     """
     # Note: **capacities will be a Python dict object.
 
-    capacities_string = ""
-    for c in capacities.keys():
-        capacities_string += "%s=%s" % (c, capacities[c])
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost change_capacities:%s\n"
-                     % capacities_string)
-
-    # 1. Read in locations.csv
-    # 2. for each location in the dict, find it in the csv, and modify the
-    # population value accordingly.
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/locations.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
-
-    for camp_name in capacities.keys():
-        for i in range(1, len(lines)):
-            if lines[i][5].strip() != "camp":
-                continue
-            if lines[i][0].strip() != camp_name:
-                continue
-
-            lines[i][7] = capacities[camp_name]
+    log_command("change_capacities:%s" % ",".join(
+        "%s=%s" % (c, capacities[c]) for c in capacities.keys()))
 
-            print(lines[i])
-
-    # 3. Write the updated CSV file.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/locations.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    # for each camp in the dict, modify the population value in
+    # locations.csv accordingly.
+    editor = active_conflict_editor()
+    editor.change_capacities(**capacities)
+    editor.write()
 
 
 @task
@@ -1093,64 +1389,23 @@ def find_capacity(csv_name):
 def add_camp(camp_name, region=" ", country=" ", lat=0.0, lon=0.0):
     """ Add an additional new camp to locations.csv. """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost add_camp:%s\n" % camp_name)
-
-    # 1. Add (or make existing forwarding hub) a new camp to locations.csv
-    # If new camp, add country,lat,lon,location_type(camp)
-    # If existing camp, change location_type to camp
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/locations.csv"
-                        % (get_plugin_path("FabFlee")), "r"))
-    lines = [l for l in r]
-
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != camp_name:
-            continue
-        print("Warning: camp %s is already present in locations.csv."
-              % (camp_name))
-        return
+    log_command("add_camp:%s,%s,%s,%s,%s"
+                % (camp_name, region, country, lat, lon))
 
-    # 2. Append one line to lines, containing the details of the new camp.
-    add_camp = [camp_name, region, country, lat, lon, "camp"]
-    with open("%s/conflict_data/active_conflict/locations.csv"
-              % (get_plugin_path("FabFlee")), "a") as new_csv:
-        writer = csv.writer(new_csv)
-        writer.writerow(add_camp)
-    print(add_camp)
+    editor = active_conflict_editor()
+    editor.add_camp(camp_name, region, country, lat, lon)
+    editor.write()
 
 
 @task
 def add_new_link(name1, name2, distance):
     """  Add a new link between locations to routes.csv. """
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost add_new_link:%s,%s,%s\n"
-                     % (name1, name2, distance))
 
-    # 1. Read routes.csv and for each location in the dict, find in the csv,
-    # and change distance between two locations.
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/routes.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
+    log_command("add_new_link:%s,%s,%s" % (name1, name2, distance))
 
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != name1:
-            continue
-        if lines[i][1].strip() != name2:
-            continue
-        lines[i][2] = distance
-        print(lines[i])
-
-    # 2. Append one line to lines, containing the details of links.
-    add_new_link = [name1, name2, distance]
-    with open("%s/conflict_data/active_conflict/routes.csv"
-              % (get_plugin_path("FabFlee")), "a") as new_csv:
-        writer = csv.writer(new_csv)
-        writer.writerow(add_new_link)
-    print(add_new_link)
+    editor = active_conflict_editor()
+    editor.add_new_link(name1, name2, distance)
+    editor.write()
 
 
 @task
@@ -1158,34 +1413,11 @@ def add_new_link(name1, name2, distance):
 def delete_location(location_name):
     """ Delete not required camp (or location) from locations.csv. """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost delete_location:%s\n" % location_name)
-
-    # 1. Delete camp from locations.csv containing the details of the camp.
-    # 2. Write the updated CSV file.
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/locations.csv"
-                        % (get_plugin_path("FabFlee")), "r"))
-    lines = [l for l in r]
-
-    writer = csv.writer(open("%s/conflict_data/active_conflict/locations.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
+    log_command("delete_location:%s" % location_name)
 
-    for i in range(0, len(lines)):
-        if lines[i][0].strip() != location_name:
-            writer.writerow(lines[i])
-            continue
-
-            print(lines[i])
-
-    # 3. Check whether wanted to delete camp is present in locations.csv
-    for i in range(1, len(lines)):
-        if lines[i][0] == location_name:
-            continue
-        print("Warning: camp %s is deleted from locations.csv."
-              % (location_name))
-        return
+    editor = active_conflict_editor()
+    editor.delete_location(location_name)
+    editor.write()
 
 
 @task
@@ -1193,30 +1425,11 @@ def delete_location(location_name):
 def change_distance(source, destination, distance):
     """ Change distance between two locations in routes.csv. """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost change_distance:%s,%s,%s\n"
-                     % (source, destination, distance))
-
-    # 1. Read routes.csv and for each location in the dict, find in the csv,
-    # and change distance between two locations.
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/routes.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
-
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != source:
-            continue
-        if lines[i][1].strip() != destination:
-            continue
-        lines[i][2] = distance
-        print(lines[i])
+    log_command("change_distance:%s,%s,%s" % (source, destination, distance))
 
-    # 2. Write the updated closures.csv in the active_conflict directory.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/routes.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    editor = active_conflict_editor()
+    editor.change_distance(source, destination, distance)
+    editor.write()
 
 
 @task
@@ -1225,40 +1438,15 @@ def change_distance(source, destination, distance):
 def close_camp(camp_name, country, closure_start=0, closure_end=-1):
     """ Close camp located within neighbouring country. """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost close_camp:%s,%s\n" % (camp_name, country))
+    log_command("close_camp:%s,%s,%s,%s"
+                % (camp_name, country, closure_start, closure_end))
 
-    # 1. Change closure_start and closure_end or add a new
-    # camp closure to closures.csv.
+    # Change closure_start and closure_end or add a new camp closure to
+    # closures.csv.
     # Format: closure type <location>,name1,name2,closure_start,closure_end
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/closures.csv"
-                        % (get_plugin_path("FabFlee"))))  # Here your csv file
-    lines = [l for l in r]
-    camp_found = False
-
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != "location":
-            continue
-        if lines[i][1].strip() != camp_name:
-            continue
-        if lines[i][2].strip() != country:
-            continue
-        lines[i][3] = closure_start
-        lines[i][4] = closure_end
-        camp_found = True
-        print(lines[i])
-
-    if not camp_found:
-        lines.append(["location", camp_name, country,
-                      closure_start, closure_end])
-    # print(lines)
-
-    # 2. Write the updated closures.csv in the active_conflict directory.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/closures.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    editor = active_conflict_editor()
+    editor.close_camp(camp_name, country, closure_start, closure_end)
+    editor.write()
 
 
 @task
@@ -1270,48 +1458,15 @@ def close_border(country1, country2, closure_start=0, closure_end=-1):
     within specific neighbouring country.
     """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost close_border:%s,%s\n"
-                     % (country1, country2))
+    log_command("close_border:%s,%s,%s,%s"
+                % (country1, country2, closure_start, closure_end))
 
-    # 1. Change closure_start and closure_end or add a new camp
-    # closure to closures.csv.
+    # Change closure_start and closure_end or add a new border closure to
+    # closures.csv.
     # Format: closure type <country>,name1,name2,closure_start,closure_end
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/closures.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
-    border_found = False
-
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != "country":
-            continue
-        if lines[i][1].strip() != country1:
-            continue
-        if lines[i][2].strip() != country2:
-            continue
-        lines[i][3] = closure_start
-        lines[i][4] = closure_end
-        border_found = True
-        print(lines[i])
-
-    if not border_found:
-        lines.append(["country", country1, country2,
-                      closure_start, closure_end])
-
-    '''
-    local(template("cp %s/conflict_data/%s/*.csv \
-        %s/conflict_data/active_conflict/")
-          % (get_plugin_path("FabFlee"), conflict_name,
-             get_plugin_path("FabFlee")))
-    print(lines)
-    '''
-
-    # 2. Write the updated closures.csv in the active_conflict directory.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/closures.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    editor = active_conflict_editor()
+    editor.close_border(country1, country2, closure_start, closure_end)
+    editor.write()
 
 
 @task
@@ -1321,56 +1476,59 @@ def redirect(source, destination):
     Redirect from town or (small/other)camp to (main)camp.
     """
 
-    with open("%s/conflict_data/active_conflict/commands.log.txt"
-              % (get_plugin_path("FabFlee")), "a") as myfile:
-        myfile.write("fab localhost redirect:%s,%s\n" % (source, destination))
+    log_command("redirect:%s,%s" % (source, destination))
 
-    # 1. Read locations.csv and for each location in the dict, find in the csv,
-    # and redirect refugees from location in neighbouring country to camp.
-    # 2. Change location_type of source location to forwarding_hub.
-    import csv
-    r = csv.reader(open("%s/conflict_data/active_conflict/locations.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
+    # Change location_type of source location to forwarding_hub, and enable
+    # forced_redirection on the route from source to destination.
+    editor = active_conflict_editor()
+    editor.redirect(source, destination)
+    editor.write()
 
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != source:
-            continue
-        lines[i][5] = "forwarding_hub"
 
-        print(lines[i])
+@task
+# Syntax: fab localhost apply_conflict_edits:commands_file
+def apply_conflict_edits(commands_file):
+    """
+    Apply a batch of refinement commands to the active conflict directory.
+    The commands_file has one command per line, in the format of
+    commands.log.txt (e.g. `fab localhost close_camp:Z,ZZZ`), so that a
+    previous commands.log.txt can be replayed after load_conflict.
+    locations.csv, routes.csv and closures.csv are read and written once.
+    """
+    from .scripts.scenario_editor import read_commands
 
-    # 3. Write the updated CSV file.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/locations.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    editor = active_conflict_editor()
+    applied = editor.apply_all(read_commands(commands_file))
+    editor.write()
 
-    # 4. Find the route from source to destination in routes.csv, and enable
-    # forced_redirection.
-    r = csv.reader(open("%s/conflict_data/active_conflict/routes.csv"
-                        % (get_plugin_path("FabFlee"))))
-    lines = [l for l in r]
+    for command in applied:
+        log_command(command.split(None, 2)[2]
+                    if command.startswith("fab ") else command)
+    print("applied %d refinement commands from %s"
+          % (len(applied), commands_file))
 
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != source:
-            continue
-        if lines[i][1].strip() != destination:
-            continue
-        lines[i][3] = "2"
-        print(lines[i])
 
-    for i in range(1, len(lines)):
-        if lines[i][0].strip() != destination:
-            continue
-        if lines[i][1].strip() != source:
-            continue
-        lines[i][3] = "1"
-        print(lines[i])
+@task
+# Syntax: fab localhost make_conflict_variants:config,variants_file
+def make_conflict_variants(config, variants_file):
+    """
+    Generate scenario variants of the active conflict in the SWEEP directory
+    of config_files/<config>.
+    The variants_file is a yml file mapping each variant name to a list of
+    refinement commands, e.g.
+        closed_border:
+          - close_border:ABC,ZZZ
+    and every variant is written to SWEEP/<variant name>/input_csv.
+    """
+    import yaml
+
+    with open(variants_file) as f:
+        variants = yaml.safe_load(f)
 
-    # 5. Write the updated CSV file.
-    writer = csv.writer(open("%s/conflict_data/active_conflict/routes.csv"
-                             % (get_plugin_path("FabFlee")), "w"))
-    writer.writerows(lines)
+    sweep_dir = "%s/config_files/%s/SWEEP" % (get_plugin_path("FabFlee"),
+                                             config)
+    active_conflict_editor().write_sweep(sweep_dir, variants)
+    print("%d scenario variants written to %s" % (len(variants), sweep_dir))
 
 
 # Test Functions
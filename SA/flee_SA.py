@@ -3,13 +3,6 @@ try:
 except ImportError:
     from base.fab import *
 
-import chaospy as cp
-import numpy as np
-import easyvvuq as uq
-import matplotlib.pyplot as plt
-import pandas as pd
-from scipy.stats.mstats import gmean
-import scipy.stats as st
 import sys
 import os
 import math
@@ -18,6 +11,21 @@ from shutil import copyfile, rmtree
 from pprint import pprint
 import json
 from plugins.FabFlee.FabFlee import *
+from plugins.FabFlee.scripts.lazy_import import lazy_import, lazy_function
+from plugins.FabFlee.scripts.results_manifest import (
+    ResultsManifest, campaign_output_files, ingest_campaign_results
+)
+from plugins.FabFlee.scripts.plotting import (
+    PlotPool, configure_from_env, plot_campaign_results
+)
+
+# the analysis libraries are only imported once a SA task uses them, and
+# not when the tasks are registered.
+cp = lazy_import("chaospy")
+np = lazy_import("numpy")
+uq = lazy_import("easyvvuq")
+gmean = lazy_function("scipy.stats.mstats", "gmean")
+st = lazy_import("scipy.stats")
 
 # authors: Hamid Arabnejad, Diana Suleimenova, Wouter Edeling, Derek Groen
 
@@ -38,7 +46,7 @@ def flee_init_SA(config, simulation_period=-1, mode="serial",
 
     ==========================================================================
     """
-    update_environment()
+    update_environment(args)
 
     #############################################
     # load flee SA configuration from yml file #
@@ -106,7 +114,7 @@ def flee_init_SA(config, simulation_period=-1, mode="serial",
 
 @task
 @load_plugin_env_vars("FabFlee")
-def flee_analyse_SA(config, sampler_name=None, ** args):
+def flee_analyse_SA(config, sampler_name=None, refetch="False", ** args):
     """
     ==========================================================================
 
@@ -117,9 +125,17 @@ def flee_analyse_SA(config, sampler_name=None, ** args):
         fab eagle_vecma flee_analyse_SA:mali
         fab localhost flee_analyse_SA:mali
 
+    Only the runs which are new, or whose output changed since the last
+    analysis, are fetched and decoded (see results_manifest.json in the
+    campaign directory); use refetch=True to fetch all results again.
+
+    The figures are rendered headless; plot_mode=fast makes low resolution
+    previews, plot_format=svg vector figures, and plot_mode=off only writes
+    sobols.yml.
+
     ==========================================================================
     """
-    update_environment()
+    update_environment(args)
 
     #############################################
     # load flee SA configuration from yml file #
@@ -167,36 +183,53 @@ def flee_analyse_SA(config, sampler_name=None, ** args):
     with_config(config)
 
     job_folder_name = template(env.job_name_template)
-    print("fetching results from remote machine ...")
-    fetch_results(regex=job_folder_name, files="out.csv")
-    print("Done\n")
-
-    #####################################################
-    # copy ONLY the required output files for analyse,  #
-    # i.e., EasyVVUQ.decoders.target_filename           #
-    #####################################################
-    output_filename = SA_campaign_config["params"]["out_file"]["default"]
-    src = os.path.join(env.local_results, job_folder_name, "RUNS")
-    des = campaign.campaign_db.runs_dir()
-    print("Syncing output_dir ...")
-    local(
-        "rsync -pthrz "
-        "--include='/*/' "
-        "--include='{}' "
-        "--exclude='*' "
-        "{}/  {} ".format(output_filename, src, des)
-    )
-    print("Done ...\n")
 
     #######################################
     # Create an decoder for data analysis #
     #######################################
+    output_filename = SA_campaign_config["params"]["out_file"]["default"]
     output_column = SA_campaign_config["decoder_output_column"]
     decoder = uq.decoders.SimpleCSV(
         target_filename=output_filename,
         output_columns=[output_column]
     )
 
+    ##########################################################
+    # only fetch and decode the runs which are new, or whose #
+    # output changed since the last analysis                 #
+    ##########################################################
+    manifest = ResultsManifest(
+        campaign_work_dir,
+        context="{}:{}".format(output_filename, output_column)
+    )
+    pending = manifest.pending(
+        campaign_output_files(campaign, output_filename)
+    )
+    if len(pending) > 0 or refetch.lower() == "true":
+        print("fetching results from remote machine ...")
+        fetch_results(regex=job_folder_name, files="out.csv")
+        print("Done\n")
+
+        #####################################################
+        # copy ONLY the required output files for analyse,  #
+        # i.e., EasyVVUQ.decoders.target_filename           #
+        #####################################################
+        src = os.path.join(env.local_results, job_folder_name, "RUNS")
+        des = campaign.campaign_db.runs_dir()
+        print("Syncing output_dir ...")
+        local(
+            "rsync -pthrz "
+            "--include='/*/' "
+            "--include='{}' "
+            "--exclude='*' "
+            "{}/  {} ".format(output_filename, src, des)
+        )
+        print("Done ...\n")
+    else:
+        print("all run outputs are already ingested, skipping fetch ...\n")
+
+    ingest_campaign_results(campaign, decoder, manifest)
+
     #####################
     # execute collate() #
     #####################
@@ -233,106 +266,7 @@ def flee_analyse_SA(config, sampler_name=None, ** args):
     campaign.apply_analysis(analysis)
     results = campaign.get_last_analysis()
 
-    ###################
-    #    Plotting     #
-    ###################
-    fig_desc = "polynomial_order = {}, num_runs = {}, sampler = {}".format(
-        polynomial_order,
-        campaign.campaign_db.get_num_runs(),
-        sampler_name
-    )
-    props = dict(boxstyle="round", facecolor="wheat", alpha=0.5)
-
-    ########################
-    #    Plot raw data     #
-    ########################
-    output_files = glob.glob(
-        os.path.join(campaign_work_dir + "/**/%s" % (output_filename)),
-        recursive=True
-    )
-
-    fig, ax = plt.subplots()
-    ax.set_xlabel("days")
-    ax.set_ylabel(output_column)
-    fig.suptitle(
-        "RAW data : column {}\n".format(output_column),
-        fontsize=10, fontweight="bold"
-    )
-    ax.set_title(
-        fig_desc, fontsize=8, loc="center",
-        fontweight="bold", bbox=props
-    )
-    for output_file in output_files:
-        total_errors = pd.read_csv(output_file)[
-            output_column].values.tolist()
-        ax.plot(total_errors)
-
-    plot_file_name = "raw[{}]".format(output_column)
-    plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                dpi=400)
-
-    ###################################
-    #    Plot statistical_moments     #
-    ###################################
-    fig, ax = plt.subplots()
-    ax.set_xlabel("days")
-    ax.set_ylabel("velocity {}".format(output_column))
-    fig.suptitle(
-        "code mean +/- standard deviation\n",
-        fontsize=10, fontweight="bold"
-    )
-    ax.set_title(
-        fig_desc, fontsize=8, loc="center",
-        fontweight="bold", bbox=props
-    )
-
-    mean = results.describe(output_column, "mean")
-    std = results.describe(output_column, "std")
-    X = range(len(mean))
-    ax.plot(X, mean, "b-", label="mean")
-    ax.plot(X, mean - std, "--r", label="+1 std-dev")
-    ax.plot(X, mean + std, "--r")
-    ax.fill_between(X, mean - std, mean + std, color="r", alpha=0.2)
-    # plt.tight_layout()
-    plt.legend(loc="best")
-    plot_file_name = "plot_statistical_moments[{}]".format(output_column)
-    plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                dpi=400)
-
-    ###################################
-    #        Plot sobols_first        #
-    ###################################
-    fig, ax = plt.subplots()
-    ax.set_xlabel("days")
-    ax.set_ylabel("Sobol indices")
-    fig.suptitle(
-        "First order Sobol index [output column = {}]\n".format(
-            output_column),
-        fontsize=10, fontweight="bold"
-    )
-    ax.set_title(
-        fig_desc, fontsize=8, loc='center',
-        fontweight='bold', bbox=props
-    )
-
-    # sobols_first = results.raw_data["sobols_first"][output_column]
     sobols_first = results.sobols_first(output_column)
-    param_i = 0
-    for v in sobols_first:
-        y = sobols_first[v].ravel()
-        important = False
-        if y[-1] != 0:
-            ax.plot(y, label=v)
-        else:
-            print("{} ignored for plotting".format(v))
-
-        param_i = param_i + 1
-
-    plt.legend(loc="best")
-    # plt.tight_layout()
-    plot_file_name = "plot_sobols_first[{}]".format(output_column)
-    plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                dpi=400)
 
     ###############################################################
     # yml_results contains all campaign info and analysis results #
@@ -400,6 +334,23 @@ def flee_analyse_SA(config, sampler_name=None, ** args):
     with open(res_file_name, "w") as outfile:
         yaml.dump(yml_results, outfile)
 
+    ###################
+    #    Plotting     #
+    ###################
+    plot_data = {
+        "campaign_work_dir": campaign_work_dir,
+        "polynomial_order": polynomial_order,
+        "sampler_name": sampler_name,
+        "num_runs": campaign.campaign_db.get_num_runs(),
+        "output_filename": output_filename,
+        "output_column": output_column,
+        "mean": results.describe(output_column, "mean"),
+        "std": results.describe(output_column, "std"),
+        "sobols_first": sobols_first
+    }
+    with PlotPool(configure_from_env(env)) as pool:
+        pool.submit(plot_campaign_results, plot_data)
+
 
 def init_SA_campaign(plugin_name, campaign_name, campaign_config,
                      polynomial_order, campaign_work_dir):
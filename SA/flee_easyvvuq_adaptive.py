@@ -15,6 +15,9 @@ import re
 import pandas as pd
 import matplotlib.pyplot as plt
 from plugins.FabFlee.FabFlee import *
+from plugins.FabFlee.scripts.plotting import (
+    PlotPool, configure_from_env, plots_enabled, save_figure
+)
 
 try:
     import glob
@@ -76,8 +79,12 @@ def flee_adapt_dimension(config, ** args):
 
         fab eagle_vecma flee_adapt_dimension:mali
 
+    The figures are rendered headless; plot_mode=fast makes low resolution
+    previews, plot_format=svg vector figures, and plot_mode=off skips them.
+
     ============================================================================
     '''
+    update_environment(args)
     load_campaign_files()
 
     # reload Campaign, sampler, analysis
@@ -103,8 +110,9 @@ def flee_adapt_dimension(config, ** args):
     job_folder_name = template(env.job_name_template + "_{}".format(job_label))
 
     print("fetching results from remote machine ...")
+    # only the out.csv files are used for the analysis
     # with hide('output', 'running', 'warnings'), settings(warn_only=True):
-    fetch_results(regex=job_folder_name)
+    fetch_results(regex=job_folder_name, files="out.csv")
     print("Done\n")
 
     # copy only output folder into local campaign_dir :)
@@ -142,25 +150,10 @@ def flee_adapt_dimension(config, ** args):
     results = campaign.get_last_analysis()
 
     # for output_column in output_columns:
+    plot_workers = configure_from_env(env)
     for output_column in [output_columns[0]]:
-        #########################
-        # plot mean +/- std dev #
-        #########################
-        fig = plt.figure()
-        ax = fig.add_subplot(111, xlabel="days", ylabel=output_column)
-        mean = results["statistical_moments"][output_column]["mean"]
-        std = results["statistical_moments"][output_column]["std"]
-        ax.plot(mean)
-        ax.plot(mean + std, '--r')
-        ax.plot(mean - std, '--r')
-        plt.tight_layout()
-
-        plt.savefig(os.path.join(work_dir_adapt,
-                                 'plot_mean_std_%d[%s]' %
-                                 (sampler.number_of_adaptations,
-                                  output_column)
-                                 ),
-                    dpi=400)
+        if not plots_enabled():
+            continue
 
         #################################
         # Plot some convergence metrics #
@@ -181,31 +174,6 @@ def flee_adapt_dimension(config, ** args):
                          )
         )
 
-        surplus_errors = analysis.get_adaptation_errors()
-
-        fig = plt.figure()
-        ax = fig.add_subplot(111, xlabel='refinement step',
-                             ylabel='max surplus error')
-        ax.plot(range(1, len(surplus_errors) + 1), surplus_errors, '-b*')
-        plt.tight_layout()
-
-        plt.savefig(os.path.join(work_dir_adapt,
-                                 'max_surplus_error_%d[%s]' %
-                                 (sampler.number_of_adaptations,
-                                  output_column)
-                                 ),
-                    dpi=400)
-
-        #####################################
-        # Plot the random surrogate samples #
-        #####################################
-
-        fig = plt.figure(figsize=[12, 4])
-        ax = fig.add_subplot(131, xlabel='days', ylabel=output_column,
-                             title='Surrogate samples')
-        ax.plot(analysis.get_sample_array(
-            output_column).T, 'ro', alpha=0.5)
-
         # generate n_mc samples from the input distributions
         n_mc = 20
         xi_mc = np.zeros([n_mc, sampler.xi_d.shape[1]])
@@ -218,50 +186,109 @@ def flee_adapt_dimension(config, ** args):
 
         # evaluate the surrogate at these values
         print('Evaluating surrogate model', n_mc, 'times')
-        for i in range(n_mc):
-            ax.plot(analysis.surrogate(output_column, xi_mc[i]), 'g')
+        surrogate_samples = [analysis.surrogate(output_column, xi_mc[i])
+                             for i in range(n_mc)]
         print('done')
 
-        plt.savefig(os.path.join(work_dir_adapt,
-                                 'Surrogate_samples_%d[%s]' %
-                                 (sampler.number_of_adaptations,
-                                  output_column)
-                                 ),
-                    dpi=400)
-
-        ##################################
-        # Plot first-order Sobol indices #
-        ##################################
-
-        ax = fig.add_subplot(122, title=r'First-order Sobols indices',
-                             xlabel="days", ylabel=output_column)
-        sobols_first = results["sobols_first"][output_column]
-        for param in sobols_first.keys():
-            ax.plot(sobols_first[param], label=param)
-        leg = ax.legend(loc=0, fontsize=8)
-        leg.set_draggable(True)
-        plt.tight_layout()
-
-        plt.savefig(os.path.join(work_dir_adapt, 'plot_first_order_Sobol_indices_%d' %
-                                 (sampler.number_of_adaptations)), dpi=400)
-
-        ##################################
-        # analysis.mean_history #
-        ##################################
-        plt.clf()
-        ax = fig.add_subplot(111, xlabel='plot_analysis.mean_history.T')
-
-        ax.plot(np.array(analysis.mean_history).T)
-
-        plt.tight_layout()
-        plt.savefig(os.path.join(work_dir_adapt, 'plot_analysis_mean_history_%d' %
-                                 (sampler.number_of_adaptations)), dpi=400)
+        plot_data = {
+            "work_dir": work_dir_adapt,
+            "number_of_adaptations": sampler.number_of_adaptations,
+            "output_column": output_column,
+            "mean": results["statistical_moments"][output_column]["mean"],
+            "std": results["statistical_moments"][output_column]["std"],
+            "surplus_errors": analysis.get_adaptation_errors(),
+            "sample_array": analysis.get_sample_array(output_column),
+            "surrogate_samples": surrogate_samples,
+            "sobols_first": results["sobols_first"][output_column],
+            "mean_history": analysis.mean_history
+        }
+        with PlotPool(plot_workers) as pool:
+            pool.submit(plot_adapt_dimension, plot_data)
 
         # pprint(analysis.std_history)
 
     backup_campaign_files()
 
 
+def plot_adapt_dimension(plot_data):
+    """
+    Plot the mean +/- std dev, the max surplus error, the surrogate samples,
+    the first order Sobol indices and the mean history of an adaptation
+    step of flee_adapt_dimension.
+    """
+    work_dir = plot_data["work_dir"]
+    number_of_adaptations = plot_data["number_of_adaptations"]
+    output_column = plot_data["output_column"]
+
+    #########################
+    # plot mean +/- std dev #
+    #########################
+    fig = plt.figure()
+    ax = fig.add_subplot(111, xlabel="days", ylabel=output_column)
+    mean = plot_data["mean"]
+    std = plot_data["std"]
+    ax.plot(mean)
+    ax.plot(mean + std, '--r')
+    ax.plot(mean - std, '--r')
+    fig.tight_layout()
+    save_figure(fig, os.path.join(work_dir, 'plot_mean_std_%d[%s]' %
+                                  (number_of_adaptations, output_column)))
+
+    ##########################
+    # Plot max surplus error #
+    ##########################
+    surplus_errors = plot_data["surplus_errors"]
+    fig = plt.figure()
+    ax = fig.add_subplot(111, xlabel='refinement step',
+                         ylabel='max surplus error')
+    ax.plot(range(1, len(surplus_errors) + 1), surplus_errors, '-b*')
+    fig.tight_layout()
+    save_figure(fig, os.path.join(work_dir, 'max_surplus_error_%d[%s]' %
+                                  (number_of_adaptations, output_column)))
+
+    #####################################
+    # Plot the random surrogate samples #
+    #####################################
+    def plot_surrogate_samples(fig):
+        ax = fig.add_subplot(131, xlabel='days', ylabel=output_column,
+                             title='Surrogate samples')
+        ax.plot(plot_data["sample_array"].T, 'ro', alpha=0.5)
+        for surrogate_sample in plot_data["surrogate_samples"]:
+            ax.plot(surrogate_sample, 'g')
+
+    fig = plt.figure(figsize=[12, 4])
+    plot_surrogate_samples(fig)
+    save_figure(fig, os.path.join(work_dir, 'Surrogate_samples_%d[%s]' %
+                                  (number_of_adaptations, output_column)))
+
+    ##################################
+    # Plot first-order Sobol indices #
+    ##################################
+    fig = plt.figure(figsize=[12, 4])
+    plot_surrogate_samples(fig)
+    ax = fig.add_subplot(122, title=r'First-order Sobols indices',
+                         xlabel="days", ylabel=output_column)
+    sobols_first = plot_data["sobols_first"]
+    for param in sobols_first.keys():
+        ax.plot(sobols_first[param], label=param)
+    ax.legend(loc=0, fontsize=8)
+    fig.tight_layout()
+    save_figure(fig, os.path.join(work_dir,
+                                  'plot_first_order_Sobol_indices_%d' %
+                                  (number_of_adaptations)))
+
+    ##################################
+    # analysis.mean_history #
+    ##################################
+    fig = plt.figure(figsize=[12, 4])
+    ax = fig.add_subplot(111, xlabel='plot_analysis.mean_history.T')
+    ax.plot(np.array(plot_data["mean_history"]).T)
+    fig.tight_layout()
+    save_figure(fig, os.path.join(work_dir,
+                                  'plot_analysis_mean_history_%d' %
+                                  (number_of_adaptations)))
+
+
 @task
 def flee_adapt_look_ahead(config, simulation_period, mode='parallel', ** args):
     '''
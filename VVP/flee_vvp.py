@@ -18,15 +18,29 @@ import ruamel.yaml
 import os
 import json
 from shutil import rmtree, copy2
-import easyvvuq as uq
-import chaospy as cp
-import numpy as np
-import pandas as pd
 import re
 import pickle
-import matplotlib.pyplot as plt
-from scipy.stats.mstats import gmean
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from plugins.FabFlee.FabFlee import *
+from plugins.FabFlee.scripts.lazy_import import lazy_import, lazy_function
+from plugins.FabFlee.scripts.results_manifest import (
+    ResultsManifest, campaign_output_files, ingest_campaign_results
+)
+from plugins.FabFlee.scripts.collation_cache import CollationCache
+from plugins.FabFlee.scripts.plotting import (
+    PlotPool, configure_from_env, plot_campaign_results, plots_enabled,
+    save_figure
+)
+
+# the analysis libraries are only imported once a VVP task uses them, and
+# not when the tasks are registered.
+uq = lazy_import("easyvvuq")
+cp = lazy_import("chaospy")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+plt = lazy_import("matplotlib.pyplot")
+gmean = lazy_function("scipy.stats.mstats", "gmean")
 
 try:
     from fabsim.VVP.vvp import ensemble_vvp_LoR
@@ -215,15 +229,24 @@ def flee_init_vvp_LoR(config, simulation_period, mode='serial', **args):
 
 @task
 @load_plugin_env_vars("FabFlee")
-def flee_analyse_vvp_QoI(config):
+def flee_analyse_vvp_QoI(config, refetch="False", **args):
     """
     flee_analyse_vvp_LoR will analysis the output of each vvp ensemble series
 
     usage example:
         fab localhost flee_analyse_vvp_QoI:mali
         fab training_hidalgo flee_analyse_vvp_QoI:mali
+
+    Only the runs which are new, or whose output changed since the last
+    analysis, are fetched and read; use refetch=True to fetch all results
+    again.
+
+    The figure of each similarity measure is rendered headless, in
+    plot_workers processes; plot_mode=fast makes low resolution previews,
+    plot_format=svg vector figures, and plot_mode=off only writes
+    results.json.
     """
-    update_environment()
+    update_environment(args)
     #############################################
     # load flee vvp configuration from yml file #
     #############################################
@@ -272,28 +295,42 @@ def flee_analyse_vvp_QoI(config):
     with_config(config)
 
     job_folder_name = template(env.job_name_template)
-    print("fetching results from remote machine ...")
-    with hide("output", "running", "warnings"), settings(warn_only=True):
-        fetch_results(regex=job_folder_name)
-    print("Done\n")
 
-    #####################################################
-    # copy ONLY the required output files for analyse,  #
-    # i.e., EasyVVUQ.decoders.target_filename           #
-    #####################################################
-    src = os.path.join(env.local_results, job_folder_name, "RUNS")
+    ##########################################################
+    # only fetch and decode the runs which are new, or whose #
+    # output changed since the last analysis                 #
+    ##########################################################
+    manifest = ResultsManifest(campaign_work_dir, context="sim columns")
+    output_files = campaign_output_files(campaign, "out.csv") + \
+        campaign_output_files(campaign, "out_uncertainty.csv")
     des = campaign.campaign_db.runs_dir()
-    print("Syncing output_dir ...")
-    # with hide('output', 'running', 'warnings'), settings(warn_only=True):
-    local(
-        "rsync -pthrz "
-        "--include='/*/' "
-        "--include='out_uncertainty.csv' "
-        "--include='out.csv' "
-        "--exclude='*' "
-        "{}/  {} ".format(src, des)
-    )
-    print("Done ...\n")
+    if len(manifest.pending(output_files)) > 0 or \
+            refetch.lower() == "true":
+        print("fetching results from remote machine ...")
+        with hide("output", "running", "warnings"), \
+                settings(warn_only=True):
+            fetch_results(regex=job_folder_name)
+        print("Done\n")
+
+        #####################################################
+        # copy ONLY the required output files for analyse,  #
+        # i.e., EasyVVUQ.decoders.target_filename           #
+        #####################################################
+        src = os.path.join(env.local_results, job_folder_name, "RUNS")
+        print("Syncing output_dir ...")
+        # with hide('output', 'running', 'warnings'),
+        #         settings(warn_only=True):
+        local(
+            "rsync -pthrz "
+            "--include='/*/' "
+            "--include='out_uncertainty.csv' "
+            "--include='out.csv' "
+            "--exclude='*' "
+            "{}/  {} ".format(src, des)
+        )
+        print("Done ...\n")
+    else:
+        print("all run outputs are already ingested, skipping fetch ...\n")
 
     #########################
     # find output csv files #
@@ -305,49 +342,18 @@ def flee_analyse_vvp_QoI(config):
     ###########################################################
     # take the number of refugees number by day per each camp #
     ###########################################################
-    pd_out_csv = []
-    for csv_file in out_csv_files:
-        pd_csv = pd.read_csv(csv_file)
-        pd_csv = pd_csv.drop(
-            [column_name
-             for column_name in pd_csv.columns.values
-             if " sim" not in column_name and column_name != "Day"
-             ],
-            1
-        )
-        pd_out_csv.append(pd_csv)
-
-    pd_uncertainty_csv = []
-    for csv_file in uncertainty_csv_files:
-        pd_csv = pd.read_csv(csv_file)
-        pd_csv = pd_csv.drop(
-            [column_name
-             for column_name in pd_csv.columns.values
-             if " sim" not in column_name and column_name != "Day"
-             ],
-            1
-        )
-        pd_uncertainty_csv.append(pd_csv)
-
-    QoIs = [column_name
-            for column_name in list(pd_out_csv[0].columns.values)
-            if column_name != "Day"
-            ]
-    agg_input = {column_name: lambda x: list(x) for column_name in QoIs}
-
-    pd_out_csv = pd.concat(pd_out_csv, axis=0,
-                           ignore_index=True
-                           ).groupby(['Day']).agg(agg_input)
-
-    pd_uncertainty_csv = pd.concat(pd_uncertainty_csv, axis=0,
-                                   ignore_index=True
-                                   ).groupby(['Day']).agg(agg_input)
+    QoIs, days, sim_values = load_sim_columns(out_csv_files,
+                                              manifest=manifest)
+    _, _, uncertainty_values = load_sim_columns(uncertainty_csv_files, QoIs,
+                                                days, manifest=manifest)
+    manifest.save()
 
     results = {}
-    for QoI in QoIs:
+    for i, QoI in enumerate(QoIs):
         print("QoI = {}".format(QoI))
-        sim_result = pd_out_csv[QoI].tolist()
-        uncertainty_result = pd_uncertainty_csv[QoI].tolist()
+        # (days x runs) arrays of this QoI
+        sim_result = by_day(sim_values[:, :, i])
+        uncertainty_result = by_day(uncertainty_values[:, :, i])
 
         res = ensemble_vvp_QoI(sim_result, uncertainty_result, QoI)
 
@@ -359,62 +365,34 @@ def flee_analyse_vvp_QoI(config):
     with open(os.path.join(campaign_work_dir, "results.json"), "w") as f:
         f.write(json.dumps(results))
 
-    for similarity_measure_name, data in results.items():
-        # print(data)
-        print("=" * 50)
-        print("=" * 50)
-        print("=" * 50)
-        print("similarity_measure_name = {}".format(similarity_measure_name))
-        print("locations name : {}".format(data.keys()))
-
-        # find the number of rows and columns for subplots
-        size = len(data.keys())
-        cols = round(math.sqrt(size))
-        rows = cols
-        while rows * cols < size:
-            rows += 1
-
-        fig, ax_arr = plt.subplots(rows, cols, figsize=(8, 5))
-        fig.suptitle(
-            'similarity measure : {}'.format(similarity_measure_name),
-            fontsize=15
-        )
-        max_y = -float("inf")
-        ax_arr = ax_arr.reshape(-1)
-        for i, (location_name, values) in enumerate(data.items()):
-            print("location_name = {} max(values) = {}".format(
-                location_name, max(values))
-            )
-
-            ax_arr[i].plot(values)
-            ax_arr[i].set_xlim([1, len(values)])
-            ax_arr[i].set_title(
-                location_name, fontsize=10, fontweight='bold', loc='center'
-            )
-        for j in range(i + 1, rows * cols):
-            ax_arr[j].axis('off')
-
-        mng = plt.get_current_fig_manager()
-        mng.window.showMaximized()
-
-        fig.tight_layout()
-        plot_file_name = "vvp_QoI_{}.png".format(similarity_measure_name)
-        plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                    dpi=400)
-
-    # plt.show()
+    with PlotPool(configure_from_env(env)) as pool:
+        for similarity_measure_name, data in results.items():
+            pool.submit(plot_vvp_QoI, similarity_measure_name, data,
+                        campaign_work_dir)
 
 
 @task
 @load_plugin_env_vars("FabFlee")
-def flee_analyse_vvp_LoR(config):
+def flee_analyse_vvp_LoR(config, refetch="False", workers="1", **args):
     """
     flee_analyse_vvp_LoR will analysis the output of each vvp ensemble series
 
     usage example:
         fab localhost flee_analyse_vvp_LoR:mali
+
+    Only the runs which are new, or whose output changed since the last
+    analysis, are fetched and decoded; use refetch=True to fetch all
+    results again.
+
+    The polynomial orders are analysed independently, in a pool of worker
+    processes if workers > 1. The plots are only made once all orders are
+    analysed, in plot_workers processes. plot_mode=fast makes low
+    resolution previews, plot_format=svg vector figures, and plot_mode=off
+    only writes the sobols.yml files; the plots can then be made later on
+    with flee_plot_vvp_LoR.
     """
-    update_environment()
+    update_environment(args)
+    plot_workers = configure_from_env(env)
 
     #############################################
     # load flee vvp configuration from yml file #
@@ -450,46 +428,204 @@ def flee_analyse_vvp_LoR(config):
         rmtree(sobol_work_dir)
     os.makedirs(sobol_work_dir)
 
-    for polynomial_order in polynomial_order_range:
-        campaign_name = "flee_vvp_LoR_{}_po{}_{}_".format(
-            sampler_name,
-            polynomial_order,
-            config
-        )
+    polynomial_orders = list(polynomial_order_range)
+    workers = min(int(workers), len(polynomial_orders))
+    if workers > 1:
+        # fork, so that the workers inherit the FabSim environment
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork")) as pool:
+            plots_data = list(pool.map(
+                analyse_vvp_LoR_order,
+                [config] * len(polynomial_orders),
+                polynomial_orders,
+                [VVP_campaign_config] * len(polynomial_orders),
+                [refetch] * len(polynomial_orders)
+            ))
+    else:
+        plots_data = [
+            analyse_vvp_LoR_order(config, polynomial_order,
+                                  VVP_campaign_config, refetch)
+            for polynomial_order in polynomial_orders
+        ]
 
-        campaign_work_dir = os.path.join(
-            get_plugin_path("FabFlee"),
-            "VVP",
-            "flee_vvp_LoR_{}_{}".format(sampler_name, config),
-            "campaign_po{}".format(polynomial_order)
+    with PlotPool(plot_workers) as pool:
+        for plot_data in plots_data:
+            pool.submit(plot_campaign_results, plot_data)
+    for plot_data in plots_data:
+        copy_vvp_LoR_order(plot_data["campaign_work_dir"], sobol_work_dir)
+
+    check_vvp_LoR_convergence(sobol_work_dir)
+
+
+@task
+@load_plugin_env_vars("FabFlee")
+def flee_plot_vvp_LoR(config, **args):
+    """
+    flee_plot_vvp_LoR makes the plots of an analysis done with
+    flee_analyse_vvp_LoR:<config>,plot_mode=off
+
+    usage example:
+        fab localhost flee_plot_vvp_LoR:mali
+        fab localhost flee_plot_vvp_LoR:mali,plot_workers=4,plot_mode=fast
+    """
+    update_environment(args)
+    flee_VVP_config_file = os.path.join(
+        get_plugin_path("FabFlee"),
+        "VVP",
+        "flee_VVP_config.yml"
+    )
+    VVP_campaign_config = load_VVP_campaign_config(flee_VVP_config_file)
+    sampler_name = VVP_campaign_config["sampler_name"]
+    LoR_work_dir = os.path.join(
+        get_plugin_path("FabFlee"),
+        "VVP",
+        "flee_vvp_LoR_{}_{}".format(sampler_name, config)
+    )
+    sobol_work_dir = os.path.join(LoR_work_dir, "sobol")
+
+    plots_data = []
+    for plot_data_file in sorted(glob.glob(
+            os.path.join(LoR_work_dir, "campaign_po*", "plot_data.pickle"))):
+        with open(plot_data_file, "rb") as f:
+            plots_data.append(pickle.load(f))
+
+    with PlotPool(configure_from_env(env)) as pool:
+        for plot_data in plots_data:
+            pool.submit(plot_campaign_results, plot_data)
+    for plot_data in plots_data:
+        copy_vvp_LoR_order(plot_data["campaign_work_dir"], sobol_work_dir)
+
+    check_vvp_LoR_convergence(sobol_work_dir)
+
+
+def check_vvp_LoR_convergence(sobol_work_dir):
+    #####################################################
+    # Check the convergence of the SC Sobols indices    #
+    # with polynomial refinement                        #
+    #####################################################
+    ensemble_vvp_LoR(
+        results_dirs_PATH=sobol_work_dir,
+        load_QoIs_function=load_QoIs_function,
+        aggregation_function=plot_convergence,
+        plot_file_path=sobol_work_dir
+    )
+
+
+def plot_vvp_QoI(similarity_measure_name, data, campaign_work_dir):
+    """
+    Plot the similarity measure of each location, i.e. data is a dict of
+    location name -> similarity by day.
+    """
+    # print(data)
+    print("=" * 50)
+    print("=" * 50)
+    print("=" * 50)
+    print("similarity_measure_name = {}".format(similarity_measure_name))
+    print("locations name : {}".format(data.keys()))
+
+    # find the number of rows and columns for subplots
+    size = len(data.keys())
+    cols = round(math.sqrt(size))
+    rows = cols
+    while rows * cols < size:
+        rows += 1
+
+    fig, ax_arr = plt.subplots(rows, cols, figsize=(8, 5))
+    fig.suptitle(
+        'similarity measure : {}'.format(similarity_measure_name),
+        fontsize=15
+    )
+    max_y = -float("inf")
+    ax_arr = ax_arr.reshape(-1)
+    for i, (location_name, values) in enumerate(data.items()):
+        print("location_name = {} max(values) = {}".format(
+            location_name, max(values))
         )
-        load_campaign_files(campaign_work_dir)
-
-        ###################
-        # reload Campaign #
-        ###################
-        db_location = "sqlite:///" + campaign_work_dir + "/campaign.db"
-        campaign = uq.Campaign(name=campaign_name, db_location=db_location)
-        print("===========================================")
-        print("Reloaded campaign {}".format(campaign_name))
-        print("===========================================")
-
-        sampler = campaign.get_active_sampler()
-        campaign.set_sampler(sampler, update=True)
-
-        ####################################################
-        # fetch results from remote machine                #
-        # here, we ONLY fetch the required results folders #
-        ####################################################
-        env.job_desc = "_vvp_LoR_{}_po{}".format(
-            sampler_name,
-            polynomial_order
+
+        ax_arr[i].plot(values)
+        ax_arr[i].set_xlim([1, len(values)])
+        ax_arr[i].set_title(
+            location_name, fontsize=10, fontweight='bold', loc='center'
         )
-        with_config(config)
+    for j in range(i + 1, rows * cols):
+        ax_arr[j].axis('off')
+
+    fig.tight_layout()
+    plot_file_name = "vvp_QoI_{}.png".format(similarity_measure_name)
+    save_figure(fig, os.path.join(campaign_work_dir, plot_file_name))
+
+
+def analyse_vvp_LoR_order(config, polynomial_order, VVP_campaign_config,
+                          refetch="False"):
+    """
+    Fetch, collate and analyse the LoR campaign of a single polynomial order,
+    and write its sobols.yml. The data needed for the plots is returned, and
+    stored in plot_data.pickle in the campaign directory.
+    """
+    sampler_name = VVP_campaign_config["sampler_name"]
+    campaign_name = "flee_vvp_LoR_{}_po{}_{}_".format(
+        sampler_name,
+        polynomial_order,
+        config
+    )
+
+    campaign_work_dir = os.path.join(
+        get_plugin_path("FabFlee"),
+        "VVP",
+        "flee_vvp_LoR_{}_{}".format(sampler_name, config),
+        "campaign_po{}".format(polynomial_order)
+    )
+    load_campaign_files(campaign_work_dir)
+
+    ###################
+    # reload Campaign #
+    ###################
+    db_location = "sqlite:///" + campaign_work_dir + "/campaign.db"
+    campaign = uq.Campaign(name=campaign_name, db_location=db_location)
+    print("===========================================")
+    print("Reloaded campaign {}".format(campaign_name))
+    print("===========================================")
 
-        job_folder_name = template(env.job_name_template)
+    sampler = campaign.get_active_sampler()
+    campaign.set_sampler(sampler, update=True)
+
+    ####################################################
+    # fetch results from remote machine                #
+    # here, we ONLY fetch the required results folders #
+    ####################################################
+    env.job_desc = "_vvp_LoR_{}_po{}".format(
+        sampler_name,
+        polynomial_order
+    )
+    with_config(config)
+
+    job_folder_name = template(env.job_name_template)
+
+    #################################
+    # Create a decoder #
+    #################################
+    output_filename = VVP_campaign_config["params"]["out_file"]["default"]
+    output_column = VVP_campaign_config["decoder_output_column"]
+    decoder = uq.decoders.SimpleCSV(
+        target_filename=output_filename,
+        output_columns=[output_column]
+    )
+
+    ##########################################################
+    # only fetch and decode the runs which are new, or whose #
+    # output changed since the last analysis                 #
+    ##########################################################
+    manifest = ResultsManifest(
+        campaign_work_dir,
+        context="{}:{}".format(output_filename, output_column)
+    )
+    run_outputs = campaign_output_files(campaign, output_filename)
+    pending = manifest.pending(run_outputs)
+    if len(pending) > 0 or refetch.lower() == "true":
         print("fetching results from remote machine ...")
-        with hide("output", "running", "warnings"), settings(warn_only=True):
+        with hide("output", "running", "warnings"), \
+                settings(warn_only=True):
             fetch_results(regex=job_folder_name)
         print("Done\n")
 
@@ -497,11 +633,9 @@ def flee_analyse_vvp_LoR(config):
         # copy ONLY the required output files for analyse,  #
         # i.e., EasyVVUQ.decoders.target_filename           #
         #####################################################
-        output_filename = VVP_campaign_config["params"]["out_file"]["default"]
         src = os.path.join(env.local_results, job_folder_name, "RUNS")
         des = campaign.campaign_db.runs_dir()
         print("Syncing output_dir ...")
-        # with hide('output', 'running', 'warnings'), settings(warn_only=True):
         local(
             "rsync -pthrz "
             "--include='/*/' "
@@ -510,16 +644,37 @@ def flee_analyse_vvp_LoR(config):
             "{}/  {} ".format(output_filename, src, des)
         )
         print("Done ...\n")
-
-        #################################
-        # Create a decoder #
-        #################################
-        output_column = VVP_campaign_config["decoder_output_column"]
-        decoder = uq.decoders.SimpleCSV(
-            target_filename=output_filename,
-            output_columns=[output_column]
+    else:
+        print("all run outputs are already ingested, "
+              "skipping fetch ...\n")
+
+    ##########################################################
+    # reuse the collation result of the previous analysis if #
+    # none of the run outputs changed                        #
+    ##########################################################
+    collation_cache = CollationCache(
+        campaign_work_dir,
+        campaign=campaign_name,
+        polynomial_order=polynomial_order,
+        decoder=manifest.context
+    )
+    # the digest covers the outputs of all runs, as the runs collated by
+    # the previous analysis are no longer NEW
+    all_run_outputs = campaign_output_files(
+        campaign, output_filename, collated=True
+    )
+    collation_result = None
+    if len(manifest.pending(all_run_outputs)) == 0:
+        collation_result = collation_cache.load(
+            manifest.digest(all_run_outputs)
         )
 
+    if collation_result is not None:
+        print("reusing the collation result of {} ...\n".format(
+            campaign_work_dir))
+    else:
+        ingest_campaign_results(campaign, decoder, manifest)
+
         #####################
         # execute collate() #
         #####################
@@ -537,233 +692,149 @@ def flee_analyse_vvp_LoR(config):
             os.path.join(campaign_work_dir, "collation_result.csv"),
             index=False
         )
-        collation_result.to_pickle(
-            os.path.join(campaign_work_dir, "collation_result.pickle")
+        collation_pickle = os.path.join(
+            campaign_work_dir, "collation_result.pickle"
         )
-
-        ###################################
-        #    Post-processing analysis     #
-        ###################################
-
-        if sampler_name == "SCSampler":
-            analysis = uq.analysis.SCAnalysis(
-                sampler=campaign._active_sampler,
-                qoi_cols=[output_column]
-            )
-        elif sampler_name == "PCESampler":
-            analysis = uq.analysis.PCEAnalysis(
-                sampler=campaign._active_sampler,
-                qoi_cols=[output_column]
-            )
-
-        campaign.apply_analysis(analysis)
-        results = campaign.get_last_analysis()
-
-        ###################
-        #    Plotting     #
-        ###################
-        fig_desc = "polynomial_order = {}, num_runs = {}, sampler = {}".format(
-            polynomial_order,
-            campaign.campaign_db.get_num_runs(),
-            sampler_name
-        )
-        props = dict(boxstyle="round", facecolor="wheat", alpha=0.5)
-
-        ########################
-        #    Plot raw data     #
-        ########################
-        output_files = glob.glob(
-            os.path.join(campaign_work_dir + "/**/%s" % (output_filename)),
-            recursive=True
+        collation_result.to_pickle(collation_pickle)
+        collation_cache.save(
+            collation_result, manifest.digest(all_run_outputs),
+            pickle_file=collation_pickle
         )
 
-        fig, ax = plt.subplots()
-        ax.set_xlabel("days")
-        ax.set_ylabel(output_column)
-        fig.suptitle(
-            "RAW data : column {}\n".format(output_column),
-            fontsize=10, fontweight="bold"
-        )
-        ax.set_title(
-            fig_desc, fontsize=8, loc="center",
-            fontweight="bold", bbox=props
-        )
-        for output_file in output_files:
-            total_errors = pd.read_csv(output_file)[
-                output_column].values.tolist()
-            ax.plot(total_errors)
-
-        plot_file_name = "raw[{}]".format(output_column)
-        plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                    dpi=400)
-
-        ###################################
-        #    Plot statistical_moments     #
-        ###################################
-        fig, ax = plt.subplots()
-        ax.set_xlabel("days")
-        ax.set_ylabel("velocity {}".format(output_column))
-        fig.suptitle(
-            "code mean +/- standard deviation\n",
-            fontsize=10, fontweight="bold"
-        )
-        ax.set_title(
-            fig_desc, fontsize=8, loc="center",
-            fontweight="bold", bbox=props
-        )
+    ###################################
+    #    Post-processing analysis     #
+    ###################################
 
-        mean = results.describe(output_column, "mean")
-        std = results.describe(output_column, "std")
-        X = range(len(mean))
-        ax.plot(X, mean, "b-", label="mean")
-        ax.plot(X, mean - std, "--r", label="+1 std-dev")
-        ax.plot(X, mean + std, "--r")
-        ax.fill_between(X, mean - std, mean + std, color="r", alpha=0.2)
-        # plt.tight_layout()
-        plt.legend(loc="best")
-        plot_file_name = "plot_statistical_moments[{}]".format(output_column)
-        plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                    dpi=400)
-
-        ###################################
-        #        Plot sobols_first        #
-        ###################################
-        fig, ax = plt.subplots()
-        ax.set_xlabel("days")
-        ax.set_ylabel("Sobol indices")
-        fig.suptitle(
-            "First order Sobol index [output column = {}]\n".format(
-                output_column),
-            fontsize=10, fontweight="bold"
+    if sampler_name == "SCSampler":
+        analysis = uq.analysis.SCAnalysis(
+            sampler=campaign._active_sampler,
+            qoi_cols=[output_column]
         )
-        ax.set_title(
-            fig_desc, fontsize=8, loc='center',
-            fontweight='bold', bbox=props
+    elif sampler_name == "PCESampler":
+        analysis = uq.analysis.PCEAnalysis(
+            sampler=campaign._active_sampler,
+            qoi_cols=[output_column]
         )
 
-        sobols_first = results.raw_data["sobols_first"][output_column]
-        param_i = 0
-        for v in sobols_first:
-            y = sobols_first[v].ravel()
-            important = False
-            if y[-1] != 0:
-                ax.plot(y, label=v)
-            else:
-                print("%s ignored for plotting" % (v))
-
-            param_i = param_i + 1
-
-        plt.legend(loc='best')
-        # plt.tight_layout()
-        plot_file_name = 'plot_sobols_first[%s]' % (output_column)
-        plt.savefig(os.path.join(campaign_work_dir, plot_file_name),
-                    dpi=400)
-
-        ###############################################################
-        # yml_results contains all campaign info and analysis results #
-        # it will be saved in sobols.yml file                         #
-        ###############################################################
-        S = ruamel.yaml.scalarstring.DoubleQuotedScalarString
-        yml_results = ruamel.yaml.comments.CommentedMap()
-        yml_results.update({'campaign_info': {}})
+    results = analysis.analyse(data_frame=collation_result)
+
+    sobols_first = results.raw_data["sobols_first"][output_column]
+
+    ###############################################################
+    # yml_results contains all campaign info and analysis results #
+    # it will be saved in sobols.yml file                         #
+    ###############################################################
+    S = ruamel.yaml.scalarstring.DoubleQuotedScalarString
+    yml_results = ruamel.yaml.comments.CommentedMap()
+    yml_results.update({'campaign_info': {}})
+    yml_results['campaign_info'].update({
+        'name': S(campaign._active_app_name),
+        'work_dir': S(campaign.work_dir),
+        'num_runs': campaign.campaign_db.get_num_runs(),
+        'output_column': S(output_column),
+        'polynomial_order': polynomial_order,
+        'sampler': S(VVP_campaign_config['sampler_name']),
+        'distribution_type': S(VVP_campaign_config['distribution_type']),
+        'sparse': S(VVP_campaign_config['sparse']),
+        'growth': S(VVP_campaign_config['growth'])
+    })
+    if sampler_name == 'SCSampler':
         yml_results['campaign_info'].update({
-            'name': S(campaign._active_app_name),
-            'work_dir': S(campaign.work_dir),
-            'num_runs': campaign.campaign_db.get_num_runs(),
-            'output_column': S(output_column),
-            'polynomial_order': polynomial_order,
-            'sampler': S(VVP_campaign_config['sampler_name']),
-            'distribution_type': S(VVP_campaign_config['distribution_type']),
-            'sparse': S(VVP_campaign_config['sparse']),
-            'growth': S(VVP_campaign_config['growth'])
+            'quadrature_rule': S(VVP_campaign_config['quadrature_rule']),
+            'midpoint_level1': S(VVP_campaign_config['midpoint_level1']),
+            'dimension_adaptive': S(VVP_campaign_config
+                                    ['dimension_adaptive'])
+        })
+    elif sampler_name == 'PCESampler':
+        yml_results['campaign_info'].update({
+            'rule': S(VVP_campaign_config['quadrature_rule']),
         })
-        if sampler_name == 'SCSampler':
-            yml_results['campaign_info'].update({
-                'quadrature_rule': S(VVP_campaign_config['quadrature_rule']),
-                'midpoint_level1': S(VVP_campaign_config['midpoint_level1']),
-                'dimension_adaptive': S(VVP_campaign_config
-                                        ['dimension_adaptive'])
-            })
-        elif sampler_name == 'PCESampler':
-            yml_results['campaign_info'].update({
-                'rule': S(VVP_campaign_config['quadrature_rule']),
-            })
-
-        ROUND_NDIGITS = 4
-        for param in VVP_campaign_config['selected_vary_parameters']:
-            # I used CommentedMap for adding comments
-            yml_results[param] = ruamel.yaml.comments.CommentedMap()
-            # yml_results.update({param: {}})
-            yml_results[param].update({
-                "sobols_first_mean":
-                    round(float(np.mean(sobols_first[param].ravel())),
-                          ROUND_NDIGITS),
-                "sobols_first_gmean":
-                    round(float(gmean(sobols_first[param].ravel())),
-                          ROUND_NDIGITS),
-                "sobols_first":
-                    np.around(sobols_first[param].ravel(),
-                              ROUND_NDIGITS).tolist()
-            })
-            # add comments to yml
-            '''
-            yml_results[param].yaml_add_eol_comment(
-                "geometric mean, i.e.,  n-th root of (x1 * x2 * … * xn)",
-                "sobols_first_gmean")
-            yml_results[param].yaml_add_eol_comment(
-                "arithmetic mean i.e., (x1 + x2 + … + xn)",
-                "sobols_first_mean")
-            '''
-            yml_results[param].yaml_set_comment_before_after_key(
-                "sobols_first_gmean",
-                before="geometric mean, i.e., n-th root of (x1 * x2 * … * xn)",
-                indent=2)
-            yml_results[param].yaml_set_comment_before_after_key(
-                "sobols_first_mean",
-                before="arithmetic mean i.e., (x1 + x2 + … + xn)/n",
-                indent=2)
-
-        yaml = ruamel.yaml.YAML()
-        yaml.preserve_quotes = True
-        yaml.default_flow_style = None
-        # to Prevent long lines getting wrapped in ruamel.yaml
-        # we set the yaml.width to a big enough value to prevent line-wrap
-        yaml.width = sys.maxsize
-
-        res_file_name = os.path.join(campaign_work_dir, 'sobols.yml')
-        print(res_file_name)
-        with open(res_file_name, 'w') as outfile:
-            yaml.dump(yml_results, outfile)
-            '''
-            yaml.dump(yml_results, outfile,
-                      default_flow_style=None, width=1000)
-            '''
-
-        ########################################
-        # copy sobols.yml file to sobol folder #
-        ########################################
-        print("copy sobols.yml file to sobol folder ...")
-        # here instead of mkdirs and copy, I used rsync
-        local(
-            "rsync -pthrz "
-            "--include='/*/' "
-            "--include='sobols.yml' "
-            "--include='*.png' "
-            "--exclude='*' "
-            "{}  {} ".format(campaign_work_dir, sobol_work_dir)
-        )
-        print("Done ...\n")
 
-    #####################################################
-    # Check the convergence of the SC Sobols indices    #
-    # with polynomial refinement                        #
-    #####################################################
-    ensemble_vvp_LoR(
-        results_dirs_PATH=sobol_work_dir,
-        load_QoIs_function=load_QoIs_function,
-        aggregation_function=plot_convergence,
-        plot_file_path=sobol_work_dir
+    ROUND_NDIGITS = 4
+    for param in VVP_campaign_config['selected_vary_parameters']:
+        # I used CommentedMap for adding comments
+        yml_results[param] = ruamel.yaml.comments.CommentedMap()
+        # yml_results.update({param: {}})
+        yml_results[param].update({
+            "sobols_first_mean":
+                round(float(np.mean(sobols_first[param].ravel())),
+                      ROUND_NDIGITS),
+            "sobols_first_gmean":
+                round(float(gmean(sobols_first[param].ravel())),
+                      ROUND_NDIGITS),
+            "sobols_first":
+                np.around(sobols_first[param].ravel(),
+                          ROUND_NDIGITS).tolist()
+        })
+        # add comments to yml
+        '''
+        yml_results[param].yaml_add_eol_comment(
+            "geometric mean, i.e.,  n-th root of (x1 * x2 * … * xn)",
+            "sobols_first_gmean")
+        yml_results[param].yaml_add_eol_comment(
+            "arithmetic mean i.e., (x1 + x2 + … + xn)",
+            "sobols_first_mean")
+        '''
+        yml_results[param].yaml_set_comment_before_after_key(
+            "sobols_first_gmean",
+            before="geometric mean, i.e., n-th root of (x1 * x2 * … * xn)",
+            indent=2)
+        yml_results[param].yaml_set_comment_before_after_key(
+            "sobols_first_mean",
+            before="arithmetic mean i.e., (x1 + x2 + … + xn)/n",
+            indent=2)
+
+    yaml = ruamel.yaml.YAML()
+    yaml.preserve_quotes = True
+    yaml.default_flow_style = None
+    # to Prevent long lines getting wrapped in ruamel.yaml
+    # we set the yaml.width to a big enough value to prevent line-wrap
+    yaml.width = sys.maxsize
+
+    res_file_name = os.path.join(campaign_work_dir, 'sobols.yml')
+    print(res_file_name)
+    with open(res_file_name, 'w') as outfile:
+        yaml.dump(yml_results, outfile)
+        '''
+        yaml.dump(yml_results, outfile,
+                  default_flow_style=None, width=1000)
+        '''
+
+    plot_data = {
+        "campaign_work_dir": campaign_work_dir,
+        "polynomial_order": polynomial_order,
+        "sampler_name": sampler_name,
+        "num_runs": campaign.campaign_db.get_num_runs(),
+        "output_filename": output_filename,
+        "output_column": output_column,
+        "mean": results.describe(output_column, "mean"),
+        "std": results.describe(output_column, "std"),
+        "sobols_first": sobols_first
+    }
+    with open(os.path.join(campaign_work_dir, "plot_data.pickle"),
+              "wb") as f:
+        pickle.dump(plot_data, f)
+
+    return plot_data
+
+
+def copy_vvp_LoR_order(campaign_work_dir, sobol_work_dir):
+    ########################################
+    # copy sobols.yml file to sobol folder #
+    ########################################
+    print("copy sobols.yml file to sobol folder ...")
+    # here instead of mkdirs and copy, I used rsync
+    local(
+        "rsync -pthrz "
+        "--include='/*/' "
+        "--include='sobols.yml' "
+        "--include='*.png' "
+        "--include='*.svg' "
+        "--include='*.pdf' "
+        "--exclude='*' "
+        "{}  {} ".format(campaign_work_dir, sobol_work_dir)
     )
+    print("Done ...\n")
 
 
 def plot_convergence(scores, plot_file_path):
@@ -826,6 +897,9 @@ def plot_convergence(scores, plot_file_path):
     #       polynomial_order: [po1,po2,...]     #
     #############################################
 
+    if not plots_enabled():
+        return
+
     params = list(results.keys())
     params.remove("polynomial_order")
 
@@ -842,15 +916,75 @@ def plot_convergence(scores, plot_file_path):
     plt.tight_layout()
     plt.legend(loc="best")
     convergence_plot_file_name = "vvp_QoI_convergence.png"
-    plt.savefig(os.path.join(plot_file_path, convergence_plot_file_name),
-                dpi=400)
+    convergence_plot_file = save_figure(
+        fig, os.path.join(plot_file_path, convergence_plot_file_name))
 
     print("=" * 50)
     print("The convergence plot generated ...")
-    print(os.path.join(plot_file_path, convergence_plot_file_name))
+    print(convergence_plot_file)
     print("=" * 50)
 
 
+def read_sim_columns(csv_file):
+    """
+    Return the Day and " sim" columns of an out.csv file as lists.
+    """
+    columns = ["Day"] + [
+        column_name
+        for column_name in pd.read_csv(csv_file, nrows=0).columns
+        if " sim" in column_name
+    ]
+    return pd.read_csv(csv_file, usecols=columns).to_dict(orient="list")
+
+
+def load_sim_columns(csv_files, QoIs=None, days=None, manifest=None):
+    """
+    Read the " sim" columns of the out.csv files of an ensemble, one file at
+    a time, into a preallocated (runs x days x QoIs) array. Days missing in a
+    run are NaN. By default, the QoIs and days are those of the first file.
+    With a ResultsManifest, only files which are new or changed since the
+    last analysis are read.
+
+    The returns values are : QoIs, days, values
+    """
+    if QoIs is None:
+        QoIs = [column_name
+                for column_name in pd.read_csv(csv_files[0], nrows=0).columns
+                if " sim" in column_name
+                ]
+    columns = ["Day"] + list(QoIs)
+
+    values = None
+    for i, csv_file in enumerate(csv_files):
+        if manifest is None:
+            pd_csv = pd.read_csv(csv_file, usecols=columns)
+        else:
+            pd_csv = pd.DataFrame(
+                manifest.decode(csv_file, read_sim_columns)
+            )[columns]
+        if days is None:
+            days = pd_csv["Day"].to_numpy()
+        if values is None:
+            values = np.full((len(csv_files), len(days), len(QoIs)), np.nan)
+        values[i] = pd_csv.set_index("Day").reindex(days)[QoIs].to_numpy()
+
+    return QoIs, days, values
+
+
+def by_day(values):
+    """
+    Turn a (runs x days) array into the per-day samples passed to the
+    similarity measures: a (days x runs) array, or, if some runs do not
+    cover all days, a list of per-day arrays without the missing runs.
+    """
+    values = values.T
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    return [day_values[~day_missing]
+            for day_values, day_missing in zip(values, missing)]
+
+
 def load_QoIs_function(result_dir):
     """
     we load input sobols.yml with this structure:
@@ -2,16 +2,14 @@ from flee import food_flee as flee 	#use food_flee instead of flee to account fo
 from flee.datamanager import handle_refugee_data
 from flee.datamanager import DataTable #DataTable.subtract_dates()
 from flee import InputGeography_food as InputGeography
-import numpy as np
 import pandas as pd
-import flee.postprocessing.analysis as a
 import sys
 
+from run_utils import CampOutput, add_agents, add_agents_to_conflict_zones
 def AddInitialRefugees(e, d, loc):
   """ Add the initial refugees to a location, using the location name"""
   num_refugees = int(d.get_field(loc.name, 0, FullInterpolation=True))
-  for i in range(0, num_refugees):
-    e.addAgent(location=loc)
+  add_agents(e, loc, num_refugees)
 
 def date_to_sim_days(date):
   return DataTable.subtract_dates(date,"2013-12-15")
@@ -82,6 +80,8 @@ if __name__ == "__main__":
 
   MC_log=start_movechance_log(e,end_time)
 
+  camp_output = CampOutput(e, lm, d, camp_locations, end_time)
+
   for t in range(0,end_time):
     #Evaluate needed line for IPC:
     line_IPC=flee.line42day(t,current_i,critict)           #has to go in the time count of flee to choose the values of IPC according to t
@@ -100,8 +100,7 @@ if __name__ == "__main__":
       refugee_debt = 0
 
     #Insert refugee agents
-    for i in range(0, new_refs):
-      e.addAgent(e.pick_conflict_location())
+    add_agents_to_conflict_zones(e, new_refs)
 
     e.refresh_conflict_weights()
     t_data = t
@@ -119,42 +118,8 @@ if __name__ == "__main__":
     e.enact_border_closures(t)
     e.evolve()
 
-    #Calculation of error terms
-    errors = []
-    abs_errors = []
-    loc_data = []
-
-    camps = []
-    for i in camp_locations:
-      camps += [lm[i]]
-      loc_data += [d.get_field(i, t)]
-
-    # calculate retrofitted time.
-    refugees_in_camps_sim = 0
-    for c in camps:
-      refugees_in_camps_sim += c.numAgents
-
-    # calculate errors
-    j=0
-    for i in camp_locations:
-      errors += [a.rel_error(lm[i].numAgents, loc_data[j])]
-      abs_errors += [a.abs_error(lm[i].numAgents, loc_data[j])]
-
-      j += 1
-
-    output = "%s" % t
-
-    for i in range(0,len(errors)):
-      output += ",%s,%s,%s" % (lm[camp_locations[i]].numAgents, loc_data[i], errors[i])
-
-    if refugees_raw>0:
-      #output_string += ",%s,%s,%s,%s" % (float(np.sum(abs_errors))/float(refugees_raw), int(sum(loc_data)), e.numAgents(), refugees_raw)
-      output += ",%s,%s,%s,%s,%s,%s" % (float(np.sum(abs_errors))/float(refugees_raw), int(sum(loc_data)), e.numAgents(), refugees_raw, refugees_in_camps_sim, refugee_debt)
-    else:
-      output += ",0,0,0,0,0,0"
-      #output_string += ",0"
-
+    camp_output.add_day(t, refugees_raw, refugee_debt)
 
-    print(output)
+  camp_output.flush()
 
   MC_log.to_csv("movechance.csv",index_label="Days")
@@ -2,13 +2,10 @@ from flee import flee, spawning
 from flee.datamanager import handle_refugee_data, read_period
 from flee.datamanager import DataTable #DataTable.subtract_dates()
 from flee import InputGeography
-import numpy as np
-import flee.postprocessing.analysis as a
 import sys
+from run_utils import CampOutput
 from flee.SimulationSettings import SimulationSettings
 
-from datetime import datetime, timedelta
-
 if __name__ == "__main__":
 
   start_date,end_time = read_period.read_conflict_period("{}/conflict_period.csv".format(sys.argv[1]))
@@ -60,6 +57,8 @@ if __name__ == "__main__":
   refugee_debt = 0
   refugees_raw = 0 #raw (interpolated) data from TOTAL UNHCR refugee count only.
 
+  camp_output = CampOutput(e, lm, d, camp_locations, end_time, start_date=start_date)
+
   for t in range(0,end_time):
 
     #if t>0:
@@ -73,39 +72,6 @@ if __name__ == "__main__":
     e.enact_border_closures(t)
     e.evolve()
 
-    #Calculation of error terms
-    errors = []
-    abs_errors = []
-    loc_data = []
-
-    camps = []
-    for i in camp_locations:
-      camps += [lm[i]]
-      loc_data += [d.get_field(i, t)]
-
-    # calculate retrofitted time.
-    refugees_in_camps_sim = 0
-    for c in camps:
-      refugees_in_camps_sim += c.numAgents
-
-    # calculate errors
-    j=0
-    for i in camp_locations:
-      errors += [a.rel_error(lm[i].numAgents, loc_data[j])]
-      abs_errors += [a.abs_error(lm[i].numAgents, loc_data[j])]
-
-      j += 1
-
-
-    date = datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=t)
-    output = "%s,%s" % (t, date.strftime("%Y-%m-%d"))
-
-    for i in range(0,len(errors)):
-      output += ",%s,%s,%s" % (lm[camp_locations[i]].numAgents, loc_data[i], errors[i])
-
-    if refugees_raw>0:
-      output += ",%s,%s,%s,%s,%s,%s" % (float(np.sum(abs_errors))/float(refugees_raw), int(sum(loc_data)), e.numAgents(), refugees_raw, refugees_in_camps_sim, refugee_debt)
-    else:
-      output += ",0,0,0,0,0,0"
+    camp_output.add_day(t, refugees_raw, refugee_debt)
 
-    print(output)
+  camp_output.flush()
@@ -6,14 +6,14 @@ import numpy as np
 import flee.postprocessing.analysis as a
 import sys
 
+from run_utils import add_agents
 insert_day0_refugees_in_camps = True
 
 
 def AddInitialRefugees(e, d, loc):
     """ Add the initial refugees to a location, using the location name"""
     num_refugees = int(d.get_field(loc.name, 0, FullInterpolation=True))
-    for i in range(0, num_refugees):
-        e.addAgent(location=loc)
+    add_agents(e, loc, num_refugees)
 
 
 if __name__ == "__main__":
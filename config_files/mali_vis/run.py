@@ -6,11 +6,11 @@ import numpy as np
 import flee.postprocessing.analysis as a
 import sys
 
+from run_utils import add_agents, add_agents_to_conflict_zones
 def AddInitialRefugees(e, d, loc):
   """ Add the initial refugees to a location, using the location name"""
   num_refugees = int(d.get_field(loc.name, 0, FullInterpolation=True))
-  for i in range(0, num_refugees):
-    e.addAgent(location=loc)
+  add_agents(e, loc, num_refugees)
 
 def date_to_sim_days(date):
   return DataTable.subtract_dates(date,"2012-02-29")
@@ -81,8 +81,7 @@ if __name__ == "__main__":
       refugee_debt = 0
 
     #Insert refugee agents
-    for i in range(0, new_refs):
-      e.addAgent(e.pick_conflict_location())
+    add_agents_to_conflict_zones(e, new_refs)
 
     e.refresh_conflict_weights()
     t_data = t
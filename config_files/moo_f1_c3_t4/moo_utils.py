@@ -0,0 +1,176 @@
+import csv
+import os
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# the only columns of agents.out.* needed for the objective evaluation
+AGENTS_OUT_COLUMNS = ["agent location", "distance_moved_this_timestep",
+                      "distance_travelled"]
+
+
+def agents_avg_distance(agents_out_files, camp_name, chunksize=1000000):
+    """
+    Average distance travelled by the agents that moved into camp_name,
+    over all agents.out.* files.
+    The files are streamed in chunks, reading only the required columns,
+    and the filtered mean is accumulated incrementally.
+    """
+    total_distance = 0.0
+    num_agents = 0
+
+    for filename in agents_out_files:
+        for chunk in pd.read_csv(filename, usecols=AGENTS_OUT_COLUMNS,
+                                 chunksize=chunksize):
+            # filter rows for agent location == camp_name
+            distance = chunk.loc[
+                (chunk["agent location"] == camp_name) &
+                (chunk["distance_moved_this_timestep"] > 0),
+                "distance_travelled"
+            ]
+            total_distance += distance.sum()
+            num_agents += distance.count()
+
+    if num_agents == 0:
+        return np.nan
+
+    return total_distance / num_agents
+
+
+class Geography:
+    """
+    The locations of a country and the routes of the MOO input_csv, read once
+    per MOO run.
+
+    Nearest-location queries for all camps of a population are answered with
+    one vectorised haversine calculation, and routes.csv is kept in memory and
+    only written, with the route to the camp changed, to each SWEEP dir.
+    """
+
+    # in kilometres
+    EARTH_RADIUS = 6371
+
+    def __init__(self, input_dir, country="South_Sudan"):
+        self.names = []
+        lat = []
+        lon = []
+        with open(os.path.join(input_dir, "locations.csv"), newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if row[2] == country:
+                    self.names.append(row[0])
+                    lat.append(float(row[3]))
+                    lon.append(float(row[4]))
+        self.names = np.array(self.names)
+        self.lat = np.radians(lat)
+        self.lon = np.radians(lon)
+
+        self.routes = pd.read_csv(os.path.join(input_dir, "routes.csv"))
+
+    def closest_locations(self, camp_lon, camp_lat):
+        """
+        Return the nearest location to each camp, and the haversine distance
+        between them, as two arrays.
+        """
+        camp_lon = np.radians(np.asarray(camp_lon, dtype=float))[:, None]
+        camp_lat = np.radians(np.asarray(camp_lat, dtype=float))[:, None]
+
+        # (camps x locations) haversine distances
+        phi = camp_lat - self.lat
+        lam = self.lon - camp_lon
+        a = np.sin(phi / 2) ** 2 + \
+            np.cos(self.lat) * np.cos(camp_lat) * np.sin(lam / 2) ** 2
+        dist = self.EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        index_min_dist = np.argmin(dist, axis=1)
+        min_dist = dist[np.arange(len(index_min_dist)), index_min_dist]
+        return self.names[index_min_dist], min_dist
+
+    def write_routes(self, routes_csv, nearest_loc, min_dist, camp_name="Z"):
+        """
+        Write routes.csv with the route to camp_name starting from nearest_loc
+        and having length min_dist.
+        """
+        routes = self.routes.copy()
+        routes["distance"] = routes["distance"].astype(object)
+        is_camp = routes["name2"] == camp_name
+        routes.loc[is_camp, "#name1"] = nearest_loc
+        routes.loc[is_camp, "distance"] = str(min_dist)
+        routes.to_csv(routes_csv, index=False)
+
+
+def available_cpus():
+    """
+    Number of CPUs this process is allowed to run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def local_workers(cores_per_job, num_jobs):
+    """
+    Number of jobs to run concurrently on the local machine, when each job
+    needs cores_per_job cores.
+    """
+    workers = max(1, available_cpus() // max(1, cores_per_job))
+    return max(1, min(workers, num_jobs))
+
+
+def _start_sh_job(sh_job_script):
+    job_dir = os.path.dirname(sh_job_script)
+    job_name = "SWEEP_{}".format(os.path.basename(job_dir))
+    stdout = open(os.path.join(job_dir, "{}.stdout".format(job_name)), "w")
+    stderr = open(os.path.join(job_dir, "{}.stderr".format(job_name)), "w")
+    p = subprocess.Popen(["bash", sh_job_script], cwd=job_dir,
+                         stdout=stdout, stderr=stderr)
+    return p, stdout, stderr
+
+
+def run_sh_jobs(sh_jobs_scripts, cores_per_job=1, poll_interval=0.5):
+    """
+    Run the SWEEP job scripts concurrently on the local machine.
+    The number of concurrent jobs is bounded by the available CPUs divided by
+    the cores used by each job. The stdout/stderr of each job is written to
+    SWEEP_<n>.stdout/SWEEP_<n>.stderr in its SWEEP dir, as with QCG-PilotJob.
+    If any job returns a non-zero code, the running jobs are terminated and
+    a RuntimeError is raised.
+    """
+    workers = local_workers(cores_per_job, len(sh_jobs_scripts))
+    print("running {} SWEEP jobs with {} worker(s)".format(
+        len(sh_jobs_scripts), workers))
+
+    pending = list(sh_jobs_scripts)
+    running = {}
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < workers:
+                sh_job_script = pending.pop(0)
+                running[sh_job_script] = _start_sh_job(sh_job_script)
+
+            for sh_job_script, (p, stdout, stderr) in list(running.items()):
+                if p.poll() is None:
+                    continue
+                stdout.close()
+                stderr.close()
+                del running[sh_job_script]
+                if p.returncode != 0:
+                    raise RuntimeError(
+                        "\njob execution encountered an error (return code {}) "
+                        "while executing '{}', see {}".format(
+                            p.returncode, sh_job_script, stderr.name)
+                    )
+
+            if len(running) >= workers or len(pending) == 0:
+                time.sleep(poll_interval)
+    finally:
+        for p, stdout, stderr in running.values():
+            p.terminate()
+            p.wait()
+            stdout.close()
+            stderr.close()
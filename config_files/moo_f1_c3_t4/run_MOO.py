@@ -24,6 +24,7 @@ from pymoo.core.problem import Problem
 from pymoo.factory import get_performance_indicator
 
 from moo_algs.bce_moead import BCEMOEAD
+from moo_utils import agents_avg_distance, run_sh_jobs
 
 work_dir = os.path.dirname(os.path.abspath(__file__))
 EXEC_LOG_FILE = None
@@ -79,26 +80,7 @@ class FLEE_MOO_Problem(Problem):
         self.cores = cores
 
     def avg_distance(self, agents_out_files, camp_name):
-
-        df_array = [pd.read_csv(filename, index_col=None, header=0)
-                    for filename in agents_out_files]
-
-        df = pd.concat(df_array, axis=0, ignore_index=True)
-
-        # filter rwos for agent location == camp_name
-        df = df[(df["agent location"] == camp_name) &
-                (df["distance_moved_this_timestep"] > 0)
-                ]
-
-        df.to_csv(os.path.join(
-            os.path.dirname(agents_out_files[0]), "df_agents.out.csv"),
-            sep=",",
-            mode="w",
-            index=False,
-            encoding='utf-8'
-        )
-
-        return df["distance_travelled"].mean()
+        return agents_avg_distance(agents_out_files, camp_name)
 
     def find_closest_location_to_camp(self, x_coordinate, y_coordinate):
         # (1) create conflict zone A, B, C, towns D, E, F, G
@@ -311,26 +293,14 @@ class FLEE_MOO_Problem(Problem):
 
     def run_simulation_without_PJ(self, sh_jobs_scripts):
         """
-        running simulation from SWEEP dir without using PJ
+        running simulation from SWEEP dir without using PJ, with as many
+        concurrent jobs as the available cores allow
         """
-        for sh_job_scripts in sh_jobs_scripts:
-            # subprocess.check_output(sh_job_scripts, shell=True)
-            try:
-                p = subprocess.Popen(sh_job_scripts, shell=True,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-                (stdout, stderr) = p.communicate()
-            except Exception as e:
-                raise RuntimeError("Unexpected error: {}".format(e))
-                sys.exit()
-
-            acceptable_err_subprocesse_ret_codes = [0]
-            if p.returncode not in acceptable_err_subprocesse_ret_codes:
-                raise RuntimeError(
-                    "\njob execution encountered an error (return code {})"
-                    "while executing '{}'".format(p.returncode, command)
-                )
-                sys.exit(0)
+        if self.execution_mode.lower() == "parallel":
+            cores_per_job = self.cores
+        else:
+            cores_per_job = 1
+        run_sh_jobs(sh_jobs_scripts, cores_per_job=cores_per_job)
 
     def _evaluate(self, population, out, *args, **kwargs):
         """
@@ -14,7 +14,6 @@ from pprint import pprint, pformat
 
 import geopandas
 from shapely.geometry import Point
-from math import sin, cos, atan2, sqrt, pi
 
 from pymoo.algorithms.moo.nsga2 import NSGA2
 from pymoo.algorithms.moo.nsga3 import NSGA3
@@ -27,6 +26,8 @@ from pymoo.core.problem import Problem
 from pymoo.factory import get_performance_indicator
 
 from moo_algs.bce_moead import BCEMOEAD
+from moo_utils import Geography, ObjectiveCache, SurrogateScreen, \
+    agents_avg_distance, run_sh_jobs
 
 
 work_dir = os.path.dirname(os.path.abspath(__file__))
@@ -70,7 +71,7 @@ def read_MOO_setting_yaml():
 class FLEE_MOO_Problem(Problem):
 
     def __init__(self, execution_mode, simulation_period, cores,
-                 work_dir=work_dir):
+                 work_dir=work_dir, surrogate_setting=None):
 
         # TODO: add input vraibles to MOO_setting.yaml file
         super().__init__(n_var=1,
@@ -83,73 +84,39 @@ class FLEE_MOO_Problem(Problem):
         self.simulation_period = simulation_period
         self.cores = cores
 
-    def avg_distance(self, agents_out_files, camp_name):
-
-        df_array = [pd.read_csv(filename, index_col=None, header=0)
-                    for filename in agents_out_files]
-
-        df = pd.concat(df_array, axis=0, ignore_index=True)
-
-        # filter rwos for agent location == camp_name
-        df = df[(df["agent location"] == camp_name) &
-                (df["distance_moved_this_timestep"] > 0)
-                ]
-
-        df.to_csv(os.path.join(
-            os.path.dirname(agents_out_files[0]), "df_agents.out.csv"),
-            sep=",",
-            mode="w",
-            index=False,
-            encoding='utf-8'
+        # locations and routes of the input_csv, read once per MOO run
+        self.geography = Geography(os.path.join(work_dir, "input_csv"))
+
+        # objective values of the camps evaluated so far
+        self.objective_cache = ObjectiveCache(
+            cache_file=os.path.join(work_dir, "objective_cache.json"),
+            simsetting_file=os.path.join(work_dir, "simsetting.csv"),
+            simulation_period=simulation_period,
+            input_paths=[os.path.join(work_dir, name) for name in
+                         ["input_csv", "source_data", "run.py", "run_par.py",
+                          "camp_locations.csv"]]
         )
 
-        return df["distance_travelled"].mean()
-
-    def find_closest_location_to_camp(self, camp_lon, camp_lat):
-        # in kilometres
-        R = 6371
-        p = pi/180
-
-        dist = []
-        locations=[]
-
-        # Read lat(Latitude) and lon(Longitude) column in locations.csv file row by row.
-        locations_path = os.path.join(self.work_dir, "input_csv", "locations.csv")
-
-        with open(locations_path, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)
-            # Iterate over each row after the header in the csv
-            for row in reader:
-                # row variable is a list that represents a row in csv
-                # print(row)
-                if row[2] == 'South_Sudan':
-                    locations.append(row[0])
-                    lat = float(row[3])
-                    lon = float(row[4])
-
-                    MOO_log(msg="\tlocation ={}".format(row[0]))
-                    MOO_log(msg="\tlongitude ={}".format(lon))
-                    MOO_log(msg="\tlatitude ={}".format(lat))
-
-                    #  calculate the haversine distance between Z and other locations in south sudan, respectively.
-                    phi = (camp_lat-lat) * p
-                    lam = (lon-camp_lon) * p
-
-                    a = sin(phi/2)*sin(phi/2)+cos(lat*p)*cos(camp_lat*p)*sin(lam/2)*sin(lam/2);
-                    c = 2*atan2(sqrt(a),sqrt(1-a))
-
-                    dist.append(R * c)
-
-        MOO_log(msg="\tall locations ={}".format(locations))
-        MOO_log(msg="\tdistance between these locations and Z={}".format(dist))
+        # optional surrogate model to pre-screen the new camps
+        self.surrogate = None
+        if surrogate_setting is not None and surrogate_setting["enabled"]:
+            camps = pd.read_csv(os.path.join(work_dir, "camp_locations.csv"))
+            self.surrogate = SurrogateScreen(
+                objective_cache=self.objective_cache,
+                features=camps[["lon", "lat"]].to_numpy(),
+                objective_signs=[1, -1, 1],
+                **surrogate_setting
+            )
 
-        # find the shortest path
-        min_dist = np.amin(dist)
-        index_min_dist = dist.index(min_dist)
-        nearest_loc = locations[index_min_dist]
+    def avg_distance(self, agents_out_files, camp_name):
+        return agents_avg_distance(agents_out_files, camp_name)
 
-        return nearest_loc, min_dist
+    def find_closest_location_to_camp(self, camp_lon, camp_lat):
+        """
+        Find the nearest location to each of the given camps, and the
+        haversine distance between them.
+        """
+        return self.geography.closest_locations(camp_lon, camp_lat)
 
 
 # --------------------------------------------------------------------------
@@ -165,66 +132,58 @@ class FLEE_MOO_Problem(Problem):
         with open(coordinates_csv_PATH, newline='') as csvfile:
             reader = csv.reader(csvfile)
             next(reader)
-            # print(header)
-            # Iterate over each row after the header in the csv
-            for row in reader:
-                # row variable is a list that represents a row in csv
-                # print(row)
-                lon = float(row[0])
-                lat = float(row[1])
-
-                MOO_log(msg="\tcamp lon ={}".format(lon))
-                MOO_log(msg="\tcamp lat ={}".format(lat))
-
-                # 1. Find the nearest location to camp and calculate the distance
-                # between them.
-                nearest_loc, min_dist = self.find_closest_location_to_camp(
-                    camp_lon=float(lon), camp_lat=float(lat)
-                )
+            rows = [row for row in reader]
 
-                # 2. Read routes.csv and modify the data (i.e., the nearest
-                # location to camp and the distance between them)
-                routes_csv_PATH = os.path.join(self.work_dir, "input_csv", "routes.csv")
-
-                df = pd.read_csv(routes_csv_PATH)
-                # change one value of a row
-
-                df.loc[lambda df: df['name2'] == 'Z', lambda df:'#name1'] = nearest_loc
-                df.loc[lambda df: df['name2'] == 'Z', lambda df:'distance'] = str(min_dist)
-
-
-                MOO_log(msg="\tLatitude of camp Z: {} \n\t"
-                        "Longitude of camp Z: {}\n\t"
-                        "nearest location: {}\n\t"
-                        "distance to {}:{}".format(
-                            float(lon),
-                            float(lat),
-                            nearest_loc,
-                            nearest_loc, min_dist)
-                        )
-
-                # 3. Write the updated route.csv in the moo_ssudan SWEEP
-                # directory.
-                sweep_dir = os.path.join(self.work_dir, "SWEEP")
-                # curr_dir_count = len(os.listdir(sweep_dir))
-                curr_dir_count = self.cnt_SWEEP_dir
-                sub_dir_SWEEP = os.path.join(
-                    sweep_dir, "{}".format(curr_dir_count + 1), "input_csv"
-                )
+        # 1. Find the nearest location to each camp and calculate the distance
+        # between them, for all camps at once.
+        nearest_locs, min_dists = self.find_closest_location_to_camp(
+            camp_lon=[float(row[0]) for row in rows],
+            camp_lat=[float(row[1]) for row in rows]
+        )
 
-                if os.path.exists(sub_dir_SWEEP):
-                    raise RuntimeError(
-                        "SWEEP dir {} is exists !!!!!".format(sub_dir_SWEEP)
+        # Iterate over each row after the header in the csv
+        for row, nearest_loc, min_dist in zip(rows, nearest_locs, min_dists):
+            # row variable is a list that represents a row in csv
+            # print(row)
+            lon = float(row[0])
+            lat = float(row[1])
+
+            MOO_log(msg="\tcamp lon ={}".format(lon))
+            MOO_log(msg="\tcamp lat ={}".format(lat))
+
+            MOO_log(msg="\tLatitude of camp Z: {} \n\t"
+                    "Longitude of camp Z: {}\n\t"
+                    "nearest location: {}\n\t"
+                    "distance to {}:{}".format(
+                        float(lon),
+                        float(lat),
+                        nearest_loc,
+                        nearest_loc, min_dist)
                     )
 
-                os.makedirs(sub_dir_SWEEP)
-                MOO_log(msg="\tgenerates SWEEP : {}".format(sub_dir_SWEEP))
+            # 2. Write the updated route.csv in the moo_ssudan SWEEP
+            # directory.
+            sweep_dir = os.path.join(self.work_dir, "SWEEP")
+            # curr_dir_count = len(os.listdir(sweep_dir))
+            curr_dir_count = self.cnt_SWEEP_dir
+            sub_dir_SWEEP = os.path.join(
+                sweep_dir, "{}".format(curr_dir_count + 1), "input_csv"
+            )
+
+            if os.path.exists(sub_dir_SWEEP):
+                raise RuntimeError(
+                    "SWEEP dir {} is exists !!!!!".format(sub_dir_SWEEP)
+                )
+
+            os.makedirs(sub_dir_SWEEP)
+            MOO_log(msg="\tgenerates SWEEP : {}".format(sub_dir_SWEEP))
 
-                updated_routes_csv_PATH = os.path.join(sub_dir_SWEEP, "routes.csv")
-                df.to_csv(updated_routes_csv_PATH, index = False)
+            updated_routes_csv_PATH = os.path.join(sub_dir_SWEEP, "routes.csv")
+            self.geography.write_routes(updated_routes_csv_PATH,
+                                        nearest_loc, min_dist)
 
-                self.cnt_SWEEP_dir += 1
-                MOO_log(msg="\t{}".format("-" * 30))
+            self.cnt_SWEEP_dir += 1
+            MOO_log(msg="\t{}".format("-" * 30))
 
     # --------------------------------------------------------------------------
 
@@ -344,26 +303,14 @@ class FLEE_MOO_Problem(Problem):
 
     def run_simulation_without_PJ(self, sh_jobs_scripts):
         """
-        running simulation from SWEEP dir without using PJ
+        running simulation from SWEEP dir without using PJ, with as many
+        concurrent jobs as the available cores allow
         """
-        for sh_job_scripts in sh_jobs_scripts:
-            # subprocess.check_output(sh_job_scripts, shell=True)
-            try:
-                p = subprocess.Popen(sh_job_scripts, shell=True,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-                (stdout, stderr) = p.communicate()
-            except Exception as e:
-                raise RuntimeError("Unexpected error: {}".format(e))
-                sys.exit()
-
-            acceptable_err_subprocesse_ret_codes = [0]
-            if p.returncode not in acceptable_err_subprocesse_ret_codes:
-                raise RuntimeError(
-                    "\njob execution encountered an error (return code {})"
-                    "while executing '{}'".format(p.returncode, command)
-                )
-                sys.exit(0)
+        if self.execution_mode.lower() == "parallel":
+            cores_per_job = self.cores
+        else:
+            cores_per_job = 1
+        run_sh_jobs(sh_jobs_scripts, cores_per_job=cores_per_job)
 
 #-------------------------------------end------------------------------------
 
@@ -404,11 +351,24 @@ class FLEE_MOO_Problem(Problem):
             self.work_dir, "input_csv", "coordinates.csv"
         )
 
+        # only the camps which are not in the objective cache, and are not
+        # duplicated in the population, need a flee simulation
+        new_rows = self.objective_cache.missing(X_1D_array)
+        MOO_log(msg="\t{} of {} camps found in the objective cache".format(
+            pop_size - len(new_rows), pop_size))
+
+        # in surrogate mode, only the most promising new camps are simulated
+        predicted = {}
+        if self.surrogate is not None:
+            new_rows, predicted = self.surrogate.screen(X_1D_array, new_rows)
+            MOO_log(msg="\t{} camps predicted by the surrogate model".format(
+                len(predicted)))
+
         #  Save data to CSV
         with open(coordinates_csv_PATH, "w", newline="") as file:
             writer = csv.writer(file, delimiter=",")
             writer.writerow(["lon", "lat"])  # header
-            writer.writerows(population)
+            writer.writerows([population[i] for i in new_rows])
 
 
 # ------------------------------end-----------------------------------
@@ -503,7 +463,9 @@ class FLEE_MOO_Problem(Problem):
         #####################################
         # run simulation per each SWEEP dir #
         #####################################
-        if USE_PJ is False:
+        if len(sh_jobs_scripts) == 0:
+            MOO_log(msg="\tno new SWEEP dirs to run")
+        elif USE_PJ is False:
             self.run_simulation_without_PJ(sh_jobs_scripts)
         else:
             self.run_simulation_with_PJ(sh_jobs_scripts)
@@ -525,7 +487,12 @@ class FLEE_MOO_Problem(Problem):
 
         MOO_log(msg="=" * 50)
         # Fetch the objective values
-        objectives = pd.read_csv("objectives.csv")
+        new_objectives = pd.read_csv("objectives.csv")
+        self.objective_cache.update(X_1D_array[new_rows],
+                                    new_objectives.values.tolist())
+        objectives = pd.DataFrame(
+            self.objective_cache.lookup(X_1D_array, predicted),
+            columns=new_objectives.columns)
         MOO_log(msg="objectives.csv =\n{}".format(pformat(objectives)))
 
         # objective 1: minimize average distance travelled by each arriving
@@ -587,6 +554,7 @@ if __name__ == "__main__":
         execution_mode=execution_mode,
         simulation_period=simulation_period,
         cores=cores,
+        surrogate_setting=MOO_CONFIG.get("surrogate"),
     )
 
     algorithm = None
@@ -0,0 +1,356 @@
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# the only columns of agents.out.* needed for the objective evaluation
+AGENTS_OUT_COLUMNS = ["agent location", "distance_moved_this_timestep",
+                      "distance_travelled"]
+
+
+def agents_avg_distance(agents_out_files, camp_name, chunksize=1000000):
+    """
+    Average distance travelled by the agents that moved into camp_name,
+    over all agents.out.* files.
+    The files are streamed in chunks, reading only the required columns,
+    and the filtered mean is accumulated incrementally.
+    """
+    total_distance = 0.0
+    num_agents = 0
+
+    for filename in agents_out_files:
+        for chunk in pd.read_csv(filename, usecols=AGENTS_OUT_COLUMNS,
+                                 chunksize=chunksize):
+            # filter rows for agent location == camp_name
+            distance = chunk.loc[
+                (chunk["agent location"] == camp_name) &
+                (chunk["distance_moved_this_timestep"] > 0),
+                "distance_travelled"
+            ]
+            total_distance += distance.sum()
+            num_agents += distance.count()
+
+    if num_agents == 0:
+        return np.nan
+
+    return total_distance / num_agents
+
+# files written to input_csv by _evaluate for every generation, which hold
+# the candidate camps and therefore are not part of the evaluation inputs
+CANDIDATE_FILES = ["coordinates.csv", "selectedCamps.csv"]
+
+
+def files_hash(paths, exclude=CANDIDATE_FILES):
+    """
+    sha1 over the names and contents of the given files and directories.
+    Paths that do not exist are skipped.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            h.update(files_hash([os.path.join(path, name) for name in names
+                                 if name not in exclude],
+                                exclude=exclude).encode())
+        elif os.path.isfile(path):
+            h.update(os.path.basename(path).encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class ObjectiveCache:
+    """
+    Persistent cache of the objective values of evaluated camp candidates.
+
+    The values are stored in a json file in the MOO work dir, per evaluation
+    context (the simsetting hash, the simulation period and the hash of the
+    input files), and within a context by candidate key (the camp index).
+    """
+
+    def __init__(self, cache_file, simsetting_file, simulation_period,
+                 input_paths):
+        self.cache_file = cache_file
+        self.context = "{}/{}/{}".format(files_hash([simsetting_file]),
+                                         simulation_period,
+                                         files_hash(input_paths))
+        self.values = self._read().get(self.context, {})
+
+    def _read(self):
+        if not os.path.isfile(self.cache_file):
+            return {}
+        with open(self.cache_file) as f:
+            return json.load(f)
+
+    def missing(self, keys):
+        """
+        Positions of the first occurrence of each key that is not cached,
+        i.e. the candidates which still have to be simulated.
+        """
+        new_keys = set()
+        positions = []
+        for i, key in enumerate(keys):
+            key = str(key)
+            if key not in self.values and key not in new_keys:
+                new_keys.add(key)
+                positions.append(i)
+        return positions
+
+    def update(self, keys, rows):
+        """
+        Store the objective values of the given keys, and save the cache.
+        """
+        for key, row in zip(keys, rows):
+            self.values[str(key)] = list(row)
+
+        cache = self._read()
+        cache[self.context] = self.values
+        tmp_file = "{}.tmp".format(self.cache_file)
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def lookup(self, keys, predicted=None):
+        """
+        Objective values of the given keys, taken from the cache or, for the
+        keys which were not simulated, from the predicted values.
+        """
+        if predicted is None:
+            predicted = {}
+        return [self.values[str(key)] if str(key) in self.values
+                else predicted[str(key)] for key in keys]
+
+
+def non_dominated_ranks(F):
+    """
+    Rank of the non-dominated front of each row of F (to be minimised),
+    starting from 0 for the Pareto front.
+    """
+    F = np.asarray(F, dtype=float)
+    # dominates[i, j] is True if row i dominates row j
+    dominates = np.all(F[:, None, :] <= F[None, :, :], axis=2) & \
+        np.any(F[:, None, :] < F[None, :, :], axis=2)
+
+    ranks = np.full(len(F), -1)
+    rank = 0
+    remaining = np.ones(len(F), dtype=bool)
+    while remaining.any():
+        front = remaining & ~dominates[remaining].any(axis=0)
+        ranks[front] = rank
+        remaining &= ~front
+        rank += 1
+    return ranks
+
+
+class SurrogateScreen:
+    """
+    Surrogate-assisted pre-screening of the new camp candidates.
+
+    Once initial_design camps have been simulated, a model fitted to the
+    features of the simulated camps and their cached objective values
+    predicts the objectives of the new camps. Only the real_fraction most
+    promising new camps, by non-dominated rank of the predictions, are then
+    simulated with flee; the other camps get the predicted values.
+    """
+
+    def __init__(self, objective_cache, features, objective_signs,
+                 model="random_forest", model_args=None, initial_design=20,
+                 real_fraction=0.1, enabled=True):
+        self.objective_cache = objective_cache
+        self.features = np.asarray(features, dtype=float)
+        self.objective_signs = np.asarray(objective_signs, dtype=float)
+        self.initial_design = initial_design
+        self.real_fraction = real_fraction
+
+        if model_args is None:
+            model_args = {}
+        model_args = model_args.get(model) or {}
+
+        try:
+            from sklearn.pipeline import make_pipeline
+            from sklearn.preprocessing import StandardScaler
+            if model == "random_forest":
+                from sklearn.ensemble import RandomForestRegressor
+                regressor = RandomForestRegressor(**model_args)
+            elif model == "gaussian_process":
+                from sklearn.gaussian_process import GaussianProcessRegressor
+                regressor = GaussianProcessRegressor(normalize_y=True,
+                                                     **model_args)
+            else:
+                raise RuntimeError(
+                    "The input surrogate model {} not valid!".format(model))
+        except ImportError:
+            raise RuntimeError(
+                "The surrogate MOO mode requires scikit-learn to be installed")
+
+        self.model = make_pipeline(StandardScaler(), regressor)
+
+    def screen(self, keys, new_rows):
+        """
+        Split the positions new_rows of the new camps in keys into the ones
+        to be simulated and the ones to be predicted.
+        Returns (simulated rows, dict of key -> predicted objective values).
+        """
+        simulated = {int(k): v for k, v in self.objective_cache.values.items()
+                     if not np.isnan(v).any()}
+        if len(simulated) < self.initial_design or len(new_rows) == 0:
+            return new_rows, {}
+
+        self.model.fit(self.features[list(simulated.keys())],
+                       np.array(list(simulated.values())))
+
+        new_keys = [int(keys[i]) for i in new_rows]
+        F = self.model.predict(self.features[new_keys]).reshape(
+            len(new_keys), -1)
+
+        # rank the predictions, with all objectives to be minimised
+        ranks = non_dominated_ranks(F * self.objective_signs)
+        num_real = max(1, int(np.ceil(self.real_fraction * len(new_rows))))
+        promising = set(np.argsort(ranks, kind="stable")[:num_real])
+
+        rows = [row for i, row in enumerate(new_rows) if i in promising]
+        predicted = {str(key): F[i].tolist() for i, key in enumerate(new_keys)
+                     if i not in promising}
+        return rows, predicted
+
+
+class Geography:
+    """
+    The locations of a country and the routes of the MOO input_csv, read once
+    per MOO run.
+
+    Nearest-location queries for all camps of a population are answered with
+    one vectorised haversine calculation, and routes.csv is kept in memory and
+    only written, with the route to the camp changed, to each SWEEP dir.
+    """
+
+    # in kilometres
+    EARTH_RADIUS = 6371
+
+    def __init__(self, input_dir, country="South_Sudan"):
+        self.names = []
+        lat = []
+        lon = []
+        with open(os.path.join(input_dir, "locations.csv"), newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if row[2] == country:
+                    self.names.append(row[0])
+                    lat.append(float(row[3]))
+                    lon.append(float(row[4]))
+        self.names = np.array(self.names)
+        self.lat = np.radians(lat)
+        self.lon = np.radians(lon)
+
+        self.routes = pd.read_csv(os.path.join(input_dir, "routes.csv"))
+
+    def closest_locations(self, camp_lon, camp_lat):
+        """
+        Return the nearest location to each camp, and the haversine distance
+        between them, as two arrays.
+        """
+        camp_lon = np.radians(np.asarray(camp_lon, dtype=float))[:, None]
+        camp_lat = np.radians(np.asarray(camp_lat, dtype=float))[:, None]
+
+        # (camps x locations) haversine distances
+        phi = camp_lat - self.lat
+        lam = self.lon - camp_lon
+        a = np.sin(phi / 2) ** 2 + \
+            np.cos(self.lat) * np.cos(camp_lat) * np.sin(lam / 2) ** 2
+        dist = self.EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        index_min_dist = np.argmin(dist, axis=1)
+        min_dist = dist[np.arange(len(index_min_dist)), index_min_dist]
+        return self.names[index_min_dist], min_dist
+
+    def write_routes(self, routes_csv, nearest_loc, min_dist, camp_name="Z"):
+        """
+        Write routes.csv with the route to camp_name starting from nearest_loc
+        and having length min_dist.
+        """
+        routes = self.routes.copy()
+        routes["distance"] = routes["distance"].astype(object)
+        is_camp = routes["name2"] == camp_name
+        routes.loc[is_camp, "#name1"] = nearest_loc
+        routes.loc[is_camp, "distance"] = str(min_dist)
+        routes.to_csv(routes_csv, index=False)
+
+
+def available_cpus():
+    """
+    Number of CPUs this process is allowed to run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def local_workers(cores_per_job, num_jobs):
+    """
+    Number of jobs to run concurrently on the local machine, when each job
+    needs cores_per_job cores.
+    """
+    workers = max(1, available_cpus() // max(1, cores_per_job))
+    return max(1, min(workers, num_jobs))
+
+
+def _start_sh_job(sh_job_script):
+    job_dir = os.path.dirname(sh_job_script)
+    job_name = "SWEEP_{}".format(os.path.basename(job_dir))
+    stdout = open(os.path.join(job_dir, "{}.stdout".format(job_name)), "w")
+    stderr = open(os.path.join(job_dir, "{}.stderr".format(job_name)), "w")
+    p = subprocess.Popen(["bash", sh_job_script], cwd=job_dir,
+                         stdout=stdout, stderr=stderr)
+    return p, stdout, stderr
+
+
+def run_sh_jobs(sh_jobs_scripts, cores_per_job=1, poll_interval=0.5):
+    """
+    Run the SWEEP job scripts concurrently on the local machine.
+    The number of concurrent jobs is bounded by the available CPUs divided by
+    the cores used by each job. The stdout/stderr of each job is written to
+    SWEEP_<n>.stdout/SWEEP_<n>.stderr in its SWEEP dir, as with QCG-PilotJob.
+    If any job returns a non-zero code, the running jobs are terminated and
+    a RuntimeError is raised.
+    """
+    workers = local_workers(cores_per_job, len(sh_jobs_scripts))
+    print("running {} SWEEP jobs with {} worker(s)".format(
+        len(sh_jobs_scripts), workers))
+
+    pending = list(sh_jobs_scripts)
+    running = {}
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < workers:
+                sh_job_script = pending.pop(0)
+                running[sh_job_script] = _start_sh_job(sh_job_script)
+
+            for sh_job_script, (p, stdout, stderr) in list(running.items()):
+                if p.poll() is None:
+                    continue
+                stdout.close()
+                stderr.close()
+                del running[sh_job_script]
+                if p.returncode != 0:
+                    raise RuntimeError(
+                        "\njob execution encountered an error (return code {}) "
+                        "while executing '{}', see {}".format(
+                            p.returncode, sh_job_script, stderr.name)
+                    )
+
+            if len(running) >= workers or len(pending) == 0:
+                time.sleep(poll_interval)
+    finally:
+        for p, stdout, stderr in running.values():
+            p.terminate()
+            p.wait()
+            stdout.close()
+            stderr.close()
@@ -4,18 +4,37 @@
 ######################################################################  
 '''
 import argparse
+import os
+import shutil
 import sys
+import uuid
+from resource_planner import read_step_times, plan_cores
+from resource_planner import save_step_times, STEP_TIMES_FILE
+from weather_cache import build_weather_cache, is_current
 parser = argparse.ArgumentParser()
 # Required parameters (mandatory)
 parser.add_argument('--COUPLING_TYPE', required=True,
                     action="store", type=str,
-                    choices=['file', 'muscle3'])
+                    choices=['file', 'muscle3', 'shm'])
 parser.add_argument('--WEATHER_COUPLING', required=True,
                     action="store", type=str)
 parser.add_argument('--NUM_WORKERS', required=True,
                     action="store", type=int)
 parser.add_argument('--WORKER_CORES', required=True,
                     action="store", type=int)
+parser.add_argument('--OUTPUT_FLUSH_INTERVAL', default=100,
+                    action="store", type=int)
+parser.add_argument('--PIPELINED_COUPLING', default="False",
+                    action="store", type=str)
+# cores of each macro and micro instance, WORKER_CORES by default
+parser.add_argument('--MACRO_CORES', default=0,
+                    action="store", type=int)
+parser.add_argument('--MICRO_CORES', default=0,
+                    action="store", type=int)
+# number of simulated days of a calibration run, used to balance the cores
+# of the macro and micro instances, 0 to not calibrate
+parser.add_argument('--CALIBRATION_DAYS', default=0,
+                    action="store", type=int)
 args, unknown = parser.parse_known_args()
 print("args: {}".format(args), file=sys.stderr)
 
@@ -23,11 +42,24 @@ COUPLING_TYPE = args.COUPLING_TYPE
 WEATHER_COUPLING = args.WEATHER_COUPLING
 NUM_WORKERS = int(args.NUM_WORKERS)
 WORKER_CORES = int(args.WORKER_CORES)
+OUTPUT_FLUSH_INTERVAL = int(args.OUTPUT_FLUSH_INTERVAL)
+PIPELINED_COUPLING = args.PIPELINED_COUPLING
 DATA_DIR = 'input_csv'
-if WORKER_CORES > 1:
-    PYTHON_CMD = "mpirun -n %d python3" % (WORKER_CORES)
+MACRO_CORES = int(args.MACRO_CORES) if args.MACRO_CORES > 0 else WORKER_CORES
+MICRO_CORES = int(args.MICRO_CORES) if args.MICRO_CORES > 0 else WORKER_CORES
+CALIBRATION_DAYS = int(args.CALIBRATION_DAYS)
+if WEATHER_COUPLING.lower() == 'true':
+    OUT_DIR = os.path.join('out', 'weather', COUPLING_TYPE)
 else:
-    PYTHON_CMD = "python3"
+    OUT_DIR = os.path.join('out', COUPLING_TYPE)
+
+
+def python_cmd(cores):
+    if cores > 1:
+        return "mpirun -n %d python3" % (cores)
+    else:
+        return "python3"
+
 
 '''
 ######################################################################
@@ -43,33 +75,73 @@ m = LocalManager(cfg={'log_level': 'DEBUG'}, server_args=['--log', 'debug'])
 # get available resources
 print("\n\navailable resources:\n%s\n" % str(m.resources()))
 
-# submit jobs and save their names in 'ids' list
-jobs = Jobs()
 
-print("Start Adding jobs . . .\n\n")
+def run_instances(cores, task_prefix='', extra_args=''):
+    # submit jobs and save their names in 'ids' list
+    jobs = Jobs()
+
+    print("Start Adding jobs . . .\n\n")
+
+    # names the shm coupling channels of this launch, so that no instance
+    # attaches to a channel left behind by a previous, killed, run
+    RUN_ID = uuid.uuid4().hex[:12]
+
+    WORKER_INDEX = 0
+    for i in range(NUM_WORKERS):
+        for SUBMODEL in ['macro', 'micro']:
+            cmd = '%s run_couple.py --submodel %s --data_dir=%s --worker_index %d --coupling_type %s --num_workers %d --weather_coupling %s --output_flush_interval %d --pipelined_coupling %s --coupling_run_id %s%s' % (
+                python_cmd(cores[SUBMODEL]), SUBMODEL, DATA_DIR, WORKER_INDEX, COUPLING_TYPE, NUM_WORKERS, WEATHER_COUPLING,
+                OUTPUT_FLUSH_INTERVAL, PIPELINED_COUPLING, RUN_ID, extra_args)
+
+            print("\tAdd job with cmd = %s" % (cmd))
+
+            TaskID = '%sTaskID%d_%s' % (task_prefix, WORKER_INDEX + 1, SUBMODEL)
+            stderr = 'log_task/%s_${jname}__${uniq}.stderr' % (TaskID)
+            stdout = 'log_task/%s_${jname}__${uniq}.stdout' % (TaskID)
+
+            jobs.add(name=TaskID, exec='bash', args=['-c', cmd],
+                     stdout=stdout, stderr=stderr,
+                     numCores={'exact': cores[SUBMODEL]}, model='default')
+        WORKER_INDEX = WORKER_INDEX + 1
+
+    ids = m.submit(jobs)
+
+    # wait until submited jobs finish
+    m.wait4(ids)
+    return ids
 
-WORKER_INDEX = 0
-for i in range(NUM_WORKERS):
-    for SUBMODEL in ['macro', 'micro']:
-        cmd = '%s run_couple.py --submodel %s --data_dir=%s --worker_index %d --coupling_type %s --num_workers %d --weather_coupling %s' % (
-            PYTHON_CMD, SUBMODEL, DATA_DIR, WORKER_INDEX, COUPLING_TYPE, NUM_WORKERS, WEATHER_COUPLING)
 
-        print("\tAdd job with cmd = %s" % (cmd))
+def reset_output_dir():
+    shutil.rmtree(OUT_DIR, ignore_errors=True)
+    for sub_dir in ['coupled', 'macro', 'micro', 'log_exchange_data',
+                    'plot_exchange_data']:
+        os.makedirs(os.path.join(OUT_DIR, sub_dir))
 
-        TaskID = 'TaskID%d_%s' % (WORKER_INDEX + 1, SUBMODEL)
-        stderr = 'log_task/%s_${jname}__${uniq}.stderr' % (TaskID)
-        stdout = 'log_task/%s_${jname}__${uniq}.stdout' % (TaskID)
 
-        jobs.add(name=TaskID, exec='bash', args=['-c', cmd],
-                 stdout=stdout, stderr=stderr,
-                 numCores={'exact': WORKER_CORES}, model='default')
-    WORKER_INDEX = WORKER_INDEX + 1
+WEATHER_DIR = os.path.join(DATA_DIR, 'weather_data')
+if WEATHER_COUPLING.lower() == 'true' and not is_current(WEATHER_DIR):
+    # convert the weather data to the arrays memory mapped by the micro
+    # instances, once for all of them
+    build_weather_cache(WEATHER_DIR)
 
+cores = {'macro': MACRO_CORES, 'micro': MICRO_CORES}
+plan = {'macro_cores': MACRO_CORES, 'micro_cores': MICRO_CORES}
+if CALIBRATION_DAYS > 0:
+    # run all instances for a few days, and split the cores of each
+    # macro/micro pair such that their step times are balanced
+    print("Calibration run of %d days . . .\n" % (CALIBRATION_DAYS))
+    run_instances(cores, task_prefix='calibration_',
+                  extra_args=' --end_time %d --log_exchange_data False' % (
+                      CALIBRATION_DAYS))
+    plan = plan_cores(read_step_times(OUT_DIR), MACRO_CORES + MICRO_CORES)
+    print("\nresource plan: %s\n" % (plan))
+    cores = {'macro': plan['macro_cores'], 'micro': plan['micro_cores']}
+    reset_output_dir()
 
-ids = m.submit(jobs)
+ids = run_instances(cores)
 
-# wait until submited jobs finish
-m.wait4(ids)
+# the step times of this run, to plan the cores of the next one
+save_step_times(STEP_TIMES_FILE, read_step_times(OUT_DIR), plan)
 
 # get detailed information about submited and finished jobs
 print("jobs details:\n%s\n" % str(m.info(ids)))
@@ -0,0 +1,55 @@
+import threading
+
+
+class PipelinedInput:
+    """
+    Pipelined coupling for the file and shm coupling types. By default,
+    c.Couple(t) waits for the agent counts of day t of the other submodel, so
+    that each submodel idles while the other one evolves. Here, Couple(t)
+    only posts the counts of day t, and applies the counts of day t - 1,
+    which are read in a background thread while this submodel evolves. The
+    macro and micro evolve steps then overlap, at the cost of a coupling lag
+    of one day.
+
+    The first day is still exchanged synchronously. c is modified in place,
+    i.e. c.readInputFromFile is replaced.
+    """
+
+    def __init__(self, c, end_time):
+        self.read = c.readInputFromFile
+        self.end_time = end_time
+        self.pending = None
+        c.readInputFromFile = self.read_input
+
+    def _prefetch(self, t):
+        result = {}
+
+        def read():
+            try:
+                result["newAgents"] = self.read(t=t)
+            except BaseException as e:
+                result["error"] = e
+
+        # a daemon thread, so that a run whose other submodel failed can
+        # still exit
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        return thread, result
+
+    def read_input(self, t):
+        if self.pending is None:
+            newAgents = self.read(t=t)
+        else:
+            thread, result = self.pending
+            thread.join()
+            if "error" in result:
+                raise result["error"]
+            newAgents = result["newAgents"]
+
+        # no input is read after the last day, which the other submodel
+        # may not post
+        if t + 1 < self.end_time:
+            self.pending = self._prefetch(t)
+        else:
+            self.pending = None
+        return newAgents
@@ -0,0 +1,209 @@
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# directory of the arrays, inside the weather_data directory
+CACHE_DIR = "cache"
+SOURCE_FILES = ["precipitation.csv", "river_discharge.csv", "40yrs_tp.csv"]
+META_FILE = "meta.json"
+
+
+def _source_state(weather_dir):
+    state = {}
+    for file_name in SOURCE_FILES:
+        path = os.path.join(weather_dir, file_name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            state[file_name] = [stat.st_size, stat.st_mtime]
+    return state
+
+
+def _save(cache_dir, file_name, array):
+    # concurrent builds of the same sources write the same arrays, each
+    # file is replaced atomically
+    path = os.path.join(cache_dir, file_name)
+    tmp_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_file, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_file, path)
+
+
+def _save_json(cache_dir, file_name, data):
+    path = os.path.join(cache_dir, file_name)
+    tmp_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, path)
+
+
+def is_current(weather_dir):
+    meta_file = os.path.join(weather_dir, CACHE_DIR, META_FILE)
+    if not os.path.isfile(meta_file):
+        return False
+    with open(meta_file) as f:
+        meta = json.load(f)
+    return meta["sources"] == json.loads(json.dumps(
+        _source_state(weather_dir)))
+
+
+def build_weather_cache(weather_dir):
+    """
+    Convert the weather csv files of weather_dir to the arrays of
+    weather_dir/cache, which the micro instances memory map:
+    - precipitation.npy: precipitation by (day, link), with the link names
+      of its columns in meta.json,
+    - tp_thresholds.npy: latitude, longitude and the 0.15 and 0.75
+      quantiles of the 40 years total precipitation of each grid point,
+    - river_discharge.npy: dis24 by (day, grid point) from the first date
+      of river_discharge.csv, and discharge_points.npy: latitude and
+      longitude of its columns. Only if river_discharge.csv exists.
+    The mean coordinates of each location of 40yrs_tp.csv are stored in
+    meta.json, which is written last.
+    """
+    cache_dir = os.path.join(weather_dir, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = _source_state(weather_dir)
+    meta = {"sources": sources}
+
+    precipitation = pd.read_csv(
+        os.path.join(weather_dir, "precipitation.csv"))
+    links = [name for name in precipitation.columns if name != "Day"]
+    _save(cache_dir, "precipitation.npy",
+          precipitation[links].to_numpy(dtype=np.float64))
+    meta["links"] = links
+
+    history = pd.read_csv(os.path.join(weather_dir, "40yrs_tp.csv"))
+    thresholds = history.groupby(["latitude", "longitude"])["tp"].quantile(
+        [0.15, 0.75]).unstack()
+    _save(cache_dir, "tp_thresholds.npy", np.column_stack([
+        thresholds.index.get_level_values("latitude"),
+        thresholds.index.get_level_values("longitude"),
+        thresholds[0.15],
+        thresholds[0.75],
+    ]).astype(np.float64))
+    coordinates = history.groupby("names")[["latitude", "longitude"]].mean()
+    meta["locations"] = {
+        name: [float(row.latitude), float(row.longitude)]
+        for name, row in coordinates.iterrows()
+    }
+
+    if "river_discharge.csv" in sources:
+        discharge = pd.read_csv(
+            os.path.join(weather_dir, "river_discharge.csv"))
+        discharge["day"] = pd.to_datetime(discharge["time"])
+        first_date = discharge["day"].min()
+        discharge["day"] = (discharge["day"] - first_date).dt.days
+        # the first value of each day and grid point, as the lookups of
+        # Link_weather_coupling
+        dis24 = discharge.pivot_table(index="day", columns=["lat", "lon"],
+                                      values="dis24", aggfunc="first")
+        dis24 = dis24.reindex(range(int(discharge["day"].max()) + 1))
+        _save(cache_dir, "river_discharge.npy",
+              dis24.to_numpy(dtype=np.float64))
+        _save(cache_dir, "discharge_points.npy", np.array(
+            dis24.columns.to_list(), dtype=np.float64).reshape(-1, 2))
+        meta["discharge_first_date"] = first_date.strftime("%Y-%m-%d")
+
+    _save_json(cache_dir, META_FILE, meta)
+
+
+def _haversine_distance(lat1, lon1, lat2, lon2):
+    p = math.pi / 180
+    a = 0.5 - np.cos((lat2 - lat1) * p) / 2 + \
+        np.cos(lat1 * p) * np.cos(lat2 * p) * \
+        (1 - np.cos((lon2 - lon1) * p)) / 2
+    return 12742 * np.arcsin(np.sqrt(a))
+
+
+class WeatherCache:
+    """
+    Weather data of the weather coupled links, memory mapped from the arrays
+    of build_weather_cache, so that all micro instances on a node share a
+    single copy, and a lookup by (day, link) is an array read.
+    """
+
+    def __init__(self, weather_dir):
+        cache_dir = os.path.join(weather_dir, CACHE_DIR)
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.precipitation = np.load(
+            os.path.join(cache_dir, "precipitation.npy"), mmap_mode="r")
+        self.links = {}
+        for i, name in enumerate(meta["links"]):
+            self.links.setdefault(name, i)
+        self.tp_thresholds = np.load(
+            os.path.join(cache_dir, "tp_thresholds.npy"))
+        self.locations = meta["locations"]
+
+        self.river_discharge = None
+        self.discharge_first_date = meta.get("discharge_first_date")
+        if self.discharge_first_date is not None:
+            self.river_discharge = np.load(
+                os.path.join(cache_dir, "river_discharge.npy"),
+                mmap_mode="r")
+            self.discharge_points = np.load(
+                os.path.join(cache_dir, "discharge_points.npy"))
+
+    @classmethod
+    def load(cls, weather_dir):
+        """
+        Return the WeatherCache of weather_dir, which is (re)built first if
+        the csv files changed since.
+        """
+        if not is_current(weather_dir):
+            build_weather_cache(weather_dir)
+        return cls(weather_dir)
+
+    @property
+    def num_days(self):
+        return self.precipitation.shape[0]
+
+    def link_column(self, start_name, end_name):
+        """
+        Return the column of the precipitation of the link between
+        start_name and end_name, in either direction, or None.
+        """
+        columns = [self.links[name] for name in [
+            "{} - {}".format(start_name, end_name),
+            "{} - {}".format(end_name, start_name)
+        ] if name in self.links]
+        return min(columns) if len(columns) > 0 else None
+
+    def coordinates(self, location_name):
+        return tuple(self.locations.get(location_name, [math.nan, math.nan]))
+
+    def thresholds(self, latitude, longitude):
+        """
+        Return the X1 and X2 thresholds of the total precipitation at the
+        grid point closest to (latitude, longitude), i.e. on the closest
+        latitude, the closest longitude.
+        """
+        latitudes = self.tp_thresholds[:, 0]
+        closest = latitudes[np.argmin(np.abs(latitudes - latitude))]
+        points = self.tp_thresholds[latitudes == closest]
+        point = points[np.argmin(np.abs(points[:, 1] - longitude))]
+        return float(point[2]), float(point[3])
+
+    def discharge_point(self, latitude, longitude):
+        """
+        Return the column of the river discharge grid point which is the
+        closest to (latitude, longitude).
+        """
+        if self.river_discharge is None:
+            raise FileNotFoundError(
+                "no river_discharge.csv for the weather coupled crossings")
+        return int(np.argmin(_haversine_distance(
+            latitude, longitude,
+            self.discharge_points[:, 0], self.discharge_points[:, 1])))
+
+    def discharge_day_offset(self, start_date):
+        """
+        Return the row of river_discharge of the first day of a simulation
+        that starts at start_date.
+        """
+        return (pd.Timestamp(start_date) -
+                pd.Timestamp(self.discharge_first_date)).days
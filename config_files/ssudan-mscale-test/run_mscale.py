@@ -4,11 +4,15 @@ from flee.datamanager import DataTable  # DataTable.subtract_dates()
 import numpy as np
 from flee.postprocessing import analysis as a
 import sys
+from run_utils import CampOutput, add_agents, add_agents_to_conflict_zones
+from run_utils import exit_on_sigterm
+from pipelined_coupling import PipelinedInput
+from resource_planner import StepTimer
+from weather_cache import WeatherCache
 import argparse
 import os
 from pprint import pprint
 import csv
-import pandas as pd
 work_dir = os.path.dirname(os.path.abspath(__file__))
 insert_day0_refugees_in_camps = False
 
@@ -16,8 +20,7 @@ insert_day0_refugees_in_camps = False
 def AddInitialRefugees(e, d, loc):
     """ Add the initial refugees to a location, using the location name"""
     num_refugees = int(d.get_field(loc.name, 0, FullInterpolation=True))
-    for i in range(0, num_refugees):
-        e.addAgent(location=loc)
+    add_agents(e, loc, num_refugees)
 
 
 def read_coupled_locations(csv_inputfile):
@@ -34,7 +37,8 @@ def read_coupled_locations(csv_inputfile):
     return c
 
 
-def run_micro_macro_model(e, c, submodel, ig, d, camp_locations, end_time):
+def run_micro_macro_model(e, c, submodel, ig, d, camp_output, end_time,
+                          step_timer):
     # Set up a mechanism to incorporate temporary decreases in refugees
     refugee_debt = 0
     # raw (interpolated) data from TOTAL UNHCR refugee count only.
@@ -68,9 +72,7 @@ def run_micro_macro_model(e, c, submodel, ig, d, camp_locations, end_time):
             if submodel == "macro":
                 print("t={}, inserting {} new agents".format(
                     t, new_refs), file=sys.stderr)
-                # e.add_agents_to_conflict_zones(new_refs)
-                for i in range(0, new_refs):
-                    e.addAgent(e.pick_conflict_location())
+                add_agents_to_conflict_zones(e, new_refs)
                 e.updateNumAgents(log=False)
 
             # e.printInfo()
@@ -78,7 +80,8 @@ def run_micro_macro_model(e, c, submodel, ig, d, camp_locations, end_time):
             # exchange data with other code.
             # immediately after agent insertion to ensure ghost locations
             # work correctly.
-            c.Couple(t)
+            with step_timer.coupling():
+                c.Couple(t)
 
             e.refresh_conflict_weights()
             t_data = t
@@ -86,64 +89,10 @@ def run_micro_macro_model(e, c, submodel, ig, d, camp_locations, end_time):
             # e.enact_border_closures(t)
             e.evolve()
 
-            # Calculation of error terms
-            errors = []
-            abs_errors = []
-            loc_data = []
-
-            camps = []
-
-            for i in camp_locations:
-                camps += [lm[i]]
-                loc_data += [d.get_field(i, t)]
-
-            # calculate retrofitted time.
-            refugees_in_camps_sim = 0
-
-            for camp in camps:
-                refugees_in_camps_sim += camp.numAgents
-
-            if e.getRankN(t):
-                output = "{}".format(t)
-
-                j = 0
-                for i in camp_locations:
-                    errors += [a.rel_error(lm[i].numAgents, loc_data[j])]
-                    abs_errors += [a.abs_error(lm[i].numAgents, loc_data[j])]
-
-                    j += 1
-
-                output = "{}".format(t)
-
-                for i in range(0, len(errors)):
-                    output += ",{},{},{}".format(
-                        lm[camp_locations[i]].numAgents,
-                        loc_data[i],
-                        errors[i]
-                    )
-
-                if refugees_raw > 0:
-                    output += ",{},{},{},{},{},{}".format(
-                        round(
-                            float(np.sum(abs_errors)) / float(refugees_raw),
-                            a.ROUND_NDIGITS
-                        ),
-                        int(sum(loc_data)),
-                        e.numAgents(),
-                        refugees_raw,
-                        refugees_in_camps_sim,
-                        refugee_debt
-                    )
-                else:
-                    output += ",0,0,0,0,0,0"
-
-                # print(output)
-
-                with open(out_csv_file, "a+") as f:
-                    f.write(output)
-                    f.write("\n")
-                    f.flush()
-                # exit()
+            # only rank 0 writes out.csv
+            camp_output.add_day(t, refugees_raw, refugee_debt,
+                                write=e.getRankN(0))
+            step_timer.step()
 
         # break while-loop(c.reuse_coupling) if coupling_type == file
         if not hasattr(c, "instance"):
@@ -173,7 +122,7 @@ if __name__ == "__main__":
 
     parser.add_argument("--coupling_type", required=True,
                         action="store", type=str,
-                        choices=["file", "muscle3"],
+                        choices=["file", "muscle3", "shm"],
                         help="the coupling type to be used")
 
     parser.add_argument("--instance_index", required=True,
@@ -198,10 +147,27 @@ if __name__ == "__main__":
                         action="store", type=str, default="False",
                         help="boolean flag to enable/disable weather coupling")
 
+    parser.add_argument("--pipelined_coupling",
+                        action="store", type=str, default="False",
+                        help="boolean flag to apply the coupled data with a \
+                        lag of one day, overlapping the macro and micro steps")
+
+    parser.add_argument("--output_flush_interval",
+                        action="store", type=int, default=100,
+                        help="number of simulated days between two writes \
+                        of out.csv")
+
+    parser.add_argument("--coupling_run_id",
+                        action="store", type=str, default="",
+                        help="id of this launch of the instances, shared by \
+                        all of them, which names the shm coupling channels")
+
     args, unknown = parser.parse_known_args()
 
     print("args: {}".format(args), file=sys.stderr)
 
+    exit_on_sigterm()
+
     data_dir = os.path.join(work_dir, args.data_dir)
 
     coupled_locations = read_coupled_locations(
@@ -222,6 +188,11 @@ if __name__ == "__main__":
     else:
         weather_coupling = False
 
+    if args.pipelined_coupling.lower() == "true":
+        pipelined_coupling = True
+    else:
+        pipelined_coupling = False
+
     if args.end_time is not None:
         end_time = int(args.end_time)
     last_physical_day = end_time
@@ -271,40 +242,21 @@ if __name__ == "__main__":
     print("This is submodel {}".format(submodel_id), file=sys.stderr)
 
     if submodel == "micro" and weather_coupling is True:
-        weather_source_files = {}
-
-        weather_source_files["precipitation"] = pd.read_csv(
-            os.path.join(data_dir, "weather_data", "precipitation.csv")
-        )
-
-        weather_source_files["river_discharge"] = pd.read_csv(
-            os.path.join(data_dir, "weather_data", "river_discharge.csv")
-        )
-
-        weather_source_files["40yrs_total_precipitation"] = pd.read_csv(
-            os.path.join(data_dir, "weather_data", "40yrs_tp.csv")
-        )
-
-        weather_source_files["conflict_start_date"], _ = (
-            read_period.read_conflict_period(
-                os.path.join(data_dir, "conflict_period.csv")
-            )
-        )
-
-        weather_source_files["output_log"] = os.path.join(
-            work_dir, "out", "weather", coupling_type, submodel,
-            "weather_log[{}].csv".format(instance_index)
-        )
-        prec_len = len(weather_source_files["precipitation"].index)
-
+        import weather_link
+        # the weather data are converted once to arrays, which all micro
+        # instances of the node memory map
+        weather_link.weather_cache = WeatherCache.load(
+            os.path.join(data_dir, "weather_data"))
+        weather_link.conflict_start_date = start_date
+
+        prec_len = weather_link.weather_cache.num_days
         if prec_len < end_time:
             print("The lenght of precipitation.csv ({}) is lower than "
                   "the simulation end_time ({})!".format(prec_len, end_time)
                   )
             exit()
 
-        flee.Link = flee.Link_weather_coupling
-        flee.weather_source_files = weather_source_files
+        flee.Link = weather_link.Link_weather_cache
 
     if weather_coupling is True:
         outputdir = os.path.join(work_dir, "out", "weather")
@@ -313,14 +265,24 @@ if __name__ == "__main__":
 
     e = flee.Ecosystem()
 
-    c = coupling.CouplingInterface(e, submodel,
-                                   instance_index=instance_index,
-                                   num_instances=num_instances,
-                                   coupling_type=coupling_type,
-                                   weather_coupling=weather_coupling,
-                                   outputdir=outputdir,
-                                   log_exchange_data=log_exchange_data
-                                   )
+    if coupling_type == "shm":
+        # macro and micro instances on the same node, exchanging the
+        # agent counts through shared memory
+        from shm_coupling import ShmCouplingInterface as CouplingInterface
+        coupling_args = {"run_id": args.coupling_run_id}
+    else:
+        CouplingInterface = coupling.CouplingInterface
+        coupling_args = {}
+
+    c = CouplingInterface(e, submodel,
+                          instance_index=instance_index,
+                          num_instances=num_instances,
+                          coupling_type=coupling_type,
+                          weather_coupling=weather_coupling,
+                          outputdir=outputdir,
+                          log_exchange_data=log_exchange_data,
+                          **coupling_args
+                          )
 
     if coupling_type == "muscle3":
         if hasattr(c, "instance"):
@@ -331,12 +293,19 @@ if __name__ == "__main__":
                   "instance attribute.", file=sys.stderr)
 
     # setting coupling output file name
-    if coupling_type == "file":
+    if coupling_type in ["file", "shm"]:
         if submodel == "micro":
             c.setCouplingChannel("out", "in")
         elif submodel == "macro":
             c.setCouplingChannel("in", "out")
 
+    if pipelined_coupling is True and submodel in ["macro", "micro"]:
+        if coupling_type in ["file", "shm"]:
+            PipelinedInput(c, end_time)
+        else:
+            print("WARNING: pipelined coupling is only supported by the "
+                  "file and shm coupling types.", file=sys.stderr)
+
     ig = InputGeography.InputGeography()
 
     ig.ReadFlareConflictInputCSV(
@@ -413,19 +382,40 @@ if __name__ == "__main__":
 
     if submodel in ["macro", "micro"]:
         # DO NOT generate output file for the micro/macro mangers
+        # out.csv is only opened by rank 0, and written once every
+        # output_flush_interval days; the other ranks do not write.
+        out_csv = sys.stdout
         if e.getRankN(0):
             # output_header_string += "num agents,num agents in camps"
             print(output_header_string)
-            with open(out_csv_file, "a+") as f:
-                f.write(output_header_string)
-                f.write("\n")
-                f.flush()
+            out_csv = open(out_csv_file, "a+")
+            out_csv.write(output_header_string)
+            out_csv.write("\n")
+
+        camp_output = CampOutput(e, lm, d, camp_locations, end_time,
+                                 out=out_csv,
+                                 flush_interval=args.output_flush_interval,
+                                 ndigits=a.ROUND_NDIGITS, round_total=True)
 
     # end_time = 30
     if submodel in ["macro", "micro"]:
-        run_micro_macro_model(
-            e, c, submodel, ig, d, camp_locations, end_time
-        )
+        step_timer = StepTimer()
+        try:
+            run_micro_macro_model(
+                e, c, submodel, ig, d, camp_output, end_time, step_timer
+            )
+        finally:
+            # also write the buffered days of a run that failed or was
+            # terminated
+            camp_output.close()
+
+        # the step times of this instance, for the resource planner of PJ.py
+        if e.getRankN(0):
+            step_timer.save(
+                os.path.join(os.path.dirname(out_csv_file),
+                             "step_times[{}].json".format(instance_index)),
+                submodel, instance_index, e.mpi.size
+            )
     elif submodel in ["macro_manager", "micro_manager"]:
         run_manager(c, submodel, end_time)
 
@@ -0,0 +1,100 @@
+import datetime
+
+import numpy as np
+from flee import pmicro_flee
+
+# WeatherCache of the weather coupled links, and the start date of the
+# simulation, set by the driver before the links are created
+weather_cache = None
+conflict_start_date = None
+
+# river discharge above which a crossing is closed
+DISCHARGE_THRESHOLD = 8000
+
+
+class Link_weather_cache(pmicro_flee.Link_weather_coupling):
+    """
+    Link_weather_coupling which looks up the weather data in the memory
+    mapped arrays of weather_cache, instead of querying the pandas tables
+    of each weather csv file. The distance of the link on a day is the same.
+    """
+
+    def __init__(self, startpoint, endpoint, distance,
+                 forced_redirection=False, link_type=None):
+        self.name = "L:{}:{}".format(startpoint.name, endpoint.name)
+        self.closed = False
+
+        # distance in km.
+        self.__distance = float(distance)
+
+        # links for now always connect two endpoints
+        self.startpoint = startpoint
+        self.endpoint = endpoint
+
+        # number of agents that are in transit.
+        self.numAgents = 0
+        # refugee population on current rank (for pflee).
+        self.numAgentsOnRank = 0
+
+        # if True, then all Persons will go down this link.
+        self.forced_redirection = forced_redirection
+
+        self.link_type = link_type
+
+        self.latMid, self.lonMid = self.midpoint()
+        self.X1, self.X2 = self.X1_X2()
+
+        self.prec_column = weather_cache.link_column(
+            self.startpoint.name, self.endpoint.name)
+
+        if self.link_type == "crossing":
+            self.discharge_column = weather_cache.discharge_point(
+                self.latMid, self.lonMid)
+            self.discharge_day = weather_cache.discharge_day_offset(
+                conflict_start_date)
+
+    def get_start_date(self, time):
+        date = datetime.datetime.strptime(
+            conflict_start_date, "%Y-%m-%d").date()
+        date += datetime.timedelta(time)
+        return date.strftime("%Y-%m-%d")
+
+    def get_longitude(self, location_name):
+        return weather_cache.coordinates(location_name)[1]
+
+    def get_latitude(self, location_name):
+        return weather_cache.coordinates(location_name)[0]
+
+    def X1_X2(self):
+        return weather_cache.thresholds(self.latMid, self.lonMid)
+
+    def get_distance(self, time):
+        if self.link_type == "crossing":
+            day = self.discharge_day + time
+            if day < 0 or day >= weather_cache.river_discharge.shape[0] or \
+                    np.isnan(weather_cache.river_discharge[
+                        day, self.discharge_column]):
+                raise IndexError("no river discharge of {} on {}".format(
+                    self.name, self.get_start_date(time)))
+            dis_level = weather_cache.river_discharge[
+                day, self.discharge_column]
+
+            if dis_level < DISCHARGE_THRESHOLD:
+                new_distance = self.__distance * 1
+            else:
+                new_distance = self.__distance * 10000
+        else:
+            if self.prec_column is None:
+                raise KeyError("no precipitation of link {}".format(
+                    self.name))
+            tp = weather_cache.precipitation[time, self.prec_column]
+            if tp <= self.X1:
+                new_distance = self.__distance * 1
+            elif tp <= self.X2:
+                new_distance = self.__distance * 2
+            elif tp > self.X2 and tp > 15:
+                new_distance = self.__distance * 10000
+            else:
+                new_distance = self.__distance * 2
+
+        return new_distance
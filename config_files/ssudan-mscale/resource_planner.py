@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# summary of the step times of a run, written next to job_execution_time.txt
+STEP_TIMES_FILE = "step_times.json"
+
+
+class StepTimer:
+    """
+    Measures the time a macro/micro instance spends per time step, split in
+    the time spent in c.Couple(), i.e. mostly waiting for the other
+    submodel, and the time spent computing, which is what the resource
+    planner balances.
+    """
+
+    def __init__(self):
+        self.steps = 0
+        self.step_time = 0.0
+        self.couple_time = 0.0
+        self.last = time.time()
+
+    @contextmanager
+    def coupling(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.couple_time += time.time() - start
+
+    def step(self):
+        now = time.time()
+        self.step_time += now - self.last
+        self.last = now
+        self.steps += 1
+
+    def save(self, file_name, submodel, instance_index, cores):
+        with open(file_name, "w") as f:
+            json.dump({
+                "submodel": submodel,
+                "instance_index": instance_index,
+                "cores": cores,
+                "steps": self.steps,
+                "compute_time": self.step_time - self.couple_time,
+                "couple_time": self.couple_time,
+            }, f)
+
+
+def read_step_times(out_dir):
+    """
+    Return the step times saved by the macro/micro instances of a run in
+    out_dir, i.e. out/<coupling_type> or out/weather/<coupling_type>.
+    """
+    records = []
+    for submodel in ["macro", "micro"]:
+        for file_name in sorted(glob.glob(
+                os.path.join(out_dir, submodel, "step_times[[]*[]].json"))):
+            with open(file_name) as f:
+                records.append(json.load(f))
+    return records
+
+
+def load_step_times(path):
+    """
+    Return the step times of a previous run, from path or from the
+    step_times.json file in the results directory path.
+    """
+    if os.path.isdir(path):
+        if not os.path.isfile(os.path.join(path, STEP_TIMES_FILE)):
+            # e.g. a muscle3 run, which is not launched by PJ.py
+            records = []
+            for out_dir in sorted(glob.glob(os.path.join(path, "out", "*")) +
+                                  glob.glob(os.path.join(path, "out",
+                                                         "weather", "*"))):
+                records += read_step_times(out_dir)
+            return records
+        path = os.path.join(path, STEP_TIMES_FILE)
+    with open(path) as f:
+        return json.load(f)["records"]
+
+
+def save_step_times(file_name, records, plan):
+    with open(file_name, "w") as f:
+        json.dump({"plan": plan, "records": records}, f, indent=2)
+
+
+def core_seconds_per_step(records):
+    """
+    Return the compute cost of one time step of each submodel, in core
+    seconds, averaged over its instances.
+    """
+    cost = {}
+    for submodel in ["macro", "micro"]:
+        costs = [r["compute_time"] * r["cores"] / r["steps"]
+                 for r in records
+                 if r["submodel"] == submodel and r["steps"] > 0]
+        if len(costs) == 0:
+            raise ValueError(
+                "no step times of the {} submodel".format(submodel))
+        cost[submodel] = sum(costs) / len(costs)
+    return cost
+
+
+def plan_cores(records, cores_per_pair):
+    """
+    Split the cores_per_pair cores of each macro/micro pair of instances
+    over the two submodels, such that their step times are balanced, i.e.
+    the slowest one is as fast as possible. The step time of a submodel is
+    assumed to scale inversely with its number of cores.
+
+    Returns a dict with the macro_cores and micro_cores, and the expected
+    step times.
+    """
+    if cores_per_pair < 2:
+        raise ValueError("a macro/micro pair needs at least 2 cores, "
+                         "got {}".format(cores_per_pair))
+    cost = core_seconds_per_step(records)
+
+    def step_time(macro_cores):
+        return max(cost["macro"] / macro_cores,
+                   cost["micro"] / (cores_per_pair - macro_cores))
+
+    macro_cores = min(range(1, cores_per_pair), key=step_time)
+    return {
+        "macro_cores": macro_cores,
+        "micro_cores": cores_per_pair - macro_cores,
+        "macro_step_time": cost["macro"] / macro_cores,
+        "micro_step_time": cost["micro"] / (cores_per_pair - macro_cores),
+    }
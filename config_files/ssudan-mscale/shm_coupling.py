@@ -0,0 +1,261 @@
+import atexit
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from flee import coupling
+
+# header of a channel: magic, number of locations, number of slots and the
+# length of the location names, followed by the names and the ring of slots
+HEADER_SIZE = 4
+MAGIC = 0x466c6565536d656d
+
+# seconds to wait for a channel or a time step of the other submodel, after
+# which its instance is assumed to have died
+DEFAULT_TIMEOUT = 3600
+
+
+def channel_name(run_id, channel, instance_index):
+    """
+    Return the name of the shared memory segment of a channel. run_id is
+    unique per launch of the instances (see PJ.py), so that readers never
+    attach to a segment left behind by a run that was killed.
+    """
+    return "flee_{}_{}{}".format(run_id, channel, instance_index)
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory segment, without registering it with
+    the resource tracker, which would remove it when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _wait(ready, timeout):
+    """
+    Spin on ready() with an increasing back-off, up to 1 ms per check.
+    """
+    delay = 0.0
+    start = time.time()
+    while not ready():
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError("no data on the shm coupling channel after "
+                               "{} seconds".format(timeout))
+        time.sleep(delay)
+        delay = min(max(delay * 2, 1e-6), 1e-3)
+
+
+class ShmChannel:
+    """
+    Ring buffer in shared memory, carrying the number of agents of a fixed
+    list of locations from one writer to any number of readers on the same
+    node. Slot t % slots holds the counts of time step t, followed by a
+    sequence word t + 1 that is written after the counts; readers wait on
+    this word, and check it again after the copy to detect an overrun.
+
+    The submodels advance in lock step, i.e. a writer is at most one step
+    ahead of its slowest reader, or three steps with the PipelinedInput of
+    pipelined_coupling.py, so 4 slots are enough.
+    """
+
+    def __init__(self, shm, names, slots, owner=False):
+        self.shm = shm
+        self.names = names
+        self.slots = slots
+        self.owner = owner
+        n = len(names)
+        offset = self._names_offset(len(self._encode(names)))
+        self.ring = np.ndarray((slots, n + 1), dtype=np.int64,
+                               buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def _encode(names):
+        return "\n".join(names).encode("utf-8")
+
+    @staticmethod
+    def _names_offset(names_size):
+        return (HEADER_SIZE * 8 + names_size + 7) // 8 * 8
+
+    @classmethod
+    def create(cls, name, names, slots=4):
+        encoded = cls._encode(names)
+        offset = cls._names_offset(len(encoded))
+        size = offset + slots * (len(names) + 1) * 8
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True,
+                                             size=size)
+        except FileExistsError:
+            # left behind by a run that was killed
+            shared_memory.SharedMemory(name=name).unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True,
+                                             size=size)
+
+        header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=shm.buf)
+        header[1:] = [len(names), slots, len(encoded)]
+        shm.buf[HEADER_SIZE * 8:HEADER_SIZE * 8 + len(encoded)] = encoded
+        channel = cls(shm, names, slots, owner=True)
+        channel.ring[:] = 0
+        # the magic number is set last, readers only attach after it
+        header[0] = MAGIC
+        return channel
+
+    @classmethod
+    def attach(cls, name, timeout=DEFAULT_TIMEOUT):
+        """
+        Attach to the channel name, waiting until its writer created it.
+        """
+        shm = []
+
+        def ready():
+            if len(shm) == 0:
+                try:
+                    shm.append(_attach(name))
+                except FileNotFoundError:
+                    return False
+                except ValueError:
+                    # created, but not sized by its writer yet
+                    return False
+            if shm[0].size < HEADER_SIZE * 8:
+                return False
+            return np.ndarray(1, dtype=np.int64, buffer=shm[0].buf)[0] == \
+                MAGIC
+
+        _wait(ready, timeout)
+        header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=shm[0].buf)
+        n, slots, names_size = [int(x) for x in header[1:]]
+        names = bytes(
+            shm[0].buf[HEADER_SIZE * 8:HEADER_SIZE * 8 + names_size]
+        ).decode("utf-8")
+        names = names.split("\n") if n > 0 else []
+        return cls(shm[0], names, slots)
+
+    def write(self, t, counts):
+        slot = self.ring[t % self.slots]
+        slot[1:] = counts
+        slot[0] = t + 1
+
+    def read(self, t, timeout=DEFAULT_TIMEOUT):
+        slot = self.ring[t % self.slots]
+        _wait(lambda: slot[0] >= t + 1, timeout)
+        counts = slot[1:].copy()
+        if slot[0] != t + 1:
+            raise RuntimeError(
+                "shm coupling channel {} overrun at t={}, increase the "
+                "number of slots".format(self.shm.name, t))
+        return counts
+
+    def close(self):
+        self.ring = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ShmCouplingInterface(coupling.CouplingInterface):
+    """
+    Coupling interface of the "shm" coupling type, a drop-in replacement of
+    the file coupling for macro and micro instances that run on the same
+    node. Instead of writing and polling one csv file per instance and time
+    step, every instance writes the agent counts of its outgoing locations to
+    a ShmChannel, and reads the channels of all instances of the other
+    submodel, whose counts are averaged as in the file coupling. All
+    instances of a run must be given the same run_id.
+    """
+
+    def __init__(self, e, submodel, coupling_type="shm", run_id=None,
+                 slots=4, timeout=DEFAULT_TIMEOUT, **kwargs):
+        if not run_id:
+            raise ValueError("the shm coupling needs the run_id of the "
+                             "instances, i.e. --coupling_run_id")
+        super().__init__(e, submodel, coupling_type="shm", **kwargs)
+        self.run_id = run_id
+        self.slots = slots
+        self.timeout = timeout
+        self.output_channel = None
+        self.input_channels = None
+
+    def reuse_coupling(self):
+        return True
+
+    def setCouplingChannel(self, outputchannel, inputchannel):
+        self.outputfilename = outputchannel
+        self.inputfilename = inputchannel
+
+    def writeOutputToFile(self, day):
+        out = [i for i in range(len(self.location_ids))
+               if "out" in self.directions[i]]
+        if self.output_channel is None:
+            self.output_channel = ShmChannel.create(
+                channel_name(self.run_id, self.outputfilename,
+                             self.instance_index),
+                [self.names[i] for i in out], self.slots)
+            atexit.register(self.output_channel.close)
+
+        self.output_channel.write(day, [
+            self.e.locations[self.location_ids[i]].numAgents for i in out
+        ])
+
+    def readInputFromFile(self, t):
+        if self.input_channels is None:
+            self.input_channels = [
+                ShmChannel.attach(
+                    channel_name(self.run_id, self.inputfilename, i),
+                    self.timeout)
+                for i in range(self.num_instances)
+            ]
+
+        # the counts of each instance, by location name
+        aggNewAgents = {}
+        for channel in self.input_channels:
+            for name, count in zip(channel.names,
+                                   channel.read(t, self.timeout).tolist()):
+                if name in self.names:
+                    aggNewAgents.setdefault(name, []).append(count)
+
+        # combined founded newAgents per location by each instance into one,
+        # using the arithmetic mean as the file coupling does
+        for name in aggNewAgents:
+            aggNewAgents[name] = int(round(np.mean(aggNewAgents[name])))
+
+        return aggNewAgents
+
+    def Couple(self, time):
+        """
+        Same exchange as the file coupling of CouplingInterface.Couple().
+        """
+        if time % self.intervals[0] != 0:
+            return
+
+        if self.coupling_rank:
+            # If MPI is used, this will be the process with rank 0
+            self.writeOutputToFile(day=time)
+            if self.log_exchange_data is True:
+                self.logExchangeData(t=time)
+
+        # all ranks read the shared memory, so no broadcast is needed
+        newAgents = self.readInputFromFile(t=time)
+
+        if self.submodel in ["micro", "macro"]:
+            self.e.clearLocationsFromAgents(
+                location_names=self.location_names)
+            for i in range(0, len(self.location_names)):
+                if "in" in self.directions[i] and self.names[i] in newAgents:
+                    print("Couple IN: {} {}".format(
+                        self.names[i], newAgents[self.names[i]]),
+                        file=sys.stderr)
+                    self.e.insertAgents(
+                        location=self.e.locations[self.location_ids[i]],
+                        number=newAgents[self.names[i]],
+                    )
+                if hasattr(self.e, "mpi"):
+                    self.e.updateNumAgents(log=False)
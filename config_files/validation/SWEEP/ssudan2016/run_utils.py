@@ -0,0 +1,148 @@
+import csv
+import signal
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# same as flee.postprocessing.analysis.ROUND_NDIGITS
+ROUND_NDIGITS = 4
+
+
+def add_agents(e, location, number):
+    """
+    Add a batch of number agents to a single location. Outside conflict
+    zones, where addAgent takes no population from the location, the whole
+    batch is inserted with a single e.insertAgents call.
+    """
+    if number <= 0:
+        return
+
+    if location.conflict:
+        # addAgent takes the population of a conflict zone agent by agent
+        for _ in range(0, number):
+            e.addAgent(location=location)
+    else:
+        e.insertAgents(location=location, number=number)
+
+
+def add_agents_to_conflict_zones(e, number):
+    """
+    Add a batch of number agents to the conflict zones, distributed by
+    conflict weight. The locations of the whole batch are picked with one
+    multinomial draw, instead of one weighted choice per agent through
+    e.pick_conflict_location(). This draw uses the same global random state
+    on every rank, so parallel runs stay consistent between ranks.
+    """
+    if number <= 0:
+        return
+
+    weights = np.asarray(e.conflict_weights, dtype=float) / e.conflict_pop
+    counts = np.random.multinomial(number, weights / weights.sum())
+
+    for location, n in zip(e.conflict_zones, counts):
+        add_agents(e, location, int(n))
+
+
+class CampOutput:
+    """
+    Per-timestep output stage of the Flee run scripts.
+
+    The camp locations and the validation data (days x camps) are looked up
+    once at start-up, the errors for all camps are computed as one array
+    operation per day, and the rows of out.csv are written through a
+    buffered csv writer.
+    """
+
+    def __init__(self, e, lm, d, camp_locations, end_time, start_date=None,
+                 out=sys.stdout, flush_interval=100, ndigits=ROUND_NDIGITS,
+                 round_total=False):
+        self.e = e
+        self.camps = [lm[name] for name in camp_locations]
+        self.start_date = start_date
+        self.flush_interval = flush_interval
+        # number of digits the errors of each camp are rounded to, and the
+        # Total error too if round_total is True
+        self.ndigits = ndigits
+        self.round_total = round_total
+
+        # keep the validation data as read from the RefugeeTable for the
+        # output, and as a float array for the error calculation.
+        self.loc_data = [[d.get_field(name, t) for name in camp_locations]
+                         for t in range(end_time)]
+        self.data = np.array(self.loc_data, dtype=float).reshape(
+            end_time, len(camp_locations))
+        self.data_total = [int(sum(row)) for row in self.loc_data]
+
+        self.writer = csv.writer(out, lineterminator="\n")
+        self.out = out
+        self.rows = []
+
+    def add_day(self, t, refugees_raw, refugee_debt, write=True):
+        """
+        Compute the errors for day t and queue the corresponding row.
+        In parallel runs this must be called on all ranks, with write=True
+        only on the rank that writes the output.
+        """
+        sim = np.array([c.numAgents for c in self.camps], dtype=float)
+        data = self.data[t]
+
+        # same definitions as flee.postprocessing.analysis.abs_error and
+        # rel_error, i.e. no relative error where there is no data.
+        abs_errors = np.round(np.abs(sim - data), self.ndigits)
+        has_data = data >= 0.00001
+        errors = np.zeros(len(data))
+        errors[has_data] = np.round(
+            np.abs(sim[has_data] / data[has_data] - 1.0), self.ndigits)
+
+        refugees_in_camps_sim = int(sim.sum())
+
+        row = [t]
+        if self.start_date is not None:
+            date = datetime.strptime(self.start_date, "%Y-%m-%d") + \
+                timedelta(days=t)
+            row += [date.strftime("%Y-%m-%d")]
+
+        for c, loc_data, error in zip(self.camps, self.loc_data[t],
+                                      errors.tolist()):
+            row += [c.numAgents, loc_data, error]
+
+        if refugees_raw > 0:
+            total_error = float(abs_errors.sum()) / float(refugees_raw)
+            if self.round_total:
+                total_error = round(total_error, self.ndigits)
+            row += [total_error,
+                    self.data_total[t], self.e.numAgents(), refugees_raw,
+                    refugees_in_camps_sim, refugee_debt]
+        else:
+            row += [0, 0, 0, 0, 0, 0]
+
+        if write:
+            self.rows.append(row)
+            if len(self.rows) >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+        self.out.flush()
+
+    def close(self):
+        """
+        Write the queued rows and close the output, unless it is stdout.
+        """
+        self.flush()
+        if self.out is not sys.stdout:
+            self.out.close()
+
+
+def exit_on_sigterm():
+    """
+    Turn a SIGTERM, e.g. sent by the batch system at the end of the wall
+    time, into a SystemExit, so that the finally blocks of a run script
+    still write its buffered output.
+    """
+    def handler(signum, frame):
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
@@ -2,34 +2,58 @@ import pandas as pd
 import warnings
 import sys
 import os
-import calendar as cal
 from datetime import datetime
 
 
-def month_convert(month):
-    name_to_number = {name: number
-                      for number, name in enumerate(cal.month_name) if number
-                      }  # dict month : month_num
-    month_num = name_to_number.get(month)  # month number in int form
-    return month_num
+# columns of the ACLED export used to build the locations
+ACLED_COLUMNS = ["event_date", "country", "admin1", "admin2",
+                 "location", "latitude", "longitude", "fatalities"]
 
 
-def date_format(in_date):
-    # converting date from textbased to dd-mm-yyyy format
-    split_date = in_date.split()
-    month_num = month_convert(split_date[1])
-    out_date = split_date[0] + "-" + str(month_num) + "-" + split_date[2]
-    return out_date
-
-
-def between_date(d1, d2):
-    # Gets difference between two dates in string format "dd-mm-yy"
-    d1list = d1.split("-")
-    d2list = d2.split("-")
-    date1 = datetime(int(d1list[2]), int(d1list[1]), int(d1list[0]))
-    date2 = datetime(int(d2list[2]), int(d2list[1]), int(d2list[0]))
-
-    return abs((date1 - date2).days) + 1  # Maybe add +1
+def parse_event_dates(event_dates):
+    # ACLED exports give the event_date as e.g. "29 June 2018", newer ones
+    # as "2018-06-29"
+    try:
+        return pd.to_datetime(event_dates, format="%d %B %Y")
+    except ValueError:
+        return pd.to_datetime(event_dates, format="mixed", dayfirst=True)
+
+
+def conflict_dates(event_dates, start_date):
+    """
+    Return the number of days between each event and start_date
+    (dd-mm-yyyy), counting both days.
+    """
+    start = pd.to_datetime(start_date, format="%d-%m-%Y")
+    return (event_dates - start).dt.days.abs() + 1
+
+
+def read_acled(input_file, cache=False):
+    """
+    Read the columns of an ACLED export used by acled2locations, with the
+    event dates parsed. With cache, the parsed events are stored in a
+    parquet file next to input_file, which is read instead of the csv as
+    long as it is newer than the csv.
+    """
+    cache_file = os.path.splitext(input_file)[0] + ".parquet"
+    if cache and os.path.isfile(cache_file) and \
+            os.path.getmtime(cache_file) >= os.path.getmtime(input_file):
+        try:
+            return pd.read_parquet(cache_file)
+        except ImportError:
+            print("Warning: no parquet engine installed, "
+                  "reading {}".format(input_file))
+
+    df = pd.read_csv(input_file, usecols=ACLED_COLUMNS)
+    df["event_date"] = parse_event_dates(df["event_date"])
+
+    if cache:
+        try:
+            df.to_parquet(cache_file, index=False)
+        except ImportError:
+            print("Warning: no parquet engine installed, "
+                  "the parsed events are not cached")
+    return df
 
 
 def date_verify(date):
@@ -44,25 +68,25 @@ def date_verify(date):
 
 
 def drop_rows(inputdata, columnname, dropparameter):
-    removedrows = inputdata.index[
-        inputdata[columnname] == dropparameter].tolist()
-    outputdata = inputdata.drop(removedrows)
-    return outputdata
+    return inputdata[inputdata[columnname] != dropparameter]
 
 
 def filter_table(df, colname, adminlevel):
-    if adminlevel == "admin1":
-        adminlist = df.admin1.unique()
-    elif adminlevel == "location":
-        adminlist = df.location.unique()
+    """
+    Keep a single event per admin unit (per country): the one with the
+    lowest conflict_date, or the highest fatalities.
+    """
+    if adminlevel not in ["admin1", "admin2", "location"]:
+        adminlevel = "admin2"
+    groups = df.groupby(["country", adminlevel], sort=False)[colname]
+
+    if colname == "conflict_date":
+        newdf = df.loc[groups.idxmin()]
+    elif colname == "fatalities":
+        newdf = df.loc[groups.idxmax()]
     else:
-        adminlist = df.admin2.unique()
-    newdf = pd.DataFrame(columns=df.columns)
-
-    for admin in adminlist:
-        tempdf = df.loc[df[adminlevel] == admin]
-        tempdf.sort_values(colname, ascending=True)
-        newdf = newdf.append(tempdf.tail(1))
+        raise ValueError(
+            "filter_opt value must be earliest or fatalities")
     print(newdf)
     return newdf
 
@@ -83,27 +107,20 @@ def find_csv(country):
 
 
 def acled2locations(fab_flee_loc, country, start_date,
-                    filter_opt, admin_level):
+                    filter_opt, admin_level, cache=False):
     warnings.filterwarnings('ignore')
     input_file = os.path.join(fab_flee_loc, "config_files",
                               country,
                               "acled.csv")
     print("Current Path: ", input_file)
     try:
-        tempdf = pd.read_csv(input_file)
-    except:
+        df = read_acled(input_file, cache)
+    except FileNotFoundError:
         print("Runtime Error: File Cannot be found")
+        return
 
-    df = tempdf[["event_date", "country", "admin1", "admin2",
-                 "location", "latitude", "longitude", "fatalities"]]
-    # event_date is given in incorrect format, so formatting to dd-mm-yyyy
-    # required
-    event_dates = df["event_date"].tolist()
-    formatted_event_dates = [date_format(date) for date in event_dates]
-    conflict_dates = [between_date(d, start_date)
-                      for d in formatted_event_dates]
-    # replacing event_date
-    df.loc[:, "event_date"] = conflict_dates
+    # replacing event_date by the days since start_date
+    df["event_date"] = conflict_dates(df["event_date"], start_date)
     df.rename(columns={'event_date': 'conflict_date'}, inplace=True)
 
     df = drop_rows(df, 'fatalities', 0)
@@ -112,8 +129,8 @@ def acled2locations(fab_flee_loc, country, start_date,
 
     try:
         df = filter_table(df, filter_opt, admin_level)
-    except:
-        print("Runtime error: filter_opt value must be earliest or fatalities")
+    except ValueError as exception:
+        print("Runtime error: {}".format(exception))
 
     # Exporting CSV to locations.csv
     output_df = df[['location', 'admin1', 'country',
@@ -148,4 +165,6 @@ if __name__ == '__main__':
     start_date = sys.argv[3]
     filter_opt = sys.argv[4]
     adminlevel = sys.argv[5]
-    acled2locations(fabflee, country, start_date, filter_opt, adminlevel)
+    cache = len(sys.argv) > 6 and sys.argv[6].lower() == "true"
+    acled2locations(fabflee, country, start_date, filter_opt, adminlevel,
+                    cache)
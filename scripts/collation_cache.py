@@ -0,0 +1,96 @@
+import json
+import os
+
+
+# the collation result and the key it was built for, stored next to
+# campaign.db
+COLLATION_CACHE_FILE = "collation_cache.parquet"
+COLLATION_CACHE_PICKLE = "collation_cache.pickle"
+COLLATION_KEY_FILE = "collation_cache.json"
+
+
+class CollationCache:
+    """
+    Collation result of an EasyVVUQ campaign, stored in a columnar parquet
+    file next to campaign.db. The cache is keyed by the given key, e.g. the
+    campaign name, polynomial order and decoder, and by the digest of the
+    decoded outputs (see ResultsManifest.digest), so that a re-analysis of
+    unchanged runs can skip the decoding and collation.
+
+    Without a parquet engine (pyarrow or fastparquet), the collation result
+    is pickled instead, or the given pickle of it is used.
+    """
+
+    def __init__(self, campaign_work_dir, **key):
+        self.campaign_work_dir = campaign_work_dir
+        self.key = key
+        self.key_file = os.path.join(campaign_work_dir, COLLATION_KEY_FILE)
+
+    def _key(self, digest):
+        return dict(self.key, digest=digest)
+
+    def load(self, digest):
+        """
+        Return the cached collation result for digest, or None.
+        """
+        import pandas as pd
+
+        if not os.path.isfile(self.key_file):
+            return None
+        with open(self.key_file) as f:
+            cached = json.load(f)
+        if cached["key"] != self._key(digest):
+            return None
+
+        data_file = os.path.join(self.campaign_work_dir, cached["file"])
+        if not os.path.isfile(data_file):
+            return None
+        if data_file.endswith(".parquet"):
+            collation_result = pd.read_parquet(data_file)
+        else:
+            collation_result = pd.read_pickle(data_file)
+
+        # parquet only stores string column names
+        columns = [tuple(column) for column in cached["columns"]]
+        if all(len(column) == 1 for column in columns):
+            collation_result.columns = [column[0] for column in columns]
+        else:
+            collation_result.columns = pd.MultiIndex.from_tuples(columns)
+        return collation_result
+
+    def save(self, collation_result, digest, pickle_file=None):
+        """
+        Store collation_result for digest. pickle_file is an existing
+        pickle of collation_result in campaign_work_dir, e.g.
+        collation_result.pickle, which is used instead of pickling it again
+        if there is no parquet engine.
+        """
+        columns = [
+            [c.item() if hasattr(c, "item") else c for c in column]
+            if isinstance(column, tuple) else [column]
+            for column in collation_result.columns
+        ]
+        data = collation_result.copy()
+        data.columns = [str(i) for i in range(len(columns))]
+
+        data_file = COLLATION_CACHE_FILE
+        try:
+            data.to_parquet(
+                os.path.join(self.campaign_work_dir, data_file), index=False
+            )
+        except ImportError:
+            print("Warning: no parquet engine installed, "
+                  "the collation cache is pickled")
+            if pickle_file is not None:
+                data_file = os.path.relpath(pickle_file,
+                                            self.campaign_work_dir)
+            else:
+                data_file = COLLATION_CACHE_PICKLE
+                data.to_pickle(
+                    os.path.join(self.campaign_work_dir, data_file))
+
+        tmp_file = self.key_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"key": self._key(digest), "file": data_file,
+                       "columns": columns}, f)
+        os.replace(tmp_file, self.key_file)
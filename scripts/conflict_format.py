@@ -0,0 +1,224 @@
+import csv
+import io
+import numpy as np
+import os
+import sys
+
+
+# suffix of the run-length encoded conflict files
+INTERVALS_SUFFIX = "_intervals.csv"
+
+
+def conflicts_format(path):
+    """
+    Return the format of a conflict progression file from its name:
+    "npz" for bit-packed files, "intervals" for run-length encoded files,
+    and "csv" for the dense day x location csv read by Flee.
+    """
+    if path.endswith(".npz"):
+        return "npz"
+    if path.endswith(INTERVALS_SUFFIX):
+        return "intervals"
+    return "csv"
+
+
+def conflicts_header(names):
+    header = "#Day,"
+    for name in names:
+        header += " %s," % (name)
+    return header
+
+
+def conflict_intervals(flags):
+    """
+    Return the run-length encoding of a (days x locations) 0/1 array as a
+    list of (location index, start row, end row) intervals, end row
+    excluded.
+    """
+    flags = np.asarray(flags, dtype=np.int8)
+    padded = np.zeros((flags.shape[0] + 2, flags.shape[1]), dtype=np.int8)
+    padded[1:-1] = flags
+    change = np.diff(padded, axis=0).T
+    starts = np.argwhere(change == 1)
+    ends = np.argwhere(change == -1)
+    return [(loc, start, end)
+            for (loc, start), (_, end) in zip(starts.tolist(),
+                                              ends.tolist())]
+
+
+class ConflictProgression:
+    """
+    Conflict progression of a set of locations, i.e. a (days x locations)
+    array of 0/1 flags, with readers and writers for:
+    - the dense csv read by Flee (conflicts.csv),
+    - a bit-packed .npz file, storing one bit per location per day,
+    - a run-length encoded csv of (location, start_day, end_day) intervals.
+    The csv header and separator are kept, so that converting a csv to a
+    compact format and back gives an identical file.
+    """
+
+    def __init__(self, names, flags, days=None, sep=",", header=None,
+                 final_newline=True):
+        self.names = list(names)
+        self.flags = np.asarray(flags, dtype=np.uint8).reshape(
+            -1, len(self.names))
+        if days is None:
+            days = np.arange(self.flags.shape[0])
+        self.days = np.asarray(days, dtype=np.int64)
+        self.sep = sep
+        if header is None:
+            header = conflicts_header(self.names)
+        self.header = header
+        self.final_newline = final_newline
+
+    @classmethod
+    def read(cls, path):
+        fmt = conflicts_format(path)
+        if fmt == "npz":
+            return cls.read_npz(path)
+        if fmt == "intervals":
+            return cls.read_intervals(path)
+        return cls.read_csv(path)
+
+    def write(self, path):
+        fmt = conflicts_format(path)
+        if fmt == "npz":
+            self.write_npz(path)
+        elif fmt == "intervals":
+            self.write_intervals(path)
+        else:
+            self.write_csv(path)
+
+    @classmethod
+    def read_csv(cls, path):
+        with open(path, newline="") as f:
+            text = f.read()
+
+        lines = text.split("\n")
+        header = lines[0]
+        final_newline = text.endswith("\n")
+        rows = [line for line in lines[1:] if len(line.strip()) > 0]
+
+        names = [name.strip() for name in next(csv.reader([header]))[1:]]
+        names = [name for name in names if len(name) > 0]
+
+        sep = ", " if len(rows) > 0 and ", " in rows[0] else ","
+        values = np.array(
+            [row.replace(" ", "").rstrip(",").split(",") for row in rows],
+            dtype=np.int64
+        ).reshape(len(rows), len(names) + 1)
+
+        return cls(names, values[:, 1:], values[:, 0], sep, header,
+                   final_newline)
+
+    def write_csv(self, path):
+        rows = io.StringIO()
+        np.savetxt(rows, np.column_stack([self.days, self.flags]),
+                   fmt="%d", delimiter=self.sep)
+        with open(path, "w", newline="") as f:
+            f.write(self.header)
+            if len(self.days) > 0:
+                f.write("\n" + rows.getvalue().rstrip("\n"))
+            if self.final_newline:
+                f.write("\n")
+
+    @classmethod
+    def read_npz(cls, path):
+        with np.load(path) as data:
+            names = [str(name) for name in data["names"]]
+            flags = np.unpackbits(data["bits"], axis=1, count=len(names))
+            return cls(names, flags, data["days"], str(data["sep"]),
+                       str(data["header"]), bool(data["final_newline"]))
+
+    def write_npz(self, path):
+        np.savez_compressed(
+            path,
+            names=np.array(self.names, dtype=str),
+            days=self.days,
+            bits=np.packbits(self.flags, axis=1),
+            sep=np.array(self.sep),
+            header=np.array(self.header),
+            final_newline=np.array(self.final_newline)
+        )
+
+    @classmethod
+    def read_intervals(cls, path):
+        with open(path, newline="") as f:
+            header = f.readline().rstrip("\n")
+            layout = f.readline().rstrip("\n").split(",", 4)
+            names = f.readline().rstrip("\n").split(",")[1:]
+            f.readline()
+
+            first_day, num_days, final_newline = [int(x) for x in layout[1:4]]
+            index = {name: i for i, name in enumerate(names)}
+            flags = np.zeros((num_days, len(names)), dtype=np.uint8)
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+                name, start, end = line.rstrip("\n").rsplit(",", 2)
+                flags[int(start) - first_day:int(end) - first_day + 1,
+                      index[name]] = 1
+
+        return cls(names, flags,
+                   np.arange(first_day, first_day + num_days),
+                   layout[4], header, bool(final_newline))
+
+    def write_intervals(self, path):
+        """
+        Write one (location, start_day, end_day) line per conflict period,
+        end_day included. Only consecutive days can be written this way.
+        """
+        if len(self.days) > 1 and np.any(np.diff(self.days) != 1):
+            raise ValueError(
+                "intervals can only be written for consecutive days")
+        first_day = int(self.days[0]) if len(self.days) > 0 else 0
+
+        with open(path, "w", newline="") as f:
+            f.write(self.header + "\n")
+            f.write("#layout,%d,%d,%d,%s\n" % (
+                first_day, len(self.days), int(self.final_newline),
+                self.sep))
+            f.write("#names,%s\n" % (",".join(self.names)))
+            f.write("#location,start_day,end_day\n")
+            for loc, start, end in conflict_intervals(self.flags):
+                f.write("%s,%d,%d\n" % (
+                    self.names[loc], first_day + start, first_day + end - 1))
+
+
+def convert_conflicts(input_file, output_file):
+    """
+    Convert a conflict progression file between the supported formats.
+    """
+    ConflictProgression.read(input_file).write(output_file)
+
+
+def expand_conflicts(directory, remove=True):
+    """
+    Convert all compact conflict progression files found below directory
+    into the csv files read by Flee, e.g. conflicts-0.npz into
+    conflicts-0.csv.
+    """
+    converted = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            fmt = conflicts_format(path)
+            if fmt == "npz":
+                csv_file = path[:-len(".npz")] + ".csv"
+            elif fmt == "intervals":
+                csv_file = path[:-len(INTERVALS_SUFFIX)] + ".csv"
+            else:
+                continue
+            convert_conflicts(path, csv_file)
+            if remove:
+                os.remove(path)
+            converted.append(csv_file)
+
+    return converted
+
+
+if __name__ == "__main__":
+    """
+    Usage <this> <input> <output>
+    """
+    convert_conflicts(sys.argv[1], sys.argv[2])
@@ -0,0 +1,109 @@
+import csv
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+SIM_CAMPS_COLUMN = "refugees in camps (simulation)"
+DATA_CAMPS_COLUMN = "refugees in camps (UNHCR)"
+
+
+def read_validation_columns(out_csv):
+    """
+    Read the per-camp "sim" and "data" columns, and the camp totals, from a
+    Flee out.csv file.
+    Returns (camp_names, sim, data, sim_total, data_total), where sim and
+    data are (days x camps) arrays.
+    """
+    with open(out_csv, newline="") as f:
+        header = [h.strip() for h in next(csv.reader(f))]
+
+    camp_names = [h[:-len(" sim")] for h in header
+                  if h.endswith(" sim") and
+                  "{} data".format(h[:-len(" sim")]) in header]
+
+    sim_cols = [header.index("{} sim".format(c)) for c in camp_names]
+    data_cols = [header.index("{} data".format(c)) for c in camp_names]
+    total_cols = [header.index(SIM_CAMPS_COLUMN),
+                  header.index(DATA_CAMPS_COLUMN)]
+
+    values = np.loadtxt(out_csv, delimiter=",", skiprows=1, ndmin=2,
+                        usecols=sim_cols + data_cols + total_cols)
+
+    n = len(camp_names)
+    return (camp_names, values[:, :n], values[:, n:2 * n],
+            values[:, 2 * n], values[:, 2 * n + 1])
+
+
+def validation_errors(sim, data, sim_total, data_total):
+    """
+    Compute the daily validation error, both with and without rescaling the
+    simulated camp populations to the UNHCR camp total, following the
+    definitions used by flee/postprocessing/extract-validation-results.py.
+    Returns (error, error_rescaled), averaged over all days.
+    """
+    has_sim = sim_total > 0
+    scale = np.zeros(len(sim_total))
+    scale[has_sim] = data_total[has_sim] / sim_total[has_sim]
+
+    norm = np.maximum(data_total, 1.0)
+    error = np.abs(sim - data).sum(axis=1) / norm
+    error_rescaled = np.abs(sim * scale[:, None] - data).sum(axis=1) / norm
+
+    return float(np.mean(error)), float(np.mean(error_rescaled))
+
+
+def score_run(output_dir):
+    """
+    Return (error, error_rescaled) for a single Flee run directory.
+    """
+    _, sim, data, sim_total, data_total = read_validation_columns(
+        os.path.join(output_dir, "out.csv"))
+    return validation_errors(sim, data, sim_total, data_total)
+
+
+def _score_run_or_none(output_dir):
+    try:
+        return score_run(output_dir)
+    except Exception as exception:
+        print("error: validation failed on {}: {}".format(
+            output_dir, exception), file=sys.stderr)
+        return None
+
+
+def score_ensemble(runs_dir, workers=1, out_file=None):
+    """
+    Compute the validation errors of all run directories in runs_dir,
+    using a pool of worker processes.
+    The scores are written, one row per run, to out_file if given.
+    Returns a dict of run name -> (error, error_rescaled), with None for runs
+    that could not be scored.
+    """
+    run_names = sorted(
+        d for d in os.listdir(runs_dir)
+        if os.path.isdir(os.path.join(runs_dir, d))
+    )
+    run_dirs = [os.path.join(runs_dir, d) for d in run_names]
+
+    if workers > 1 and len(run_dirs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scores = list(pool.map(_score_run_or_none, run_dirs,
+                                   chunksize=max(1, len(run_dirs) //
+                                                 (4 * workers))))
+    else:
+        scores = [_score_run_or_none(d) for d in run_dirs]
+
+    results = dict(zip(run_names, scores))
+
+    if out_file is not None:
+        with open(out_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["run", "Error", "Error (rescaled)"])
+            for run_name, score in results.items():
+                if score is None:
+                    writer.writerow([run_name, "", ""])
+                else:
+                    writer.writerow([run_name, *score])
+
+    return results
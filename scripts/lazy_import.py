@@ -0,0 +1,37 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported on first attribute access.
+    This keeps the import of the FabFlee plugin, i.e. the registration of its
+    tasks, free of the heavy analysis libraries until a task uses them.
+    """
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name):
+    """
+    Return the module name if it is already loaded, and a LazyModule for it
+    otherwise.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def lazy_function(module_name, function_name):
+    """
+    Return a function that imports module_name on its first call, and then
+    calls module_name.function_name.
+    """
+    def function(*args, **kwargs):
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)(*args, **kwargs)
+
+    function.__name__ = function_name
+    return function
@@ -1,47 +1,102 @@
 from flee import InputGeography
 import numpy as np
+import os
 import sys
 
+try:
+    from .conflict_format import ConflictProgression
+except ImportError:
+    from conflict_format import ConflictProgression
 
-def location2conflict(simulation_period, input_file, output_file):
+
+# conflict date of the locations which are not a conflict zone
+NO_CONFLICT = np.iinfo(np.int64).max
+
+
+def read_conflict_dates(input_file):
+    """
+    Return the names and conflict dates of the locations in input_file,
+    with NO_CONFLICT as date of the locations which are not a conflict zone.
+    """
     ig = InputGeography.InputGeography()
 
     ig.ReadLocationsFromCSV(input_file)
 
-    file = open(output_file, "w")
+    names = [l[0] for l in ig.locations]
+    dates = np.array(
+        [int(l[5]) if l[4] == "conflict_zone" else NO_CONFLICT
+         for l in ig.locations],
+        dtype=np.int64
+    )
+    return names, dates
 
-    output_header_string = "#Day,"
 
-    for l in ig.locations:
-        output_header_string += " %s," % (l[0])
+def conflict_matrix(dates, simulation_period):
+    """
+    Return the (days x locations) conflict flags, i.e. 1 from the conflict
+    date of a location onwards.
+    """
+    days = np.arange(simulation_period)
+    return (dates[np.newaxis, :] <= days[:, np.newaxis]).astype(np.uint8)
 
-    output_header_string += "\n"
-    file.write(output_header_string)
 
-    for t in range(0, simulation_period):
+def read_conflict_period(input_dir):
+    """
+    Return the simulation period (Length) given in conflict_period.csv.
+    """
+    with open(os.path.join(input_dir, "conflict_period.csv")) as f:
+        for line in f:
+            key, _, value = line.partition(",")
+            if key.strip() == "Length":
+                return int(value)
 
-        output = "%s" % t
+    raise ValueError(
+        "no Length found in {}/conflict_period.csv".format(input_dir))
 
-        for l in ig.locations:
-            # print(l)
-            if l[4] == "conflict_zone":
-                confl_date = int(l[5])
-                if confl_date <= t:
-                    output += ", 1"
-                else:
-                    output += ", 0"
-            else:
-                output += ", 0"
 
-        output += "\n"
-        file.write(output)
+def location2conflict(simulation_period, input_file, output_file):
+    """
+    Write the conflict progression of the locations in input_file over
+    simulation_period days to output_file. simulation_period and output_file
+    may also be lists of the same length, in which case the locations are
+    read once and a conflicts file is written for each period.
+    """
+    if isinstance(simulation_period, (list, tuple)):
+        periods = list(simulation_period)
+        output_files = list(output_file)
+    else:
+        periods = [simulation_period]
+        output_files = [output_file]
+
+    names, dates = read_conflict_dates(input_file)
+    flags = conflict_matrix(dates, max(periods))
+
+    for period, out_file in zip(periods, output_files):
+        ConflictProgression(
+            names=names, flags=flags[:int(period)], sep=", "
+        ).write(out_file)
 
-    file.close()
+
+def location2conflict_batch(jobs):
+    """
+    Generate the conflicts files of many configs or simulation periods in one
+    go, e.g. for all members of a SWEEP directory. jobs is a list of
+    (simulation_period, input_file, output_file) tuples; each input file is
+    read only once.
+    """
+    by_input = {}
+    for simulation_period, input_file, output_file in jobs:
+        periods, output_files = by_input.setdefault(input_file, ([], []))
+        periods.append(int(simulation_period))
+        output_files.append(output_file)
+
+    for input_file, (periods, output_files) in by_input.items():
+        location2conflict(periods, input_file, output_files)
 
 
 if __name__ == "__main__":
     """
-    Usage <this> <end_time> <input> <output>
+    Usage <this> <end_time> <input> <output> [<end_time> <input> <output> ...]
     """
 
     end_time = 100
@@ -50,11 +105,8 @@ if __name__ == "__main__":
         if (sys.argv[1]).isnumeric():
             end_time = int(sys.argv[1])
 
-    input_file = sys.argv[2]
-    output_file = sys.argv[3]
+    jobs = [(end_time, sys.argv[2], sys.argv[3])]
+    for i in range(4, len(sys.argv) - 2, 3):
+        jobs.append((int(sys.argv[i]), sys.argv[i + 1], sys.argv[i + 2]))
 
-    location2conflict(
-        simulation_period=end_time,
-        input_file=input_file,
-        output_file=output_file
-    )
+    location2conflict_batch(jobs)
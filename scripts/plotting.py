@@ -0,0 +1,241 @@
+import glob
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from .lazy_import import lazy_import
+except ImportError:
+    from lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+
+# plot modes: "full" for the publication figures, "fast" for low resolution
+# previews, and "off" to only write the numeric results of an analysis
+PLOT_MODES = {"full": 400, "fast": 100, "off": None}
+
+# formats recognised as the extension of a figure file name
+FIGURE_FORMATS = [".png", ".svg", ".pdf"]
+
+_settings = {"mode": "full", "format": "png", "dpi": 400}
+
+
+def use_headless_backend():
+    """
+    Select the non-interactive Agg backend of matplotlib, so that figures are
+    only rendered to files and no display is needed, e.g. on a compute node.
+    """
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].switch_backend("Agg")
+    else:
+        os.environ["MPLBACKEND"] = "Agg"
+
+
+def configure(mode="full", fmt=None, dpi=None):
+    """
+    Set how the analysis tasks render their figures:
+    - mode: "full" (400 dpi), "fast" (100 dpi) or "off" (no figures),
+    - fmt: file format of the figures, e.g. "png" or "svg",
+    - dpi: resolution of the figures, overrides the default of the mode.
+    """
+    if mode not in PLOT_MODES:
+        raise ValueError("unknown plot mode {}, expected one of {}".format(
+            mode, list(PLOT_MODES)))
+    _settings["mode"] = mode
+    _settings["format"] = fmt if fmt else "png"
+    _settings["dpi"] = int(dpi) if dpi else PLOT_MODES[mode]
+    use_headless_backend()
+
+
+def configure_from_env(env):
+    """
+    Configure the plots from the plot_mode, plot_format and plot_dpi
+    variables of the FabSim environment, and return the number of processes
+    to render them with (plot_workers).
+    """
+    configure(mode=str(env.get("plot_mode", "full")),
+              fmt=env.get("plot_format"), dpi=env.get("plot_dpi"))
+    return int(env.get("plot_workers", 1))
+
+
+def plots_enabled():
+    return _settings["mode"] != "off"
+
+
+def save_figure(fig, file_name):
+    """
+    Save fig to file_name, with the format and resolution set by configure,
+    and close it. A .png/.svg/.pdf extension of file_name is replaced by the
+    configured format.
+    """
+    import matplotlib.pyplot as plt
+
+    root, ext = os.path.splitext(file_name)
+    if ext.lower() in FIGURE_FORMATS:
+        file_name = root
+    path = "{}.{}".format(file_name, _settings["format"])
+    fig.savefig(path, dpi=_settings["dpi"], format=_settings["format"])
+    plt.close(fig)
+    return path
+
+
+def _init_plot_worker(settings):
+    _settings.update(settings)
+    use_headless_backend()
+
+
+class PlotPool:
+    """
+    Renders figures in a pool of worker processes, so that an analysis task
+    does not wait for them one by one. submit() takes a module-level function
+    which draws and saves its figures with save_figure. The plots are made in
+    the calling process if workers <= 1, and not at all if the plot mode is
+    "off". Leaving the with block waits for all submitted plots.
+    """
+
+    def __init__(self, workers=1):
+        self.pool = None
+        self.futures = {}
+        if workers > 1 and plots_enabled():
+            # fork, so that the workers inherit the loaded plugin modules
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_plot_worker,
+                initargs=(dict(_settings),)
+            )
+
+    def submit(self, function, *args):
+        if not plots_enabled():
+            return
+        if self.pool is None:
+            function(*args)
+        else:
+            self.futures[self.pool.submit(function, *args)] = \
+                function.__name__
+
+    def wait(self):
+        if self.pool is None:
+            return
+        failed = []
+        for future in as_completed(self.futures):
+            if future.exception() is not None:
+                failed.append("{}: {}".format(
+                    self.futures[future], future.exception()))
+        self.futures = {}
+        self.pool.shutdown()
+        self.pool = None
+
+        if len(failed) > 0:
+            raise RuntimeError(
+                "{} plots failed:\n{}".format(len(failed), "\n".join(failed)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wait()
+
+
+def plot_campaign_results(plot_data):
+    """
+    Plot the raw data, statistical moments and first order Sobol indices of
+    an EasyVVUQ campaign. plot_data is a dict with:
+    campaign_work_dir, polynomial_order, sampler_name, num_runs,
+    output_filename, output_column, mean, std and sobols_first.
+    """
+    import matplotlib.pyplot as plt
+
+    campaign_work_dir = plot_data["campaign_work_dir"]
+    output_filename = plot_data["output_filename"]
+    output_column = plot_data["output_column"]
+
+    fig_desc = "polynomial_order = {}, num_runs = {}, sampler = {}".format(
+        plot_data["polynomial_order"],
+        plot_data["num_runs"],
+        plot_data["sampler_name"]
+    )
+    props = dict(boxstyle="round", facecolor="wheat", alpha=0.5)
+
+    ########################
+    #    Plot raw data     #
+    ########################
+    output_files = glob.glob(
+        os.path.join(campaign_work_dir + "/**/%s" % (output_filename)),
+        recursive=True
+    )
+
+    fig, ax = plt.subplots()
+    ax.set_xlabel("days")
+    ax.set_ylabel(output_column)
+    fig.suptitle(
+        "RAW data : column {}\n".format(output_column),
+        fontsize=10, fontweight="bold"
+    )
+    ax.set_title(
+        fig_desc, fontsize=8, loc="center",
+        fontweight="bold", bbox=props
+    )
+    for output_file in output_files:
+        total_errors = pd.read_csv(output_file)[
+            output_column].values.tolist()
+        ax.plot(total_errors)
+
+    plot_file_name = "raw[{}]".format(output_column)
+    save_figure(fig, os.path.join(campaign_work_dir, plot_file_name))
+
+    ###################################
+    #    Plot statistical_moments     #
+    ###################################
+    fig, ax = plt.subplots()
+    ax.set_xlabel("days")
+    ax.set_ylabel("velocity {}".format(output_column))
+    fig.suptitle(
+        "code mean +/- standard deviation\n",
+        fontsize=10, fontweight="bold"
+    )
+    ax.set_title(
+        fig_desc, fontsize=8, loc="center",
+        fontweight="bold", bbox=props
+    )
+
+    mean = plot_data["mean"]
+    std = plot_data["std"]
+    X = range(len(mean))
+    ax.plot(X, mean, "b-", label="mean")
+    ax.plot(X, mean - std, "--r", label="+1 std-dev")
+    ax.plot(X, mean + std, "--r")
+    ax.fill_between(X, mean - std, mean + std, color="r", alpha=0.2)
+    ax.legend(loc="best")
+    plot_file_name = "plot_statistical_moments[{}]".format(output_column)
+    save_figure(fig, os.path.join(campaign_work_dir, plot_file_name))
+
+    ###################################
+    #        Plot sobols_first        #
+    ###################################
+    fig, ax = plt.subplots()
+    ax.set_xlabel("days")
+    ax.set_ylabel("Sobol indices")
+    fig.suptitle(
+        "First order Sobol index [output column = {}]\n".format(
+            output_column),
+        fontsize=10, fontweight="bold"
+    )
+    ax.set_title(
+        fig_desc, fontsize=8, loc="center",
+        fontweight="bold", bbox=props
+    )
+
+    sobols_first = plot_data["sobols_first"]
+    for v in sobols_first:
+        y = sobols_first[v].ravel()
+        if y[-1] != 0:
+            ax.plot(y, label=v)
+        else:
+            print("{} ignored for plotting".format(v))
+
+    ax.legend(loc="best")
+    plot_file_name = "plot_sobols_first[{}]".format(output_column)
+    save_figure(fig, os.path.join(campaign_work_dir, plot_file_name))
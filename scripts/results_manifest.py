@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+
+
+# name of the manifest, stored next to campaign.db
+MANIFEST_FILE = "results_manifest.json"
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class ResultsManifest:
+    """
+    Record of the run outputs ingested by an analysis task, stored next to
+    campaign.db: output file, relative to the campaign directory -> size,
+    mtime and sha1 of the file, and the result decoded from it. Re-running
+    the analysis only fetches and decodes the runs which are new, or whose
+    output changed since.
+
+    context describes how the files are decoded, e.g. the output columns of
+    the decoder; entries recorded with another context are discarded.
+    """
+
+    def __init__(self, campaign_work_dir, context=""):
+        self.campaign_work_dir = campaign_work_dir
+        self.path = os.path.join(campaign_work_dir, MANIFEST_FILE)
+        self.context = context
+        self.entries = {}
+        self.decoded = 0
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get("context") == context:
+                self.entries = manifest["runs"]
+
+    def _key(self, path):
+        return os.path.relpath(path, self.campaign_work_dir)
+
+    def is_current(self, path):
+        """
+        Return True if the file path was already decoded. The sha1 is only
+        computed when the size or mtime of the file changed, e.g. after it
+        was fetched again.
+        """
+        entry = self.entries.get(self._key(path))
+        if entry is None or not os.path.isfile(path):
+            return False
+        state = _file_state(path)
+        if state["size"] != entry["size"]:
+            return False
+        if state["mtime"] != entry["mtime"]:
+            if file_sha1(path) != entry["sha1"]:
+                return False
+            entry.update(state)
+        return True
+
+    def pending(self, paths):
+        """
+        Return the files of paths which are new or changed.
+        """
+        return [path for path in paths if not self.is_current(path)]
+
+    def decode(self, path, decode_function):
+        """
+        Return the result of decode_function(path), which is only called if
+        the file is new or changed.
+        """
+        if self.is_current(path):
+            return self.entries[self._key(path)]["result"]
+
+        result = decode_function(path)
+        self.entries[self._key(path)] = dict(
+            _file_state(path), sha1=file_sha1(path), result=result
+        )
+        self.decoded += 1
+        return result
+
+    def digest(self, paths):
+        """
+        Return a digest of the recorded contents of the files of paths,
+        which identifies the set of decoded outputs.
+        """
+        h = hashlib.sha1()
+        for key in sorted(self._key(path) for path in paths):
+            if key in self.entries:
+                h.update(key.encode())
+                h.update(self.entries[key]["sha1"].encode())
+        return h.hexdigest()
+
+    def save(self):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"context": self.context, "runs": self.entries}, f)
+        os.replace(tmp_file, self.path)
+
+
+def campaign_output_files(campaign, target_filename, collated=False):
+    """
+    Return the paths of the output files of the runs of an EasyVVUQ
+    campaign which are not collated yet, or of all its runs if collated.
+    """
+    from easyvvuq.constants import Status
+
+    if collated:
+        runs = campaign.campaign_db.runs()
+    else:
+        runs = campaign.campaign_db.runs(status=Status.NEW)
+    return [
+        os.path.join(run_info["run_dir"], target_filename)
+        for run_id, run_info in runs
+    ]
+
+
+def ingest_campaign_results(campaign, decoder, manifest):
+    """
+    Decode the output of the runs of an EasyVVUQ campaign which are not
+    collated yet, and store the results in the campaign database. Outputs
+    recorded in the manifest are not decoded again. Runs without output
+    are left to campaign.execute().collate().
+    """
+    from easyvvuq.constants import Status
+
+    def decode_function(path):
+        return decoder.parse_sim_output({"run_dir": os.path.dirname(path)})
+
+    results = []
+    for run_id, run_info in campaign.campaign_db.runs(status=Status.NEW):
+        path = os.path.join(run_info["run_dir"], decoder.target_filename)
+        if not os.path.isfile(path):
+            continue
+        results.append((run_id, manifest.decode(path, decode_function)))
+
+    campaign.campaign_db.store_results(campaign._active_app_name, results)
+    manifest.save()
+
+    print("decoded {} of {} runs, reused the others from {}".format(
+        manifest.decoded, len(results), manifest.path))
@@ -1,19 +1,43 @@
+import copy
 import numpy as np
+import os
+import random
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from flee import InputGeography
 from flare import Ecosystem
 
+try:
+    from .conflict_format import ConflictProgression, INTERVALS_SUFFIX
+except ImportError:
+    from conflict_format import ConflictProgression, INTERVALS_SUFFIX
+
+
+# InputGeography shared by all Flare instances evolved in a worker process
+_worker_geography = {}
 
-def run_flare(config_dir, flare_out_dir,
-              simulation_period=100, file_suffix=""):
 
+def read_geography(config_dir, file_suffix=""):
     ig = InputGeography.InputGeography()
 
     ig.ReadLocationsFromCSV("%s/locations%s.csv" % (config_dir, file_suffix))
 
     ig.ReadLinksFromCSV("%s/routes%s.csv" % (config_dir, file_suffix))
 
+    return ig
+
+
+def evolve_flare(ig, flare_out_dir, simulation_period=100, seed=None):
+    """
+    Evolve a single Flare instance on the InputGeography ig, and write the
+    conflict progression to flare_out_dir, as a csv or, depending on its
+    extension, in one of the compact formats of conflict_format.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
     e = Ecosystem.Ecosystem()
 
     lm = e.StoreInputGeographyInEcosystem(ig)
@@ -21,32 +45,103 @@ def run_flare(config_dir, flare_out_dir,
     # print("Network data loaded")
 
     print("output file -> %s" % (flare_out_dir))
-    file = open("%s" % flare_out_dir, "w")
-
-    output_header_string = "#Day,"
 
-    for l in e.locations:
-        output_header_string += " %s," % (l.name)
-
-    output_header_string += "\n"
-    file.write(output_header_string)
+    flags = np.zeros((simulation_period, len(e.locations)), dtype=np.uint8)
 
     for t in range(0, simulation_period):
 
         e.evolve()
 
-        output = "%s" % t
+        flags[t] = [1 if l.flare else 0 for l in e.locations]
 
-        for l in e.locations:
-            if l.flare:
-                output += ",1"
-            else:
-                output += ",0"
+    ConflictProgression(
+        names=[l.name for l in e.locations], flags=flags
+    ).write(flare_out_dir)
 
-        output += "\n"
-        file.write(output)
 
-    file.close()
+def run_flare(config_dir, flare_out_dir,
+              simulation_period=100, file_suffix="", seed=None):
+
+    ig = read_geography(config_dir, file_suffix)
+
+    evolve_flare(ig, flare_out_dir, simulation_period, seed)
+
+
+def init_worker(config_dir, file_suffix="", module_paths=()):
+    """
+    Read the geography once per worker process.
+    """
+    for p in module_paths:
+        if p not in sys.path:
+            sys.path.insert(0, p)
+
+    _worker_geography["ig"] = read_geography(config_dir, file_suffix)
+
+
+def run_instance(flare_out_dir, simulation_period, seed):
+    os.makedirs(os.path.dirname(flare_out_dir), exist_ok=True)
+    evolve_flare(copy.deepcopy(_worker_geography["ig"]), flare_out_dir,
+                 simulation_period, seed)
+    return flare_out_dir
+
+
+def run_flare_ensemble(config_dir, out_dir, N, simulation_period=100,
+                       file_suffix="", workers=1, seed=None,
+                       module_paths=(), out_format="csv"):
+    """
+    Evolve N independently seeded Flare instances on a process pool, sharing
+    a single read of the geography per worker. Instance i is written to
+    <out_dir>/<i>/input_csv/conflicts<file_suffix>.csv, i.e. the SWEEP layout
+    used by couple_flare_to_flee. With out_format "npz" or "intervals" the
+    compact formats of conflict_format are written instead of the csv.
+
+    The instance seeds are spawned from seed, so that a given seed
+    reproduces the whole ensemble independently of the number of workers.
+    """
+    seeds = [
+        int(s.generate_state(1)[0])
+        for s in np.random.SeedSequence(seed).spawn(int(N))
+    ]
+    extension = {"csv": ".csv", "npz": ".npz",
+                 "intervals": INTERVALS_SUFFIX}[out_format]
+    out_files = [
+        os.path.join(out_dir, str(i), "input_csv",
+                     "conflicts%s%s" % (file_suffix, extension))
+        for i in range(int(N))
+    ]
+
+    if workers <= 1:
+        init_worker(config_dir, file_suffix, module_paths)
+        for out_file, instance_seed in zip(out_files, seeds):
+            run_instance(out_file, simulation_period, instance_seed)
+        return out_files
+
+    print("running {} Flare instances with {} worker(s)".format(
+        N, workers))
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(config_dir, file_suffix,
+                                       module_paths)) as pool:
+        futures = {
+            pool.submit(run_instance, out_file, simulation_period,
+                        instance_seed): out_file
+            for out_file, instance_seed in zip(out_files, seeds)
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as exception:
+                print("Error: {} failed: {}".format(
+                    futures[future], exception))
+                failed.append(futures[future])
+
+    if len(failed) > 0:
+        raise RuntimeError(
+            "{} Flare instance(s) failed: {}".format(len(failed), failed))
+
+    return out_files
 
 
 if __name__ == "__main__":
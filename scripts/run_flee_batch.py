@@ -0,0 +1,223 @@
+import contextlib
+import copy
+import hashlib
+import os
+import runpy
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# InputGeography readers whose results are shared between SWEEP members
+# handled by the same worker process.
+CACHED_READERS = ["ReadLocationsFromCSV", "ReadLinksFromCSV",
+                  "ReadClosuresFromCSV", "ReadFlareConflictInputCSV"]
+
+_worker_cache = {}
+_default_settings = {}
+
+
+def _file_key(path):
+    """
+    Key a file (or directory) on its contents rather than its path, since
+    each SWEEP member works on its own copy of the shared input files.
+    """
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, name)):
+                h.update(name.encode())
+                h.update(_file_key(os.path.join(path, name)).encode())
+    elif os.path.isfile(path):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    else:
+        h.update(os.path.abspath(path).encode())
+    return h.hexdigest()
+
+
+def _changed(old, new):
+    try:
+        return bool(old != new)
+    except ValueError:
+        # e.g. numpy arrays, which have no single truth value.
+        return True
+
+
+def _cached_reader(reader):
+    """
+    Wrap an InputGeography reader so that a given csv file is parsed only
+    once per worker. The attributes set by the first call are stored and
+    copied onto the InputGeography object on subsequent calls.
+    """
+    def wrapper(self, csv_name, *args, **kwargs):
+        key = (reader.__name__, _file_key(csv_name), args,
+               tuple(sorted(kwargs.items())))
+        if key not in _worker_cache:
+            before = copy.deepcopy(self.__dict__)
+            reader(self, csv_name, *args, **kwargs)
+            _worker_cache[key] = {
+                k: copy.deepcopy(v) for k, v in self.__dict__.items()
+                if k not in before or _changed(before[k], v)
+            }
+        for k, v in _worker_cache[key].items():
+            setattr(self, k, copy.deepcopy(v))
+
+    wrapper.__name__ = reader.__name__
+    return wrapper
+
+
+def _cached_refugee_table(table_class):
+    """
+    Wrap the RefugeeTable constructor so that the source_data directory is
+    parsed only once per worker.
+    """
+    def factory(*args, **kwargs):
+        data_directory = kwargs.get("data_directory", "")
+        key = ("RefugeeTable", _file_key(data_directory), args,
+               tuple(sorted(kwargs.items())))
+        if key not in _worker_cache:
+            _worker_cache[key] = table_class(*args, **kwargs)
+        return copy.deepcopy(_worker_cache[key])
+
+    return factory
+
+
+def init_worker(flee_location):
+    """
+    Import flee once per worker process and install the caching readers.
+    """
+    for p in flee_location.split(":"):
+        sys.path.insert(0, p)
+
+    os.environ.setdefault("FLEE_TYPE_CHECK", "False")
+
+    from flee import flee, InputGeography
+    from flee.datamanager import handle_refugee_data
+
+    for name in CACHED_READERS:
+        reader = getattr(InputGeography.InputGeography, name, None)
+        if reader is not None:
+            setattr(InputGeography.InputGeography, name,
+                    _cached_reader(reader))
+
+    handle_refugee_data.RefugeeTable = _cached_refugee_table(
+        handle_refugee_data.RefugeeTable)
+
+    # keep a pristine copy of the simulation settings, so that settings from
+    # one SWEEP member do not leak into the next one.
+    _default_settings.update({
+        k: copy.deepcopy(v)
+        for k, v in vars(flee.SimulationSettings).items()
+        if not k.startswith("__") and not callable(v)
+        and not isinstance(v, (classmethod, staticmethod))
+    })
+
+
+def _reset_simulation_settings():
+    from flee import flee
+
+    for k, v in _default_settings.items():
+        setattr(flee.SimulationSettings, k, copy.deepcopy(v))
+
+
+def _run_script(run_script, run_dir, args, out_file):
+    """
+    Run run_script from within run_dir, as `run_script <args> > out_file`.
+    """
+    cwd = os.getcwd()
+    argv = sys.argv
+    os.chdir(run_dir)
+    sys.argv = [run_script] + args
+    try:
+        with open(out_file, "w") as out, contextlib.redirect_stdout(out):
+            runpy.run_path(run_script, run_name="__main__")
+    except SystemExit as exception:
+        if exception.code not in [None, 0]:
+            raise RuntimeError(
+                "{} exited with code {}".format(run_script, exception.code))
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+
+
+def run_member(run_script, run_dir, simulation_period,
+               simsetting_file="simsetting.yml", out_file="out.csv",
+               uncertainty=False):
+    """
+    Run a single SWEEP member in the current worker process.
+    The run script is executed exactly as the flee job template would do it,
+    i.e. `run.py input_csv source_data <period> <simsetting> > out.csv`,
+    from within run_dir, followed by
+    `run_UNHCR_uncertainty.py input_csv source_data <period> simsetting.csv
+    > out_uncertainty.csv` if uncertainty is True.
+    """
+    _reset_simulation_settings()
+    _run_script(run_script, run_dir,
+                ["input_csv", "source_data", str(simulation_period),
+                 simsetting_file],
+                out_file)
+
+    if uncertainty:
+        _reset_simulation_settings()
+        _run_script("run_UNHCR_uncertainty.py", run_dir,
+                    ["input_csv", "source_data", str(simulation_period),
+                     "simsetting.csv"],
+                    "out_uncertainty.csv")
+
+    return run_dir
+
+
+def prepare_run_dirs(config_dir, sweep_dir, runs_dir):
+    """
+    Create one run directory per SWEEP member under runs_dir, containing the
+    base config files overlaid with the files of the SWEEP member, i.e. the
+    same layout as produced by run_ensemble.
+    """
+    run_dirs = []
+    for member in sorted(os.listdir(sweep_dir)):
+        member_dir = os.path.join(sweep_dir, member)
+        if not os.path.isdir(member_dir):
+            continue
+        run_dir = os.path.join(runs_dir, member)
+        shutil.copytree(config_dir, run_dir, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns("SWEEP"))
+        shutil.copytree(member_dir, run_dir, dirs_exist_ok=True)
+        run_dirs.append(run_dir)
+
+    return run_dirs
+
+
+def run_flee_batch(flee_location, run_script, run_dirs, simulation_period,
+                   workers=1, simsetting_file="simsetting.yml",
+                   uncertainty=False):
+    """
+    Run a list of prepared SWEEP run directories in a persistent pool of
+    worker processes. With uncertainty, run_UNHCR_uncertainty.py is run
+    after each member, as the flee and pflee templates do.
+    """
+    print("running {} SWEEP members with {} worker(s)".format(
+        len(run_dirs), workers))
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(flee_location,)) as pool:
+        futures = {
+            pool.submit(run_member, run_script, run_dir,
+                        simulation_period, simsetting_file,
+                        uncertainty=uncertainty): run_dir
+            for run_dir in run_dirs
+        }
+        for future in as_completed(futures):
+            run_dir = futures[future]
+            try:
+                future.result()
+                print("finished {}".format(run_dir))
+            except Exception as exception:
+                print("Error: {} failed: {}".format(run_dir, exception))
+                failed.append(run_dir)
+
+    if len(failed) > 0:
+        raise RuntimeError(
+            "{} SWEEP member(s) failed: {}".format(len(failed), failed))
@@ -0,0 +1,209 @@
+import copy
+import csv
+import os
+import re
+
+
+# the csv files of a conflict that can be edited
+SCENARIO_FILES = ["locations", "routes", "closures"]
+
+# the refinement commands handled by the ScenarioEditor
+EDIT_COMMANDS = ["change_capacities", "add_camp", "add_new_link",
+                 "delete_location", "change_distance", "close_camp",
+                 "close_border", "redirect"]
+
+
+def _cell(row, col):
+    return row[col].strip() if col < len(row) else ""
+
+
+def _set(row, col, value):
+    # routes added by add_new_link have no forced_redirection column
+    while len(row) <= col:
+        row.append("")
+    row[col] = value
+
+
+def parse_command(command):
+    """
+    Parse a FabFlee refinement command, either as written in
+    commands.log.txt (`fab localhost close_camp:Z,ZZZ`) or without the
+    `fab <machine>` prefix, into (task name, args, kwargs).
+    """
+    command = command.strip()
+    if command.startswith("fab "):
+        command = command.split(None, 2)[2]
+
+    name, _, arg_string = command.partition(":")
+    args = []
+    kwargs = {}
+    if name == "change_capacities":
+        # older logs contain the capacities without separators, e.g. Z=10Y=20
+        kwargs = dict(re.findall(r"([^=,]+?)=(\d+),?", arg_string))
+    elif len(arg_string) > 0:
+        for arg in arg_string.split(","):
+            if "=" in arg:
+                k, v = arg.split("=", 1)
+                kwargs[k] = v
+            else:
+                args.append(arg)
+    return name, args, kwargs
+
+
+class ScenarioEditor:
+    """
+    In-memory editor for the locations, routes and closures of a conflict.
+
+    The csv files are read once into name-indexed tables, any number of edits
+    is applied to these tables, and each modified file is written once.
+    The edit methods have the same effect as the FabFlee refinement tasks of
+    the same name.
+    """
+
+    def __init__(self, conflict_dir):
+        self.conflict_dir = conflict_dir
+        self.tables = {}
+        for name in SCENARIO_FILES:
+            path = os.path.join(conflict_dir, "{}.csv".format(name))
+            self.tables[name] = []
+            if os.path.isfile(path):
+                with open(path, newline="") as f:
+                    self.tables[name] = [row for row in csv.reader(f)]
+        self.modified = set()
+        self._index()
+
+    def _index(self):
+        # name -> rows, without the header rows
+        self.locations = {}
+        for row in self.tables["locations"][1:]:
+            self.locations.setdefault(_cell(row, 0), []).append(row)
+        self.routes = {}
+        for row in self.tables["routes"][1:]:
+            self.routes.setdefault(
+                (_cell(row, 0), _cell(row, 1)), []).append(row)
+        self.closures = {}
+        for row in self.tables["closures"][1:]:
+            self.closures.setdefault(
+                (_cell(row, 0), _cell(row, 1), _cell(row, 2)), []).append(row)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def change_capacities(self, **capacities):
+        for camp_name, capacity in capacities.items():
+            for row in self.locations.get(camp_name, []):
+                if _cell(row, 5) == "camp":
+                    _set(row, 7, capacity)
+        self.modified.add("locations")
+
+    def add_camp(self, camp_name, region=" ", country=" ", lat=0.0, lon=0.0):
+        if camp_name in self.locations:
+            print("Warning: camp %s is already present in locations.csv."
+                  % (camp_name))
+            return
+        row = [camp_name, region, country, lat, lon, "camp"]
+        self.tables["locations"].append(row)
+        self.locations[camp_name] = [row]
+        self.modified.add("locations")
+
+    def add_new_link(self, name1, name2, distance):
+        row = [name1, name2, distance]
+        self.tables["routes"].append(row)
+        self.routes.setdefault((name1, name2), []).append(row)
+        self.modified.add("routes")
+
+    def delete_location(self, location_name):
+        rows = self.locations.pop(location_name, [])
+        self.tables["locations"] = [
+            row for row in self.tables["locations"]
+            if not any(row is deleted for deleted in rows)
+        ]
+        self.modified.add("locations")
+
+    def change_distance(self, source, destination, distance):
+        for row in self.routes.get((source, destination), []):
+            _set(row, 2, distance)
+        self.modified.add("routes")
+
+    def _close(self, closure_type, name1, name2, closure_start, closure_end):
+        key = (closure_type, name1, name2)
+        if key not in self.closures:
+            row = [closure_type, name1, name2, closure_start, closure_end]
+            self.tables["closures"].append(row)
+            self.closures[key] = [row]
+        else:
+            for row in self.closures[key]:
+                _set(row, 3, closure_start)
+                _set(row, 4, closure_end)
+        self.modified.add("closures")
+
+    def close_camp(self, camp_name, country, closure_start=0, closure_end=-1):
+        self._close("location", camp_name, country,
+                    closure_start, closure_end)
+
+    def close_border(self, country1, country2, closure_start=0,
+                     closure_end=-1):
+        self._close("country", country1, country2,
+                    closure_start, closure_end)
+
+    def redirect(self, source, destination):
+        for row in self.locations.get(source, []):
+            _set(row, 5, "forwarding_hub")
+        for row in self.routes.get((source, destination), []):
+            _set(row, 3, "2")
+        for row in self.routes.get((destination, source), []):
+            _set(row, 3, "1")
+        self.modified.update(["locations", "routes"])
+
+    def apply(self, command):
+        """
+        Apply a single refinement command (see parse_command).
+        Commands which do not edit the scenario files, e.g. load_conflict,
+        are ignored.
+        """
+        name, args, kwargs = parse_command(command)
+        if name not in EDIT_COMMANDS:
+            return False
+        getattr(self, name)(*args, **kwargs)
+        return True
+
+    def apply_all(self, commands):
+        return [command for command in commands if self.apply(command)]
+
+    def write(self, out_dir=None, all_files=False):
+        """
+        Write the modified csv files (or all of them) to out_dir, which
+        defaults to the conflict directory that was read.
+        """
+        if out_dir is None:
+            out_dir = self.conflict_dir
+        os.makedirs(out_dir, exist_ok=True)
+        for name in SCENARIO_FILES:
+            if not all_files and name not in self.modified:
+                continue
+            if len(self.tables[name]) == 0:
+                continue
+            path = os.path.join(out_dir, "{}.csv".format(name))
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerows(self.tables[name])
+
+    def write_sweep(self, sweep_dir, variants):
+        """
+        Write one scenario per variant, i.e. the current tables edited by
+        the commands of that variant, to <sweep_dir>/<variant>/input_csv.
+        variants is a dict of variant name -> list of commands.
+        """
+        for variant, commands in variants.items():
+            editor = self.copy()
+            editor.apply_all(commands)
+            editor.write(os.path.join(sweep_dir, str(variant), "input_csv"),
+                         all_files=True)
+
+
+def read_commands(commands_file):
+    """
+    Read a list of commands, one per line, e.g. from commands.log.txt.
+    """
+    with open(commands_file) as f:
+        return [line.strip() for line in f
+                if len(line.strip()) > 0 and not line.startswith("#")]
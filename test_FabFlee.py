@@ -210,3 +210,160 @@ def test_clear_active_conflict():     # fab localhost test_clear_active_conflict
   else:
     print("test_clear_active_conflict: False")
     return False
+
+
+@task
+def test_import_time(budget="2.0"):    # fab localhost test_import_time
+  # importing the FabFlee plugin, i.e. registering its tasks, should not load
+  # the heavy analysis libraries, and should stay within the time budget (in
+  # seconds, on top of the FabSim3 base import).
+  import subprocess
+  heavy_modules = ["numpy", "pandas", "scipy", "matplotlib", "chaospy",
+                   "easyvvuq"]
+
+  code = "\n".join([
+    "import sys, time",
+    "try:",
+    "  from fabsim.base.fab import *",
+    "except ImportError:",
+    "  from base.fab import *",
+    "loaded = set(sys.modules)",
+    "start = time.time()",
+    "try:",
+    "  from fabsim.plugins.FabFlee.FabFlee import *",
+    "except ImportError:",
+    "  from plugins.FabFlee.FabFlee import *",
+    "print(time.time() - start)",
+    "print(' '.join(m for m in %r if m in set(sys.modules) - loaded))"
+    % heavy_modules,
+  ])
+  result = subprocess.run([sys.executable, "-c", code], cwd=env.localroot,
+                          capture_output=True, text=True)
+  output = result.stdout.splitlines()
+  if result.returncode != 0 or len(output) < 2:
+    print("importing FabFlee failed (exit code %d):\n%s" % (result.returncode, result.stderr))
+    pr_utest("test_import_time-import_succeeded", False)
+    return
+
+  import_time = float(output[-2])
+  loaded_modules = output[-1].split()
+  print("FabFlee import time: %.2fs, heavy modules loaded: %s" % (import_time, loaded_modules))
+
+  pr_utest("test_import_time-within_budget", import_time <= float(budget))
+  pr_utest("test_import_time-no_heavy_modules", len(loaded_modules) == 0)
+
+
+@task
+def test_shm_coupling(steps="1000", readers="2"):    # fab localhost test_shm_coupling
+  # local stand-in of the macro and micro instances of coupling_type=shm,
+  # without PJ.py or MUSCLE3: one writer and a few reader processes exchange
+  # counts through ShmChannel in lock step, with the readers started before
+  # the writer. A channel left behind by a killed writer is replaced by the
+  # next ShmChannel.create of the same name.
+  import subprocess
+  import uuid
+  shm_dir = "%s/config_files/ssudan-mscale" % (env.fabflee_root)
+  sys.path.insert(0, shm_dir)
+  python_path = [shm_dir]
+  if env.get("flee_location"):
+    sys.path.insert(0, env.flee_location)
+    python_path.append(env.flee_location)
+  from shm_coupling import ShmChannel, channel_name
+
+  steps = int(steps)
+  readers = int(readers)
+  names = ["A", "B", "C"]
+
+  def counts(t):
+    return [t, t + 1, t + 2]
+
+  run_id = uuid.uuid4().hex[:12]
+  code = "\n".join([
+    "import sys",
+    "from shm_coupling import ShmChannel, channel_name",
+    "run_id, i, steps = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])",
+    "channel = ShmChannel.attach(channel_name(run_id, 'out', 0), timeout=60)",
+    "ack = ShmChannel.create(channel_name(run_id, 'in', i), ['t'])",
+    "result = channel.names == %r" % (names),
+    "for t in range(steps):",
+    "  result = result and channel.read(t, timeout=60).tolist() == [t, t + 1, t + 2]",
+    "  ack.write(t, [t])",
+    "channel.close()",
+    "ack.close()",
+    "print(result)",
+  ])
+  environment = dict(os.environ, PYTHONPATH=os.pathsep.join(
+    python_path + [os.environ.get("PYTHONPATH", "")]))
+
+  # a writer killed after a few steps, i.e. its channel is not unlinked
+  stale_name = channel_name(uuid.uuid4().hex[:12], "out", 0)
+  stale = ShmChannel.create(stale_name, ["X"])
+  for t in range(stale.slots):
+    stale.write(t, [2 * t + 1])
+  stale.ring = None
+  stale.shm.close()
+
+  channel = ShmChannel.create(stale_name, names)
+  check = "\n".join([
+    "from shm_coupling import ShmChannel",
+    "channel = ShmChannel.attach(%r, timeout=10)" % (stale_name),
+    "print(channel.names == %r and not channel.ring.any())" % (names),
+    "channel.close()",
+  ])
+  result = subprocess.run([sys.executable, "-c", check], env=environment,
+                          capture_output=True, text=True)
+  channel.close()
+  if result.returncode != 0:
+    print("shm coupling check failed (exit code %d):\n%s" % (result.returncode, result.stderr))
+  pr_utest("test_shm_coupling-stale_channel_replaced", result.stdout.strip() == "True")
+
+  processes = [
+    subprocess.Popen([sys.executable, "-c", code, run_id, str(i), str(steps)],
+                     env=environment, stdout=subprocess.PIPE,
+                     stderr=subprocess.PIPE, text=True)
+    for i in range(readers)
+  ]
+
+  channel = ShmChannel.create(channel_name(run_id, "out", 0), names)
+  acks = [ShmChannel.attach(channel_name(run_id, "in", i), timeout=60) for i in range(readers)]
+  for t in range(steps):
+    channel.write(t, counts(t))
+    for ack in acks:
+      ack.read(t, timeout=60)
+  test_result = True
+  for p in processes:
+    stdout, stderr = p.communicate()
+    if p.returncode != 0 or stdout.strip() != "True":
+      print("shm coupling reader failed (exit code %d):\n%s" % (p.returncode, stderr))
+      test_result = False
+  for ack in acks:
+    ack.close()
+  channel.close()
+
+  pr_utest("test_shm_coupling-exchanged_counts", test_result)
+
+  try:
+    ShmChannel.attach(channel_name(uuid.uuid4().hex[:12], "out", 0), timeout=0.1)
+    test_result = False
+  except TimeoutError:
+    test_result = True
+  pr_utest("test_shm_coupling-attach_timeout", test_result)
+
+  if os.path.isdir("/dev/shm"):
+    left = [f for f in os.listdir("/dev/shm") if f.startswith("flee_%s" % (run_id))]
+    pr_utest("test_shm_coupling-no_segments_left", len(left) == 0)
+
+
+@task
+def test_run_utils_copies():    # fab localhost test_run_utils_copies
+  # the copies of config_files/run_utils.py in the config directories must
+  # not drift from it; fab localhost sync_run_utils updates them.
+  import filecmp
+  import glob
+  master = "%s/config_files/run_utils.py" % (env.fabflee_root)
+  copies = glob.glob("%s/config_files/**/run_utils.py" % (env.fabflee_root), recursive=True)
+  drifted = [path for path in copies if not filecmp.cmp(master, path, shallow=False)]
+  for path in drifted:
+    print("%s differs from %s" % (path, master))
+
+  pr_utest("test_run_utils_copies-identical", len(drifted) == 0)